@@ -1,14 +1,17 @@
-import csv
 import os
 import queue
 import threading
 import cv2
-import requests
-import shutil
 import olympe
-import json
 import datetime
+from concurrent.futures import Future
 from olympe.messages.ardrone3.PilotingState import PositionChanged
+from AnafiMediaDownloader import AnafiMediaDownloader
+from AnafiMediaCatalog import AnafiMediaCatalog
+from AnafiCaptureTracker import AnafiCaptureTracker
+from AnafiFrameSlot import AnafiFrameSlot
+from AnafiFrameChannel import AnafiFrameChannel
+from AnafiStreamStats import AnafiStreamStats
 #from olympe.video.renderer import PdrawRenderer
 
 from olympe.messages.camera import (
@@ -21,7 +24,6 @@ from olympe.messages.camera import (
 	photo_progress,
 	start_recording,
 	stop_recording,
-	recording_progress,
 )
 
 # << Camera Photo, Recording and Stream Methods >>			
@@ -49,6 +51,26 @@ class AnafiCameraMedia:
 		the drone's current camera mode (None, photo, recording, streaming)
 	media_id_list
 		A list of media id's of all media saved this mission
+	downloader : AnafiMediaDownloader
+		the pooled, resumable downloader used for every media download
+	catalog : AnafiMediaCatalog
+		the persistent catalog of every media taken and downloaded, stored in download_dir
+	mission_run : str
+		the mission run recorded in the catalog for media taken by this instance
+	mission_started : datetime
+		the start of the mission run, media captured before it belong to other runs
+	capture_tracker : AnafiCaptureTracker
+		the background listener resolving capture futures from the camera progress events
+	last_media_id : str
+		the media id of the last saved photo or recording
+	frame_slot : AnafiFrameSlot
+		the in-memory latest live stream frame, served as the live preview
+	preview_interval : int
+		a frame out of every {preview_interval} is published to {frame_slot}
+	frame_channel : AnafiFrameChannel
+		the bounded queue of decoded stream frames, created by setup_stream()
+	h264_stats : AnafiStreamStats
+		the sliding window statistics of the h264 stream (fps, bitrate, keyframe interval, jitter)
 		
 	Methods
 	-------
@@ -56,6 +78,10 @@ class AnafiCameraMedia:
 		Prepares the drone camera for photos, and changes camera_mode to "photo"
 	take_photo()
 		Takes a photo
+	take_photo_async(timeout)
+		Takes a photo and returns a future of its media id without waiting for it to be saved
+	wait_camera_ready(timeout)
+		Waits until the camera can take the next photo
 	start_lapse_photo()
 		Starts to take time/gps lapse photos
 	stop_lapse_photo()
@@ -66,12 +92,18 @@ class AnafiCameraMedia:
 		Starts a recording
 	stop_recording()
 		Stops current recording
+	stop_recording_async()
+		Stops current recording and returns a future of its media id
 	add_last_media()
 		Adds the media id of the last media taken to the media list
 	download_media(self, media_id, name, path):
 		Downloads the given media with the given download name at the given location
 	download_last_media(name, path)
 		Downloads the last media taken at the given download name at the given location
+	download_medias(media_ids, path)
+		Downloads all the resources of the given medias in parallel at the given location
+	sync_media(path)
+		Downloads every media on the drone that is not already present locally
 	setup_stream(value, record, yuv_frame_processing, yuv_frame_cb, h264_frame_cb, start_cb, end_cb, flush_cb)
 		Prepares the drone camera for streaming, and changes camera_mode to "streaming"
 	start_stream()
@@ -107,6 +139,15 @@ class AnafiCameraMedia:
 		self.download_dir = download_dir
 		self.camera_mode = "None"
 		self.media_id_dict = {}
+		self.downloader = AnafiMediaDownloader(self.drone_url)
+		self.catalog = AnafiMediaCatalog(os.path.join(self.download_dir, "media_catalog.db"))
+		self.mission_started = datetime.datetime.now()
+		self.mission_run = self.mission_started.strftime("%Y%m%d_%H%M%S")
+		self.last_media_id = None
+		self.capture_tracker = AnafiCaptureTracker(self.drone)
+		self.capture_tracker.subscribe()
+		self.frame_slot = AnafiFrameSlot()
+		self.preview_interval = 5
 	
 	# << Photo Methods >>
 	def setup_photo(self,
@@ -161,14 +202,73 @@ class AnafiCameraMedia:
 	
 	def take_photo(self):
 		'''
-		Takes a photo
+		Takes a photo and waits until it is saved
+		
+		Return
+		----------
+		media_id : str
+			the id of the photo
 		'''
-			
-		self.media_saved = self.drone(photo_progress(result="photo_saved", _policy="wait"))
-		self.drone(take_photo(cam_id=0)).wait()
-		self.media_saved.wait()
-		self.add_last_media()
+		
+		media_id = self.take_photo_async().result()
 		print("< Take Photo >")
+		return media_id
+
+	def take_photo_async(self, timeout = 10):
+		'''
+		Takes a photo without waiting for it to be saved. Only waits if the camera is still
+		busy with the previous photo, the media is added to the media list once it is saved.
+		
+		Parameters
+		----------
+		timeout : float, optional
+			the time in seconds to wait for the camera to be ready (default = 10)
+		
+		Return
+		----------
+		media_future : concurrent.futures.Future
+			a future resolved with the media id of the photo once it is saved
+		'''
+		
+		if not self.capture_tracker.wait_camera_ready(timeout):
+			raise RuntimeError("Camera still busy after {}s".format(timeout))
+		data = self.getMediaData()
+		saved = self.capture_tracker.expect_photo()
+		if not self.drone(take_photo(cam_id=0)).wait().success():
+			self.capture_tracker.cancel(saved, RuntimeError("take_photo command failed"))
+		return self._chain_media_future(saved, data)
+
+	def wait_camera_ready(self, timeout = None):
+		'''
+		Waits until the camera can take the next photo
+		
+		Parameters
+		----------
+		timeout : float, optional
+			the time in seconds to wait, waits forever if None (default = None)
+		
+		Return
+		----------
+		ready : bool
+			True if the camera is ready, False if {timeout} expired
+		'''
+		
+		return self.capture_tracker.wait_camera_ready(timeout)
+
+	def _chain_media_future(self, saved, data):
+		media_future = Future()
+		def on_saved(future):
+			try:
+				media_id = future.result()
+			except Exception as e:
+				media_future.set_exception(e)
+				return
+			self.media_id_dict[media_id] = data
+			self.catalog.record(media_id, data, mission_run = self.mission_run)
+			self.last_media_id = media_id
+			media_future.set_result(media_id)
+		saved.add_done_callback(on_saved)
+		return media_future
 	
 	def start_lapse_photo(self):
 		'''	
@@ -236,19 +336,38 @@ class AnafiCameraMedia:
 		Starts a recording
 		'''
 		
-		self.media_saved = self.drone(recording_progress(result="stopped", _policy="wait"))
 		self.drone(start_recording(cam_id=0)).wait()
 		print ("< Recording Started >")
 
 	def stop_recording(self):
 		'''
-		Stops current recording
+		Stops current recording and waits until it is saved
+		
+		Return
+		----------
+		media_id : str
+			the id of the recording
 		'''
 		
-		self.drone(stop_recording(cam_id=0)).wait()
-		self.media_saved.wait()	
-		self.add_last_media()
+		media_id = self.stop_recording_async().result()
 		print("< Recording Stopped >")
+		return media_id
+
+	def stop_recording_async(self):
+		'''
+		Stops current recording without waiting for it to be saved
+		
+		Return
+		----------
+		media_future : concurrent.futures.Future
+			a future resolved with the media id of the recording once it is saved
+		'''
+		
+		data = self.getMediaData()
+		saved = self.capture_tracker.expect_recording()
+		if not self.drone(stop_recording(cam_id=0)).wait().success():
+			self.capture_tracker.cancel(saved, RuntimeError("stop_recording command failed"))
+		return self._chain_media_future(saved, data)
 
 	# << Photo & Recording Download Methods >>
 	
@@ -265,6 +384,8 @@ class AnafiCameraMedia:
 		media_id = self.media_saved.received_events().last().args["media_id"]
 		data = self.getMediaData()
 		self.media_id_dict[media_id] = data
+		self.catalog.record(media_id, data, mission_run = self.mission_run)
+		self.last_media_id = media_id
 		return media_id
 
 	def download_media(self, media_id, name=None, path=None,folderName=None):
@@ -277,7 +398,8 @@ class AnafiCameraMedia:
 			the media to download
 		name : str, optional
 			the name of the file to be downloaded, if None is provided it will use the 
-			resource id instead
+			resource id instead. If the media has several resources the resource index
+			is appended to the name
 		path : str, optional
 			the name of the location to download the file at, if None is provided it will
 			default to self.download_dir
@@ -285,48 +407,73 @@ class AnafiCameraMedia:
 		Return
 		----------
 		download_path : str
-			the location of the downloaded image
+			the location of the last downloaded resource of the media
 		'''
 		
-		media_info_response = requests.get(self.drone_media_api_url + media_id)
-		media_info_response.raise_for_status()
-
-		# self.download_dir = f'/home/icicle/icicleEdge/local.softwarepilotservice/static/{folderName}/'
-
-		# if folderName is None:
-		# 	self.download_dir = '/home/icicle/icicleEdge/local.softwarepilotservice/static/'
-
-		# os.mkdir(self.download_dir)
-		# Download the photo
-		for resource in media_info_response.json()["resources"]:
-			image_response = requests.get(self.drone_url + resource["url"], stream=True)
-			if path == None:
-				if name == None:
-					download_path = os.path.join(self.download_dir, resource["resource_id"])
-				else:
-					download_path = os.path.join(self.download_dir, name)
-			else:
-				if name == None:
-					download_path = os.path.join(path, resource["resource_id"])
-				else:
-					download_path = os.path.join(path, name)
-			image_response.raise_for_status()
-
-			# print(download_path)
-			# os.mkdir(self.download_dir)
-			with open(download_path, "wb") as image_file:
-				shutil.copyfileobj(image_response.raw, image_file)
-			
-			# with open(f"static/", "wb") as image_file:
-			# 	shutil.copyfileobj(image_response.raw, image_file)
-
-			# #save media data
-			# data = self.media_id_dict[media_id]
-			# with open("static/photo_data.json", 'w') as coord_json:
-			# 	json.dump(data, coord_json)
-
+		download_paths = self.downloader.download(
+			self.downloader.resource_jobs(media_id, name, path, self.download_dir)
+		)
+		self.catalog.mark_downloaded(media_id, download_paths)
 		print("< Media Downloaded >")
-		return download_path
+		return download_paths[-1]
+
+	def download_medias(self, media_ids = None, path = None):
+		'''
+		Downloads all the resources of the given medias in parallel at the given location.
+		Files that are already fully downloaded are skipped and partial downloads are resumed.
+		
+		Parameters
+		----------
+		media_ids : str[], optional
+			the medias to download, if None is provided it will download every media of {media_id_dict}
+		path : str, optional
+			the name of the location to download the files at, if None is provided it will
+			default to self.download_dir
+		
+		Return
+		----------
+		download_paths : dict
+			the locations of the downloaded files of each media id
+		'''
+		
+		if media_ids is None:
+			media_ids = list(self.media_id_dict.keys())
+
+		jobs = []
+		owners = []
+		for media_id in media_ids:
+			media_jobs = self.downloader.resource_jobs(media_id, None, path, self.download_dir)
+			jobs.extend(media_jobs)
+			owners.extend([media_id] * len(media_jobs))
+
+		download_paths = {media_id: [] for media_id in media_ids}
+		for media_id, download_path in zip(owners, self.downloader.download(jobs)):
+			download_paths[media_id].append(download_path)
+		for media_id, paths in download_paths.items():
+			self.catalog.mark_downloaded(media_id, paths)
+		print("< Medias Downloaded >")
+		return download_paths
+
+	def sync_media(self, path = None):
+		'''
+		Downloads every media on the drone that is not already present locally according
+		to the media catalog. Repeated calls only transfer media taken since the last sync.
+		
+		Parameters
+		----------
+		path : str, optional
+			the name of the location to download the files at, if None is provided it will
+			default to self.download_dir
+		
+		Return
+		----------
+		download_paths : dict
+			the locations of the newly downloaded files of each media id
+		'''
+		
+		return self.catalog.sync(
+			self.downloader, self.download_dir if path is None else path, self.mission_run, self.mission_started
+		)
 	
 	def download_last_media(self, name = None, path = None):
 		'''
@@ -347,9 +494,7 @@ class AnafiCameraMedia:
 			the location of the downloaded image
 		'''
 		
-		# Get Photo Media ID
-		media_id = self.media_saved.received_events().last().args["media_id"]
-		return self.download_media(media_id, name, path)
+		return self.download_media(self.last_media_id, name, path)
 	
 	# << Stream Methods >>
 	def setup_stream(self,
@@ -361,6 +506,9 @@ class AnafiCameraMedia:
 		start_cb = "None",
 		end_cb = "None",
 		flush_cb = "None",
+		frame_queue_size = 4,
+		frame_policy = "drop_oldest",
+		h264_stats_path = "static/h264_stats.csv",
 	):
 		'''
 		Prepares the drone camera for streaming, and changes camera_mode to "streaming"
@@ -376,13 +524,13 @@ class AnafiCameraMedia:
 			if true the drone sends a recording of the videos (default = False)
 		yuv_frame_processing : method, optional
 			a callback for live video processing
-			default: saves each yuv frame as an image from a frame queue
+			default: publishes the yuv frames from a frame queue to the live preview frame slot
 		yuv_frame_cb : method, optional
 			a callack to prepare live video processing
 			default: sends each yuv frame to a frame queue
 		h264_frame_cb : method, optional
 			a callback for h264 frame processing
-			default: saves bitrate and framerate information
+			default: updates the h264 stream statistics
 		start_cb : method, optional
 			a callback for the start of the stream
 			default: pass
@@ -392,21 +540,24 @@ class AnafiCameraMedia:
 		flush_cb: method, optional
 			a callback to flush the frame queue
 			default: flushes the frame queue
+		frame_queue_size : int, optional
+			the maximum number of decoded frames waiting to be processed (default = 4)
+		frame_policy : str, optional
+			what happens to a new frame when the frame queue is full (default = "drop_oldest")
+			- "drop_oldest"/"keep_latest"/"block"
+		h264_stats_path : str, optional
+			the csv file the h264 stream statistics are flushed to once per second from
+			a background thread, None to keep them in memory only (default = "static/h264_stats.csv")
 		'''
 		
 		yuv_frame_processing, yuv_frame_cb, h264_frame_cb, start_cb, end_cb, flush_cb = self.cb_helper(
 			yuv_frame_processing, yuv_frame_cb, h264_frame_cb, start_cb, end_cb, flush_cb
 		)	
 	
-		if h264_frame_cb == self.h264_frame_cb:
-			self.h264_frame_stats = []
-			self.h264_stats_file = open("static/h264_stats.csv", "w+")
-			self.h264_stats_writer = csv.DictWriter(
-			    self.h264_stats_file, ["fps", "bitrate"]
-			)
-			self.h264_stats_writer.writeheader()
+		self.h264_stats = AnafiStreamStats()
+		self.h264_stats_path = h264_stats_path if h264_frame_cb == self.h264_frame_cb else None
 
-		self.frame_queue = queue.Queue()
+		self.frame_channel = AnafiFrameChannel(frame_queue_size, frame_policy)
 		self.processing_thread = threading.Thread(target= yuv_frame_processing)
 		self.renderer = None
 		self.frame_counter = 0
@@ -451,6 +602,8 @@ class AnafiCameraMedia:
 		self.drone.streaming.start()
 		#self.renderer = PdrawRenderer(pdraw=self.drone.streaming)
 		self.running = True
+		if self.h264_stats_path is not None:
+			self.h264_stats.start_flush(self.h264_stats_path)
 		self.processing_thread.start()
 		print("< Stream Started >")
 
@@ -460,6 +613,8 @@ class AnafiCameraMedia:
 		#if self.renderer is not None:
 		#	self.renderer.stop()
 		assert self.drone.streaming.stop()
+		self.frame_channel.flush()
+		self.h264_stats.stop_flush()
 		print("< Stream Stopped >")
 
 	def yuv_frame_cb(self, yuv_frame):
@@ -469,54 +624,56 @@ class AnafiCameraMedia:
 		:type yuv_frame: olympe.VideoFrame
 		"""
 		
-		yuv_frame.ref()
-		self.frame_queue.put_nowait(yuv_frame)
+		self.frame_channel.put(yuv_frame)
 		
 	def yuv_frame_processing(self):
 		while self.running:
 			try:
-				yuv_frame = self.frame_queue.get(timeout=0.1)
-				self.frame_counter += 1
+				with self.frame_channel.get(timeout=0.1) as yuv_frame:
+					self.frame_counter += 1
 				
-				if self.frame_counter%20 == 0:
-					data = self.getMediaData()
+					if self.frame_counter % self.preview_interval == 0:
+						data = self.getMediaData()
 					
-					# the VideoFrame.info() dictionary contains some useful information
-					# such as the video resolution
-					info = yuv_frame.info()
-
-					height, width = (  # noqa
-						info["raw"]["frame"]["info"]["height"],
-						info["raw"]["frame"]["info"]["width"],
-					)
-
-					# yuv_frame.vmeta() returns a dictionary that contains additional
-					# metadata from the drone (GPS coordinates, battery percentage, ...)
-
-					# convert pdraw YUV flag to OpenCV YUV flag
-					cv2_cvt_color_flag = {
-						olympe.VDEF_I420: cv2.COLOR_YUV2BGR_I420,
-						olympe.VDEF_NV12: cv2.COLOR_YUV2BGR_NV12,
-					}[yuv_frame.format()]
-
-					cv2frame = cv2.cvtColor(yuv_frame.as_ndarray(), cv2_cvt_color_flag)
-					cv2.imwrite("static/stream.jpg", cv2frame)
-					
-					with open("static/stream_data.json", 'w') as coord_file:
-						json.dump(data, coord_file, default=str)
+						# the VideoFrame.info() dictionary contains some useful information
+						# such as the video resolution
+						info = yuv_frame.info()
+
+						height, width = (  # noqa
+							info["raw"]["frame"]["info"]["height"],
+							info["raw"]["frame"]["info"]["width"],
+						)
+
+						# yuv_frame.vmeta() returns a dictionary that contains additional
+						# metadata from the drone (GPS coordinates, battery percentage, ...)
+
+						# convert pdraw YUV flag to OpenCV YUV flag
+						cv2_cvt_color_flag = {
+							olympe.VDEF_I420: cv2.COLOR_YUV2BGR_I420,
+							olympe.VDEF_NV12: cv2.COLOR_YUV2BGR_NV12,
+						}[yuv_frame.format()]
+
+						# the frame buffer goes back to the pool once unref'd, the slot keeps a copy
+						# and only converts/encodes it when a viewer asks for it
+						self.frame_slot.publish(
+							yuv_frame.as_ndarray().copy(),
+							cv2_cvt_color_flag,
+							{
+								"time": data["time"].isoformat(),
+								"coordinates": data["coordinates"],
+								"frame": self.frame_counter,
+								"width": width,
+								"height": height,
+							},
+						)
 	
 			except queue.Empty:
 				continue
-		# You should process your frames here and release (unref) them when you're done.
-		# Don't hold a reference on your frames for too long to avoid memory leaks and/or memory
-		# pool exhaustion.
-		yuv_frame.unref()
 
 	def flush_cb(self, stream):
 		if stream["vdef_format"] != olympe.VDEF_I420:
 			return True
-		while not self.frame_queue.empty():
-			self.frame_queue.get_nowait().unref()
+		self.frame_channel.flush()
 		return True
 	
 	def start_cb(self):
@@ -535,24 +692,10 @@ class AnafiCameraMedia:
 		# Get a ctypes pointer and size for this h264 frame
 		frame_pointer, frame_size = h264_frame.as_ctypes_pointer()
 
-		# For this example we will just compute some basic video stream stats
-		# (bitrate and FPS) but we could choose to resend it over an another
-		# interface or to decode it with our preferred hardware decoder..
-
-		# Compute some stats and dump them in a csv file
+		# Only cheap constant time work here, this runs on the Olympe video thread:
+		# the statistics are read from the API and flushed to disk by a background thread
 		info = h264_frame.info()
-		frame_ts = info["ntp_raw_timestamp"]
-		if not bool(info["is_sync"]):
-			while len(self.h264_frame_stats) > 0:
-				start_ts, _ = self.h264_frame_stats[0]
-				if (start_ts + 1e6) < frame_ts:
-					self.h264_frame_stats.pop(0)
-				else:
-						break
-			self.h264_frame_stats.append((frame_ts, frame_size))
-			h264_fps = len(self.h264_frame_stats)
-			h264_bitrate = 8 * sum(map(lambda t: t[1], self.h264_frame_stats))
-			self.h264_stats_writer.writerow({"fps": h264_fps, "bitrate": h264_bitrate})
+		self.h264_stats.add(info["ntp_raw_timestamp"], frame_size, bool(info["is_sync"]))
 
 	def getMediaData(self):
 		date_time = datetime.datetime.now()
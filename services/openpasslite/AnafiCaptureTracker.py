@@ -0,0 +1,156 @@
+import threading
+import collections
+import olympe
+from concurrent.futures import Future
+from olympe.messages.camera import photo_progress, recording_progress
+
+# << Photo & Recording Completion Tracking >>
+class AnafiCaptureTracker(olympe.EventListener):
+	'''
+	Background listener resolving capture futures from the camera progress events
+
+	...
+
+	Attributes
+	----------
+	camera_ready : threading.Event
+		set when the camera can take the next photo (the shutter of the previous photo is done)
+	pending_photos : collections.deque
+		the futures of the photos waiting for their "photo_saved" event, oldest first
+	pending_recordings : collections.deque
+		the futures of the recordings waiting for their "stopped" event, oldest first
+
+	Methods
+	-------
+	expect_photo()
+		Returns a future resolved with the media id of the next saved photo
+	expect_recording()
+		Returns a future resolved with the media id of the next stopped recording
+	wait_camera_ready(timeout)
+		Waits until the camera can take the next photo
+	'''
+
+	PHOTO_ERRORS = ("error_no_storage_space", "error_bad_state", "error")
+	RECORDING_ERRORS = ("stopped_no_storage_space", "stopped_storage_too_slow", "error_bad_state", "error", "stopped_system_reconfigured")
+
+	def __init__(self, drone_object):
+		'''
+		Parameters
+		----------
+		drone_object : olympe.Drone
+			the drone object
+		'''
+
+		super().__init__(drone_object)
+		self.lock = threading.Lock()
+		self.camera_ready = threading.Event()
+		self.camera_ready.set()
+		self.pending_photos = collections.deque()
+		self.pending_recordings = collections.deque()
+
+	def expect_photo(self):
+		'''
+		Returns a future resolved with the media id of the next saved photo.
+		Must be called before the take_photo command is sent.
+
+		Return
+		----------
+		future : concurrent.futures.Future
+			the future of the photo media id
+		'''
+
+		future = Future()
+		with self.lock:
+			self.camera_ready.clear()
+			self.pending_photos.append(future)
+		return future
+
+	def expect_recording(self):
+		'''
+		Returns a future resolved with the media id of the next stopped recording.
+		Must be called before the stop_recording command is sent.
+
+		Return
+		----------
+		future : concurrent.futures.Future
+			the future of the recording media id
+		'''
+
+		future = Future()
+		with self.lock:
+			self.pending_recordings.append(future)
+		return future
+
+	def wait_camera_ready(self, timeout = None):
+		'''
+		Waits until the camera can take the next photo
+
+		Parameters
+		----------
+		timeout : float, optional
+			the time in seconds to wait, waits forever if None (default = None)
+
+		Return
+		----------
+		ready : bool
+			True if the camera is ready, False if {timeout} expired
+		'''
+
+		return self.camera_ready.wait(timeout)
+
+	def cancel(self, future, error):
+		'''
+		Fails a pending future whose command was rejected by the drone
+
+		Parameters
+		----------
+		future : concurrent.futures.Future
+			the future returned by expect_photo() or expect_recording()
+		error : Exception
+			the exception set on the future
+		'''
+
+		with self.lock:
+			for pending in (self.pending_photos, self.pending_recordings):
+				if future in pending:
+					pending.remove(future)
+			if not self.pending_photos:
+				self.camera_ready.set()
+		if not future.done():
+			future.set_exception(error)
+
+	@olympe.listen_event(photo_progress(_policy = "wait"))
+	def on_photo_progress(self, event, scheduler):
+		result = _enum_name(event.args["result"])
+		if result == "photo_taken":
+			self.camera_ready.set()
+		elif result == "photo_saved":
+			self._resolve(self.pending_photos, event.args["media_id"])
+			self.camera_ready.set()
+		elif result in self.PHOTO_ERRORS:
+			self._fail(self.pending_photos, RuntimeError("Photo failed: {}".format(result)))
+			self.camera_ready.set()
+
+	@olympe.listen_event(recording_progress(_policy = "wait"))
+	def on_recording_progress(self, event, scheduler):
+		result = _enum_name(event.args["result"])
+		if result == "stopped":
+			self._resolve(self.pending_recordings, event.args["media_id"])
+		elif result in self.RECORDING_ERRORS:
+			self._fail(self.pending_recordings, RuntimeError("Recording failed: {}".format(result)))
+
+	def _resolve(self, pending, media_id):
+		with self.lock:
+			future = pending.popleft() if pending else None
+		if future is not None and not future.done():
+			future.set_result(media_id)
+
+	def _fail(self, pending, error):
+		with self.lock:
+			future = pending.popleft() if pending else None
+		if future is not None and not future.done():
+			future.set_exception(error)
+
+
+def _enum_name(value):
+	return getattr(value, "name", str(value))
@@ -0,0 +1,98 @@
+import time
+
+class AnafiClock:
+	'''
+	Time source of the missions and control loops, used instead of time.sleep/time.monotonic
+	so a simulated drone (AnafiSimulator) can run them faster than real time
+
+	...
+
+	Attributes
+	----------
+	speed : float
+		the number of clock seconds per real second (1.0 for a real drone)
+
+	Methods
+	-------
+	time()
+		Returns the current clock time in seconds
+	sleep(seconds)
+		Sleeps for {seconds : float} clock seconds
+	wait(event, timeout)
+		Waits for a threading.Event for at most {timeout : float} clock seconds
+	real_seconds(seconds)
+		Converts clock seconds to real seconds
+	'''
+
+	def __init__(self, speed = 1.0):
+		'''
+		Parameters
+		----------
+		speed : float, optional
+			the number of clock seconds per real second (default = 1.0)
+		'''
+
+		if speed <= 0:
+			raise RuntimeError("Illegal clock speed")
+		self.speed = speed
+		self.start = time.monotonic()
+
+	def time(self):
+		'''
+		Returns the current clock time in seconds, monotonic
+
+		Return
+		----------
+		now : float
+			the clock time
+		'''
+
+		return (time.monotonic() - self.start) * self.speed
+
+	def sleep(self, seconds):
+		'''
+		Sleeps for {seconds : float} clock seconds
+
+		Parameters
+		----------
+		seconds : float
+			the clock time to sleep
+		'''
+
+		time.sleep(self.real_seconds(max(0.0, seconds)))
+
+	def wait(self, event, timeout = None):
+		'''
+		Waits for a threading.Event for at most {timeout : float} clock seconds
+
+		Parameters
+		----------
+		event : threading.Event
+			the event to wait for
+		timeout : float, optional
+			the clock time to wait, waits forever if None (default = None)
+
+		Return
+		----------
+		set : bool
+			True if the event is set, False if {timeout} expired
+		'''
+
+		return event.wait(None if timeout is None else self.real_seconds(max(0.0, timeout)))
+
+	def real_seconds(self, seconds):
+		'''
+		Converts clock seconds to real seconds
+
+		Parameters
+		----------
+		seconds : float
+			the clock time
+
+		Return
+		----------
+		seconds : float
+			the real time
+		'''
+
+		return seconds / self.speed
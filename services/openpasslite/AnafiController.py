@@ -3,7 +3,8 @@ import olympe
 from AnafiCamera import AnafiCamera
 from AnafiPiloting import AnafiPiloting
 from AnafiRTH import AnafiRTH
-from olympe.messages.ardrone3.PilotingState import PositionChanged, AttitudeChanged
+from AnafiClock import AnafiClock
+from olympe.messages.ardrone3.PilotingState import PositionChanged, AttitudeChanged, AltitudeChanged
 from olympe.messages.obstacle_avoidance import set_mode, status
 
 class AnafiController:
@@ -22,6 +23,8 @@ class AnafiController:
 		the url used request to make requests from the drone
 	drone : olympe.Drone
 		the drone object
+	clock : AnafiClock
+		the time source of the missions, faster than real time with a simulated drone
 	camera : AnafiCamera
 		the drone camera method interface
 	piloting : AnafiPiloting
@@ -37,6 +40,8 @@ class AnafiController:
 		Breaks current connection with the drone
 	get_drone_coordinates()
 		Returns drone's current gps coordinates
+	get_drone_height()
+		Returns drone's current height above the takeoff point
 	'''	
 	
 	def __init__(self, connection_type = 1, download_dir = "None"):
@@ -65,6 +70,7 @@ class AnafiController:
 			raise RuntimeError("Illegal object parameter")
 
 		self.drone = olympe.Drone(self.drone_ip)
+		self.clock = getattr(self.drone, "clock", None) or AnafiClock()
 		if download_dir == "None":
 			if os.path.isdir("static") == False:			
 				os.mkdir("static")		
@@ -113,6 +119,18 @@ class AnafiController:
 		coordinates = [latitude, longitude, altitude]
 		return coordinates
 
+	def get_drone_height(self):
+		'''
+		Returns the drone's current height above the takeoff point, the gps altitude is above sea level
+		
+		Return
+		----------
+		height : float
+			the height in meters
+		'''
+		
+		return self.drone.get_state(AltitudeChanged)["altitude"]
+
 	def get_drone_orientation(self):
 		'''
 		Returns the drone's current orientation (yaw, pitch, roll)
@@ -0,0 +1,219 @@
+import queue
+import threading
+import collections
+
+# << Live Stream Frame Queue Methods >>
+class AnafiFrameChannel:
+	'''
+	Bounded queue of decoded stream frames. Every frame in the channel or handed out to a
+	consumer holds a reference on its pooled buffer (a lease), released by the FrameLease
+	context manager, so the number of referenced frames never exceeds {maxsize} + consumers.
+
+	...
+
+	Attributes
+	----------
+	maxsize : int
+		the maximum number of frames waiting in the channel
+	policy : str
+		what happens when a frame arrives while the channel is full
+		- "drop_oldest" (the oldest waiting frame is released)
+		- "keep_latest" (only the newest frame is kept, maxsize is 1)
+		- "block" (the stream thread waits up to {block_timeout} for room, then drops the new frame)
+	block_timeout : float
+		the time in seconds the stream thread waits for room with the "block" policy
+
+	Methods
+	-------
+	put(yuv_frame)
+		Leases a frame and adds it to the channel
+	get(timeout)
+		Returns a FrameLease of the oldest waiting frame
+	flush()
+		Releases every waiting frame
+	stats()
+		Returns the channel counters
+	'''
+
+	POLICIES = ("drop_oldest", "keep_latest", "block")
+
+	def __init__(self, maxsize = 4, policy = "drop_oldest", block_timeout = 0.05):
+		'''
+		Parameters
+		----------
+		maxsize : int, optional
+			the maximum number of frames waiting in the channel (default = 4)
+		policy : str, optional
+			the backpressure policy (default = "drop_oldest")
+			- "drop_oldest"/"keep_latest"/"block"
+		block_timeout : float, optional
+			the time in seconds the stream thread waits for room with the "block" policy (default = 0.05)
+		'''
+
+		if policy not in self.POLICIES:
+			raise RuntimeError("Illegal frame policy: {}".format(policy))
+
+		self.policy = policy
+		self.maxsize = 1 if policy == "keep_latest" else maxsize
+		self.block_timeout = block_timeout
+		self.frames = collections.deque()
+		self.lock = threading.Lock()
+		self.not_empty = threading.Condition(self.lock)
+		self.not_full = threading.Condition(self.lock)
+
+		self.leases = 0
+		self.received = 0
+		self.dropped = 0
+		self.delivered = 0
+
+	def put(self, yuv_frame):
+		'''
+		Leases a frame and adds it to the channel, applying the backpressure policy if it is full
+
+		Parameters
+		----------
+		yuv_frame : olympe.VideoFrame
+			the decoded frame
+
+		Return
+		----------
+		queued : bool
+			True if the frame was queued, False if it was dropped
+		'''
+
+		released = []
+		with self.lock:
+			self.received += 1
+			if len(self.frames) >= self.maxsize:
+				if self.policy == "block":
+					self.not_full.wait_for(lambda: len(self.frames) < self.maxsize, self.block_timeout)
+					if len(self.frames) >= self.maxsize:
+						self.dropped += 1
+						return False
+				else:
+					while len(self.frames) >= self.maxsize:
+						released.append(self.frames.popleft())
+						self.dropped += 1
+						self.leases -= 1
+			yuv_frame.ref()
+			self.leases += 1
+			self.frames.append(yuv_frame)
+			self.not_empty.notify()
+
+		for frame in released:
+			frame.unref()
+		return True
+
+	def get(self, timeout = None):
+		'''
+		Returns a FrameLease of the oldest waiting frame, the frame is released when the lease is exited
+
+		Parameters
+		----------
+		timeout : float, optional
+			the time in seconds to wait for a frame, waits forever if None (default = None)
+
+		Return
+		----------
+		lease : FrameLease
+			a context manager yielding the frame
+
+		Raises
+		----------
+		queue.Empty
+			if no frame arrived before {timeout}
+		'''
+
+		with self.lock:
+			if not self.not_empty.wait_for(lambda: len(self.frames) > 0, timeout):
+				raise queue.Empty
+			yuv_frame = self.frames.popleft()
+			self.delivered += 1
+			self.not_full.notify()
+		return FrameLease(self, yuv_frame)
+
+	def flush(self):
+		'''
+		Releases every waiting frame
+		'''
+
+		with self.lock:
+			released = list(self.frames)
+			self.frames.clear()
+			self.leases -= len(released)
+			self.not_full.notify_all()
+		for frame in released:
+			frame.unref()
+
+	def empty(self):
+		with self.lock:
+			return len(self.frames) == 0
+
+	def qsize(self):
+		with self.lock:
+			return len(self.frames)
+
+	def stats(self):
+		'''
+		Returns the channel counters
+
+		Return
+		----------
+		stats : dict
+			the policy, queue depth, outstanding leases and received/dropped/delivered frame counts
+		'''
+
+		with self.lock:
+			return {
+				"policy": self.policy,
+				"maxsize": self.maxsize,
+				"depth": len(self.frames),
+				"outstanding_leases": self.leases,
+				"received": self.received,
+				"dropped": self.dropped,
+				"delivered": self.delivered,
+			}
+
+	def _release(self, yuv_frame):
+		yuv_frame.unref()
+		with self.lock:
+			self.leases -= 1
+
+
+class FrameLease:
+	'''
+	Context manager holding the reference of a frame taken from an AnafiFrameChannel
+
+	...
+
+	Attributes
+	----------
+	frame : olympe.VideoFrame
+		the leased frame, it must not be used after the lease is released
+
+	Methods
+	-------
+	release()
+		Releases the frame reference, called when the context is exited
+	'''
+
+	def __init__(self, channel, frame):
+		self.channel = channel
+		self.frame = frame
+		self.released = False
+
+	def __enter__(self):
+		return self.frame
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+		return False
+
+	def release(self):
+		'''
+		Releases the frame reference, releasing twice does nothing
+		'''
+
+		if not self.released:
+			self.released = True
+			self.channel._release(self.frame)
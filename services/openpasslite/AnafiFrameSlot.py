@@ -0,0 +1,176 @@
+import time
+import asyncio
+import threading
+import cv2
+
+# << Live Preview Frame Methods >>
+class AnafiFrameSlot:
+	'''
+	In-memory slot holding the latest live stream frame. The frame is only converted
+	and JPEG encoded when a viewer asks for it, once per frame whatever the number of viewers.
+
+	...
+
+	Attributes
+	----------
+	jpeg_quality : int
+		the JPEG quality used to encode the frame (0-100)
+	seq : int
+		the sequence number of the latest frame, 0 if no frame was published yet
+
+	Methods
+	-------
+	publish(raw, cv2_cvt_color_flag, metadata)
+		Replaces the latest frame
+	get_jpeg()
+		Returns the latest frame JPEG encoded with its metadata
+	get_metadata()
+		Returns the metadata of the latest frame
+	wait_next(seq, timeout)
+		Waits until a frame newer than {seq : int} is published
+	wait_next_async(seq, timeout)
+		Same as wait_next for asyncio tasks, without holding a thread
+	'''
+
+	def __init__(self, jpeg_quality = 80):
+		'''
+		Parameters
+		----------
+		jpeg_quality : int, optional
+			the JPEG quality used to encode the frame (default = 80)
+		'''
+
+		self.jpeg_quality = jpeg_quality
+		self.seq = 0
+		self.condition = threading.Condition()
+		self.encode_lock = threading.Lock()
+		self._raw = None
+		self._cv2_cvt_color_flag = None
+		self._metadata = None
+		self._jpeg = None
+		self._jpeg_seq = 0
+		# (loop, asyncio.Event) of the tasks waiting in wait_next_async
+		self._async_waiters = []
+
+	def publish(self, raw, cv2_cvt_color_flag = None, metadata = None):
+		'''
+		Replaces the latest frame. Cheap enough to be called from the stream thread:
+		the frame is neither converted nor encoded here.
+
+		Parameters
+		----------
+		raw : numpy.ndarray
+			the frame, it must not be modified afterwards (copy pooled frame buffers before publishing)
+		cv2_cvt_color_flag : int, optional
+			the OpenCV colour conversion flag to BGR, None if {raw} is already BGR
+		metadata : dict, optional
+			the metadata attached to the frame (time, coordinates, ...)
+		'''
+
+		with self.condition:
+			self.seq += 1
+			self._raw = raw
+			self._cv2_cvt_color_flag = cv2_cvt_color_flag
+			self._metadata = dict(metadata or {}, seq = self.seq, published = time.time())
+			self.condition.notify_all()
+			waiters, self._async_waiters = self._async_waiters, []
+		for loop, event in waiters:
+			try:
+				loop.call_soon_threadsafe(event.set)
+			except RuntimeError:
+				# the loop of the viewer is closed
+				pass
+
+	def get_jpeg(self):
+		'''
+		Returns the latest frame JPEG encoded with its metadata, the encoding is cached until the next frame
+
+		Return
+		----------
+		jpeg : bytes
+			the JPEG encoded frame, None if no frame was published yet
+		metadata : dict
+			the metadata of the frame
+		'''
+
+		with self.encode_lock:
+			with self.condition:
+				seq, raw, flag, metadata = self.seq, self._raw, self._cv2_cvt_color_flag, self._metadata
+			if raw is None:
+				return None, None
+			if self._jpeg_seq != seq:
+				bgr = raw if flag is None else cv2.cvtColor(raw, flag)
+				ok, buffer = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+				if not ok:
+					raise RuntimeError("JPEG encoding failed")
+				self._jpeg = buffer.tobytes()
+				self._jpeg_seq = seq
+			return self._jpeg, metadata
+
+	def get_metadata(self):
+		'''
+		Returns the metadata of the latest frame
+
+		Return
+		----------
+		metadata : dict
+			the metadata of the frame, None if no frame was published yet
+		'''
+
+		with self.condition:
+			return self._metadata
+
+	def wait_next(self, seq, timeout = None):
+		'''
+		Waits until a frame newer than {seq : int} is published
+
+		Parameters
+		----------
+		seq : int
+			the sequence number of the last frame seen by the caller
+		timeout : float, optional
+			the time in seconds to wait, waits forever if None (default = None)
+
+		Return
+		----------
+		seq : int
+			the sequence number of the latest frame
+		'''
+
+		with self.condition:
+			self.condition.wait_for(lambda: self.seq > seq, timeout)
+			return self.seq
+
+	async def wait_next_async(self, seq, timeout = None):
+		'''
+		Waits until a frame newer than {seq : int} is published, from an asyncio task.
+		The task waits on an asyncio.Event set by publish, so a viewer doesn't hold a thread
+
+		Parameters
+		----------
+		seq : int
+			the sequence number of the last frame seen by the caller
+		timeout : float, optional
+			the time in seconds to wait, waits forever if None (default = None)
+
+		Return
+		----------
+		seq : int
+			the sequence number of the latest frame
+		'''
+
+		waiter = (asyncio.get_running_loop(), asyncio.Event())
+		with self.condition:
+			if self.seq > seq:
+				return self.seq
+			self._async_waiters.append(waiter)
+		try:
+			await asyncio.wait_for(waiter[1].wait(), timeout)
+		except asyncio.TimeoutError:
+			pass
+		finally:
+			with self.condition:
+				if waiter in self._async_waiters:
+					self._async_waiters.remove(waiter)
+		with self.condition:
+			return self.seq
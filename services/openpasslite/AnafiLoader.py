@@ -0,0 +1,187 @@
+import sys
+import time
+import importlib
+import threading
+
+class AnafiLoader:
+	'''
+	Imports the heavy dependencies of the service (olympe, cv2, the Anafi wrapper chain) on a
+	background thread so the HTTP API is up before they are, and times each import
+
+	...
+
+	Attributes
+	----------
+	subsystems : dict
+		the modules to import (or warm-up methods to call) for each subsystem, in order, {name : list}
+	imports : dict
+		the import time in seconds and number of modules pulled in of each module
+	states : dict
+		the readiness, warm-up time and error of each subsystem
+	started : float
+		the time.perf_counter() the loader was created
+
+	Methods
+	-------
+	start()
+		Starts importing the subsystems in the background
+	wait(subsystem, timeout)
+		Waits until a subsystem is imported
+	module(name)
+		Returns an imported module, waits for its subsystem
+	ready()
+		Returns True once every subsystem is imported
+	checks()
+		Returns the readiness, warm-up time and error of each subsystem
+	report()
+		Returns the import times and the state of the subsystems
+	'''
+
+	def __init__(self, subsystems, before = None):
+		'''
+		Parameters
+		----------
+		subsystems : dict
+			the modules to import (or warm-up methods to call) for each subsystem, in order, {name : list}
+		before : method, optional
+			called on the loader thread before any import (default = None)
+		'''
+
+		self.subsystems = subsystems
+		self.before = before
+		self.imports = {}
+		self.states = {name: {"ready": False, "seconds": None, "error": None} for name in subsystems}
+		self.started = time.perf_counter()
+		self.lock = threading.Lock()
+		self.done = {name: threading.Event() for name in subsystems}
+		self.thread = None
+
+	def start(self):
+		'''
+		Starts importing the subsystems in the background, only once
+		'''
+
+		if self.thread is None:
+			self.thread = threading.Thread(target = self._load, name = "Anafi-Loader", daemon = True)
+			self.thread.start()
+
+	def _load(self):
+		try:
+			if self.before is not None:
+				self.before()
+		except Exception as e:
+			for name in self.subsystems:
+				self._finish(name, 0.0, str(e))
+			print("< Loading Failed : {} >".format(e))
+			return
+		for name, modules in self.subsystems.items():
+			start = time.perf_counter()
+			error = None
+			try:
+				for module in modules:
+					if callable(module):
+						module()
+					else:
+						self._import(module)
+			except Exception as e:
+				error = str(e)
+				print("< Loading Failed : {} : {} >".format(name, e))
+			self._finish(name, time.perf_counter() - start, error)
+
+	def _import(self, name):
+		if name in sys.modules:
+			return
+		modules = len(sys.modules)
+		start = time.perf_counter()
+		importlib.import_module(name)
+		with self.lock:
+			self.imports[name] = {
+				"seconds": round(time.perf_counter() - start, 4),
+				"modules": len(sys.modules) - modules,
+			}
+
+	def _finish(self, name, seconds, error):
+		with self.lock:
+			self.states[name].update(ready = error is None, seconds = round(seconds, 4), error = error)
+		self.done[name].set()
+
+	def wait(self, subsystem, timeout = None):
+		'''
+		Waits until a subsystem is imported, or failed to
+
+		Parameters
+		----------
+		subsystem : str
+			the subsystem name
+		timeout : float, optional
+			the maximum time to wait in seconds, forever if None (default = None)
+
+		Return
+		----------
+		ready : bool
+			True if the subsystem is imported
+		'''
+
+		if subsystem not in self.subsystems:
+			raise RuntimeError("Illegal subsystem")
+		self.start()
+		self.done[subsystem].wait(timeout)
+		with self.lock:
+			return self.states[subsystem]["ready"]
+
+	def module(self, name):
+		'''
+		Returns an imported module, waits for the subsystem importing it
+
+		Parameters
+		----------
+		name : str
+			the module name
+
+		Return
+		----------
+		module : module
+			the imported module
+		'''
+
+		for subsystem, modules in self.subsystems.items():
+			if name in modules:
+				if not self.wait(subsystem):
+					raise RuntimeError("Illegal state : {} failed to load : {}".format(subsystem, self.states[subsystem]["error"]))
+				return sys.modules[name]
+		raise RuntimeError("Illegal module")
+
+	def ready(self):
+		'''
+		Returns True once every subsystem is imported
+		'''
+
+		with self.lock:
+			return all(state["ready"] for state in self.states.values())
+
+	def checks(self):
+		'''
+		Returns the readiness, warm-up time and error of each subsystem
+		'''
+
+		with self.lock:
+			return {name: dict(state) for name, state in self.states.items()}
+
+	def report(self):
+		'''
+		Returns the import times, slowest first, and the state of the subsystems
+
+		Return
+		----------
+		report : dict
+			uptime, import_seconds, imports and subsystems
+		'''
+
+		with self.lock:
+			imports = sorted(self.imports.items(), key = lambda item: item[1]["seconds"], reverse = True)
+			return {
+				"uptime": round(time.perf_counter() - self.started, 4),
+				"import_seconds": round(sum(record["seconds"] for _, record in imports), 4),
+				"imports": [dict(module = name, **record) for name, record in imports],
+				"subsystems": {name: dict(state) for name, state in self.states.items()},
+			}
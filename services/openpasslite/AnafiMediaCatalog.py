@@ -0,0 +1,417 @@
+import os
+import json
+import sqlite3
+import datetime
+import threading
+
+# << Persistent Media Catalog Methods >>
+class AnafiMediaCatalog:
+	'''
+	Persistent catalog of the drone media backed by an embedded sqlite database.
+	Positions and capture times are indexed by an R*Tree so area and time range queries stay fast.
+
+	...
+
+	Attributes
+	----------
+	db_path : str
+		the location of the sqlite database
+	connection : sqlite3.Connection
+		the database connection, shared by every thread behind {lock}
+	has_rtree : bool
+		True if the sqlite build supports the R*Tree spatial index, the lat/lon/time
+		columns are indexed with regular b-tree indexes otherwise
+
+	Methods
+	-------
+	record(media_id, data, resources, mission_run, media_type)
+		Adds or updates a media in the catalog
+	mark_downloaded(media_id, download_paths)
+		Sets the download state of a media to "downloaded"
+	mark_failed(media_id)
+		Sets the download state of a media to "failed"
+	get(media_id)
+		Returns the catalog entry of a media
+	pending(media_ids)
+		Returns the media ids that are not fully present locally
+	query(bbox, start, end, mission_run, media_type, state)
+		Returns the catalog entries matching an area, time range and filters
+	sync(downloader, path, mission_run, since)
+		Downloads every media on the drone that is not already present locally
+	close()
+		Closes the database connection
+	'''
+
+	def __init__(self, db_path):
+		'''
+		Parameters
+		----------
+		db_path : str
+			the location of the sqlite database, it is created if it does not exist
+		'''
+
+		self.db_path = db_path
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(db_path, check_same_thread = False)
+		self.connection.row_factory = sqlite3.Row
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute("PRAGMA synchronous=NORMAL")
+		self._create_tables()
+
+	def _create_tables(self):
+		with self.lock, self.connection:
+			self.connection.execute(
+				"""CREATE TABLE IF NOT EXISTS media (
+					id INTEGER PRIMARY KEY,
+					media_id TEXT UNIQUE NOT NULL,
+					media_type TEXT,
+					resources TEXT NOT NULL DEFAULT '[]',
+					capture_time REAL,
+					latitude REAL,
+					longitude REAL,
+					altitude REAL,
+					mission_run TEXT,
+					download_state TEXT NOT NULL DEFAULT 'pending',
+					download_paths TEXT NOT NULL DEFAULT '[]'
+				)"""
+			)
+			self.connection.execute("CREATE INDEX IF NOT EXISTS media_mission_run ON media (mission_run)")
+			self.connection.execute("CREATE INDEX IF NOT EXISTS media_download_state ON media (download_state)")
+			try:
+				self.connection.execute(
+					"CREATE VIRTUAL TABLE IF NOT EXISTS media_position USING rtree("
+					"id, min_lat, max_lat, min_lon, max_lon, min_time, max_time)"
+				)
+				self.has_rtree = True
+			except sqlite3.OperationalError:
+				self.connection.execute("CREATE INDEX IF NOT EXISTS media_lat_lon ON media (latitude, longitude)")
+				self.connection.execute("CREATE INDEX IF NOT EXISTS media_capture_time ON media (capture_time)")
+				self.has_rtree = False
+
+	def record(self, media_id, data = None, resources = None, mission_run = None, media_type = None):
+		'''
+		Adds or updates a media in the catalog. Fields that are None keep their stored value.
+
+		Parameters
+		----------
+		media_id : str
+			the id of the media
+		data : dict, optional
+			the capture data of the media as returned by AnafiCameraMedia.getMediaData()
+			({"time" : datetime, "coordinates" : [latitude, longitude, altitude]})
+		resources : dict[], optional
+			the media api description of the media resources
+		mission_run : str, optional
+			the mission run the media was captured in
+		media_type : str, optional
+			the media type ("PHOTO"/"VIDEO")
+		'''
+
+		capture_time = latitude = longitude = altitude = None
+		if data is not None:
+			capture_time = _to_timestamp(data.get("time"))
+			coordinates = data.get("coordinates")
+			if coordinates:
+				latitude, longitude, altitude = (list(coordinates) + [None, None, None])[:3]
+
+		resources_json = None if resources is None else json.dumps(resources)
+		with self.lock, self.connection:
+			self.connection.execute(
+				"""INSERT INTO media (media_id, media_type, resources, capture_time, latitude, longitude, altitude, mission_run)
+				VALUES (?, ?, COALESCE(?, '[]'), ?, ?, ?, ?, ?)
+				ON CONFLICT(media_id) DO UPDATE SET
+					media_type = COALESCE(excluded.media_type, media.media_type),
+					resources = COALESCE(?, media.resources),
+					capture_time = COALESCE(excluded.capture_time, media.capture_time),
+					latitude = COALESCE(excluded.latitude, media.latitude),
+					longitude = COALESCE(excluded.longitude, media.longitude),
+					altitude = COALESCE(excluded.altitude, media.altitude),
+					mission_run = COALESCE(excluded.mission_run, media.mission_run)""",
+				(
+					media_id, media_type, resources_json,
+					capture_time, latitude, longitude, altitude, mission_run,
+					resources_json,
+				),
+			)
+			row = self.connection.execute(
+				"SELECT id, capture_time, latitude, longitude FROM media WHERE media_id = ?", (media_id,)
+			).fetchone()
+			if self.has_rtree:
+				self.connection.execute("DELETE FROM media_position WHERE id = ?", (row["id"],))
+				if row["latitude"] is not None and row["longitude"] is not None and row["capture_time"] is not None:
+					self.connection.execute(
+						"INSERT INTO media_position VALUES (?, ?, ?, ?, ?, ?, ?)",
+						(
+							row["id"], row["latitude"], row["latitude"], row["longitude"], row["longitude"],
+							row["capture_time"], row["capture_time"],
+						),
+					)
+
+	def mark_downloaded(self, media_id, download_paths):
+		'''
+		Sets the download state of a media to "downloaded"
+
+		Parameters
+		----------
+		media_id : str
+			the id of the media
+		download_paths : str[]
+			the locations of the downloaded resources
+		'''
+
+		self._set_state(media_id, "downloaded", download_paths)
+
+	def mark_failed(self, media_id):
+		'''
+		Sets the download state of a media to "failed"
+
+		Parameters
+		----------
+		media_id : str
+			the id of the media
+		'''
+
+		self._set_state(media_id, "failed")
+
+	def _set_state(self, media_id, state, download_paths = None):
+		with self.lock, self.connection:
+			self.connection.execute("INSERT OR IGNORE INTO media (media_id) VALUES (?)", (media_id,))
+			if download_paths is None:
+				self.connection.execute(
+					"UPDATE media SET download_state = ? WHERE media_id = ?", (state, media_id)
+				)
+			else:
+				self.connection.execute(
+					"UPDATE media SET download_state = ?, download_paths = ? WHERE media_id = ?",
+					(state, json.dumps(download_paths), media_id),
+				)
+
+	def get(self, media_id):
+		'''
+		Returns the catalog entry of a media
+
+		Parameters
+		----------
+		media_id : str
+			the id of the media
+
+		Return
+		----------
+		entry : dict
+			the catalog entry, None if the media is not in the catalog
+		'''
+
+		with self.lock:
+			row = self.connection.execute("SELECT * FROM media WHERE media_id = ?", (media_id,)).fetchone()
+		return None if row is None else _row_to_entry(row)
+
+	def pending(self, media_ids):
+		'''
+		Returns the media ids that are not fully present locally, either because they
+		were never downloaded or because one of their downloaded files is missing
+
+		Parameters
+		----------
+		media_ids : str[]
+			the media ids to check
+
+		Return
+		----------
+		pending_ids : str[]
+			the media ids that need to be downloaded, in the order of {media_ids}
+		'''
+
+		media_ids = list(media_ids)
+		downloaded = {}
+		with self.lock:
+			for start in range(0, len(media_ids), 500):
+				batch = media_ids[start:start + 500]
+				rows = self.connection.execute(
+					"SELECT media_id, download_paths FROM media WHERE download_state = 'downloaded' AND media_id IN ({})".format(
+						",".join("?" * len(batch))
+					),
+					batch,
+				).fetchall()
+				for row in rows:
+					downloaded[row["media_id"]] = json.loads(row["download_paths"])
+
+		return [
+			media_id for media_id in media_ids
+			if media_id not in downloaded
+			or not downloaded[media_id]
+			or not all(os.path.isfile(p) for p in downloaded[media_id])
+		]
+
+	def query(self, bbox = None, start = None, end = None, mission_run = None, media_type = None, state = None):
+		'''
+		Returns the catalog entries matching an area, time range and filters
+
+		Parameters
+		----------
+		bbox : (float, float, float, float), optional
+			the area as (min_lat, min_lon, max_lat, max_lon)
+		start : datetime or float, optional
+			the earliest capture time
+		end : datetime or float, optional
+			the latest capture time
+		mission_run : str, optional
+			only return media of this mission run
+		media_type : str, optional
+			only return media of this type ("PHOTO"/"VIDEO")
+		state : str, optional
+			only return media in this download state ("pending"/"downloaded"/"failed")
+
+		Return
+		----------
+		entries : dict[]
+			the matching catalog entries ordered by capture time
+		'''
+
+		start = _to_timestamp(start)
+		end = _to_timestamp(end)
+		clauses = []
+		params = []
+		spatial = bbox is not None or start is not None or end is not None
+
+		if spatial and self.has_rtree:
+			min_lat, min_lon, max_lat, max_lon = bbox if bbox is not None else (-90.0, -180.0, 90.0, 180.0)
+			sql = (
+				"SELECT media.* FROM media_position JOIN media ON media.id = media_position.id "
+				"WHERE media_position.max_lat >= ? AND media_position.min_lat <= ? "
+				"AND media_position.max_lon >= ? AND media_position.min_lon <= ? "
+				"AND media_position.max_time >= ? AND media_position.min_time <= ?"
+			)
+			params.extend([
+				min_lat, max_lat, min_lon, max_lon,
+				start if start is not None else -1e18, end if end is not None else 1e18,
+			])
+		else:
+			sql = "SELECT * FROM media WHERE 1"
+			if bbox is not None:
+				min_lat, min_lon, max_lat, max_lon = bbox
+				clauses.append("latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?")
+				params.extend([min_lat, max_lat, min_lon, max_lon])
+			if start is not None:
+				clauses.append("capture_time >= ?")
+				params.append(start)
+			if end is not None:
+				clauses.append("capture_time <= ?")
+				params.append(end)
+
+		if mission_run is not None:
+			clauses.append("media.mission_run = ?")
+			params.append(mission_run)
+		if media_type is not None:
+			clauses.append("media.media_type = ?")
+			params.append(media_type)
+		if state is not None:
+			clauses.append("media.download_state = ?")
+			params.append(state)
+
+		for clause in clauses:
+			sql += " AND " + clause
+		sql += " ORDER BY media.capture_time"
+
+		with self.lock:
+			rows = self.connection.execute(sql, params).fetchall()
+		return [_row_to_entry(row) for row in rows]
+
+	def sync(self, downloader, path, mission_run = None, since = None):
+		'''
+		Downloads every media on the drone that is not already present locally.
+		Media that are already downloaded are skipped without any transfer, a media is only
+		marked downloaded once the size of each of its files matches the drone.
+
+		Parameters
+		----------
+		downloader : AnafiMediaDownloader
+			the downloader used to list and download the drone media
+		path : str
+			the location to download the files at
+		mission_run : str, optional
+			the mission run recorded for the media captured since {since} that have none.
+			Media keep the run they were recorded with when they were captured
+		since : datetime or float, optional
+			the start of {mission_run}, without it no mission run is recorded
+
+		Return
+		----------
+		download_paths : dict
+			the locations of the newly downloaded files of each media id
+		'''
+
+		remote_medias = {media["media_id"]: media for media in downloader.list_medias()}
+		for media_id, media in remote_medias.items():
+			gps = media.get("gps") or {}
+			data = {"time": media.get("datetime")}
+			if gps.get("latitude") is not None and gps.get("longitude") is not None:
+				data["coordinates"] = [gps["latitude"], gps["longitude"], gps.get("altitude")]
+			self.record(media_id, data, media.get("resources"), None, media.get("type"))
+		if mission_run is not None and since is not None:
+			# media captured before the run belong to another one, even if this is their first sync
+			with self.lock, self.connection:
+				self.connection.executemany(
+					"UPDATE media SET mission_run = ? WHERE media_id = ? AND mission_run IS NULL AND capture_time >= ?",
+					[(mission_run, media_id, _to_timestamp(since)) for media_id in remote_medias],
+				)
+
+		pending_ids = self.pending(remote_medias.keys())
+		jobs = []
+		owners = []
+		for media_id in pending_ids:
+			media_jobs = downloader.resource_jobs(media_id, None, path, path, remote_medias[media_id])
+			jobs.extend(media_jobs)
+			owners.extend([media_id] * len(media_jobs))
+
+		download_paths = {media_id: [] for media_id in pending_ids}
+		try:
+			results = downloader.download(jobs)
+		except IOError:
+			# a file left by an earlier failed sync may be partial, only complete files count
+			results = [download_path if _is_complete(resource, download_path) else None for resource, download_path in jobs]
+		for media_id, download_path in zip(owners, results):
+			download_paths[media_id].append(download_path)
+
+		for media_id, paths in download_paths.items():
+			if paths and all(p is not None for p in paths):
+				self.mark_downloaded(media_id, paths)
+			else:
+				self.mark_failed(media_id)
+
+		print("< Media Synced : {} new, {} already present >".format(
+			len(pending_ids), len(remote_medias) - len(pending_ids)
+		))
+		return download_paths
+
+	def close(self):
+		'''
+		Closes the database connection
+		'''
+
+		with self.lock:
+			self.connection.close()
+
+
+def _to_timestamp(value):
+	if value is None or isinstance(value, (int, float)):
+		return value
+	if isinstance(value, datetime.datetime):
+		return value.timestamp()
+	if isinstance(value, str):
+		try:
+			return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+		except ValueError:
+			return None
+	return None
+
+def _is_complete(resource, download_path):
+	# without its size on the drone a file can't be told complete
+	expected_size = resource.get("size")
+	return expected_size is not None and os.path.isfile(download_path) and os.path.getsize(download_path) == expected_size
+
+def _row_to_entry(row):
+	entry = dict(row)
+	entry.pop("id", None)
+	entry["resources"] = json.loads(entry["resources"])
+	entry["download_paths"] = json.loads(entry["download_paths"])
+	return entry
@@ -0,0 +1,288 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# << Pooled Media Download Methods >>
+class AnafiMediaDownloader:
+	'''
+	Parallel, resumable downloader for the drone's media api
+
+	...
+
+	Attributes
+	----------
+	drone_url : str
+		the url used request to make requests from the drone
+	drone_media_api_url : str
+		the complete url used to make media requests from the drone
+	session : requests.Session
+		the persistent http session, its connection pool is shared by every worker
+	max_workers : int
+		the number of resources downloaded at the same time
+	chunk_size : int
+		the number of bytes read from the response at once
+	retries : int
+		the number of times an interrupted transfer is resumed before giving up
+	timeout : float
+		the connect/read timeout in seconds of each request
+	last_report : dict
+		the throughput report of the last call to download()
+
+	Methods
+	-------
+	list_medias()
+		Returns the media api description of every media on the drone
+	get_media_info(media_id)
+		Returns the media api description of the given media
+	resource_jobs(media_id, name, path, default_dir, media_info)
+		Returns the (resource, download_path) pairs of the given media
+	download_resource(resource, download_path)
+		Downloads a single resource, resuming a previous partial transfer if there is one
+	download(jobs)
+		Downloads the given (resource, download_path) pairs in parallel
+	close()
+		Closes the http session
+	'''
+
+	def __init__(self, drone_url, max_workers = 4, chunk_size = 1 << 20, retries = 3, timeout = 10):
+		'''
+		Parameters
+		----------
+		drone_url : str
+			the url used request to make requests from the drone
+		max_workers : int, optional
+			the number of resources downloaded at the same time (default = 4)
+		chunk_size : int, optional
+			the number of bytes read from the response at once (default = 1MiB)
+		retries : int, optional
+			the number of times an interrupted transfer is resumed (default = 3)
+		timeout : float, optional
+			the connect/read timeout in seconds of each request (default = 10)
+		'''
+
+		self.drone_url = drone_url
+		self.drone_media_api_url = self.drone_url + "api/v1/media/medias/"
+		self.max_workers = max_workers
+		self.chunk_size = chunk_size
+		self.retries = retries
+		self.timeout = timeout
+		self.last_report = {}
+
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max_workers)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+		self._bytes_lock = threading.Lock()
+		self._bytes_transferred = 0
+
+	def list_medias(self):
+		'''
+		Returns the media api description of every media on the drone
+
+		Return
+		----------
+		medias : dict[]
+			the media api response, one entry per media with its "media_id" and "resources"
+		'''
+
+		response = self.session.get(self.drone_media_api_url.rstrip("/"), timeout = self.timeout)
+		response.raise_for_status()
+		return response.json()
+
+	def get_media_info(self, media_id):
+		'''
+		Returns the media api description of the given media
+
+		Parameters
+		----------
+		media_id : str
+			the media to describe
+
+		Return
+		----------
+		media_info : dict
+			the media api response, its "resources" list holds the files of the media
+		'''
+
+		response = self.session.get(self.drone_media_api_url + media_id, timeout = self.timeout)
+		response.raise_for_status()
+		return response.json()
+
+	def resource_jobs(self, media_id, name = None, path = None, default_dir = ".", media_info = None):
+		'''
+		Returns the (resource, download_path) pairs of the given media
+
+		Parameters
+		----------
+		media_id : str
+			the media to download
+		name : str, optional
+			the name of the downloaded file, if None is provided it will use the resource id instead.
+			If the media has more than one resource the resource index is appended to the name
+		path : str, optional
+			the location to download the files at, if None is provided it will default to {default_dir : str}
+		default_dir : str, optional
+			the fallback download location
+		media_info : dict, optional
+			the media api description of the media, if None is provided it is requested from the drone
+
+		Return
+		----------
+		jobs : (dict, str)[]
+			the resources of the media and the location each of them is downloaded to
+		'''
+
+		if media_info is None:
+			media_info = self.get_media_info(media_id)
+		resources = media_info["resources"]
+		directory = default_dir if path is None else path
+		jobs = []
+		for index, resource in enumerate(resources):
+			if name is None:
+				file_name = resource["resource_id"]
+			elif len(resources) == 1:
+				file_name = name
+			else:
+				root, ext = os.path.splitext(name)
+				file_name = "{}_{}{}".format(root, index, ext)
+			jobs.append((resource, os.path.join(directory, file_name)))
+		return jobs
+
+	def download_resource(self, resource, download_path):
+		'''
+		Downloads a single resource into "{download_path}.part" and renames it once its size is verified.
+		An existing partial file is resumed with an http Range request, an existing complete file is skipped.
+
+		Parameters
+		----------
+		resource : dict
+			the media api description of the resource (needs "url", optionally "size")
+		download_path : str
+			the location of the downloaded file
+
+		Return
+		----------
+		size : int
+			the size of the downloaded file in bytes
+		'''
+
+		expected_size = resource.get("size")
+		if expected_size is not None and os.path.isfile(download_path) and os.path.getsize(download_path) == expected_size:
+			return expected_size
+
+		part_path = download_path + ".part"
+		attempt = 0
+		while True:
+			try:
+				expected_size = self._transfer(self.drone_url + resource["url"], part_path, expected_size)
+				break
+			except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+				# a transfer cut mid-body is resumed from the partial file like a dropped connection
+				attempt += 1
+				if attempt > self.retries:
+					raise
+				print("< Download Interrupted, Resuming ({}/{}) : {} >".format(attempt, self.retries, e))
+
+		size = os.path.getsize(part_path)
+		if expected_size is not None and size != expected_size:
+			raise IOError("Size mismatch for {}: expected {} bytes, got {}".format(download_path, expected_size, size))
+		os.replace(part_path, download_path)
+		return size
+
+	def _transfer(self, url, part_path, expected_size):
+		offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+		if expected_size is not None and offset == expected_size:
+			return expected_size
+		if expected_size is not None and offset > expected_size:
+			offset = 0
+
+		headers = {"Range": "bytes={}-".format(offset)} if offset > 0 else {}
+		with self.session.get(url, headers = headers, stream = True, timeout = self.timeout) as response:
+			if response.status_code == 416:
+				# the partial file is stale, start over
+				os.remove(part_path)
+				return self._transfer(url, part_path, expected_size)
+			response.raise_for_status()
+
+			if response.status_code == 206:
+				mode = "ab"
+				total = response.headers.get("Content-Range", "").rpartition("/")[2]
+				if expected_size is None and total.isdigit():
+					expected_size = int(total)
+			else:
+				# the server ignored the range, the whole file is sent again
+				mode = "wb"
+				length = response.headers.get("Content-Length")
+				if expected_size is None and length is not None and length.isdigit():
+					expected_size = int(length)
+
+			with open(part_path, mode) as part_file:
+				for chunk in response.iter_content(chunk_size = self.chunk_size):
+					part_file.write(chunk)
+					with self._bytes_lock:
+						self._bytes_transferred += len(chunk)
+		return expected_size
+
+	def download(self, jobs):
+		'''
+		Downloads the given (resource, download_path) pairs in parallel with at most {max_workers : int}
+		transfers at once, and stores the throughput report in {last_report : dict}
+
+		Parameters
+		----------
+		jobs : (dict, str)[]
+			the resources and the location each of them is downloaded to
+
+		Return
+		----------
+		download_paths : str[]
+			the locations of the downloaded files, in the order of {jobs}
+		'''
+
+		with self._bytes_lock:
+			self._bytes_transferred = 0
+		start = time.monotonic()
+		download_paths = [None] * len(jobs)
+		total_size = 0
+		errors = []
+
+		with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+			futures = {
+				executor.submit(self.download_resource, resource, download_path): index
+				for index, (resource, download_path) in enumerate(jobs)
+			}
+			for future in as_completed(futures):
+				index = futures[future]
+				try:
+					total_size += future.result()
+					download_paths[index] = jobs[index][1]
+				except Exception as e:
+					errors.append((jobs[index][1], e))
+
+		elapsed = time.monotonic() - start
+		self.last_report = {
+			"files": len(jobs) - len(errors),
+			"failed": len(errors),
+			"bytes": total_size,
+			"bytes_transferred": self._bytes_transferred,
+			"seconds": elapsed,
+			"mbps": (8 * self._bytes_transferred / 1e6 / elapsed) if elapsed > 0 else 0.0,
+		}
+		print("< {files} Files Downloaded ({bytes_transferred} bytes in {seconds:.1f}s, {mbps:.1f} Mbit/s) >".format(
+			**self.last_report
+		))
+		if errors:
+			raise IOError("Failed to download {} file(s): {}".format(
+				len(errors), ", ".join("{} ({})".format(p, e) for p, e in errors)
+			))
+		return download_paths
+
+	def close(self):
+		'''
+		Closes the http session
+		'''
+
+		self.session.close()
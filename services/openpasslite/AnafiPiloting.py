@@ -12,6 +12,7 @@ from olympe.messages.ardrone3.PilotingState import (
 	PositionChanged,
 	moveToChanged,	
 )
+from AnafiVelocityControl import AnafiVelocityControl
 
 class AnafiPiloting:
 	'''
@@ -25,6 +26,8 @@ class AnafiPiloting:
 		the drone object
 	action_queue : str[]
 		queue of all the actions to be executed
+	velocity_control : AnafiVelocityControl
+		the continuous control loop, None if not started
 		
 	Methods
 	-------
@@ -50,6 +53,12 @@ class AnafiPiloting:
 		clears the {action_queue : str[]}
 	execute_actions(num, a_sync)
 		Executes the first {num : int} actions from {action_queue : str[]} in order.
+	start_velocity_control(rate, **gains)
+		switches to continuous control: setpoints sent at a fixed rate towards the latest target
+	set_velocity_target(x, y, z)
+		replaces the target offset of the continuous control
+	stop_velocity_control()
+		stops the continuous control and hovers
 	'''
 	
 	def __init__(self, drone_object):
@@ -62,6 +71,7 @@ class AnafiPiloting:
 		
 		self.drone = drone_object
 		self.action_queue = []	
+		self.velocity_control = None
 
 	def takeoff(self, queue = False):
 		'''
@@ -143,7 +153,7 @@ class AnafiPiloting:
 		y : float
 			the movement in the y axis, left and right, in meters
 		z : float
-			the movement in the z axis, up and down, in meters
+			the movement in the z axis in meters, positive down as the Olympe moveBy dZ
 		angle : float
 			the rotation in radians
 		wait : bool, optional
@@ -297,4 +307,58 @@ class AnafiPiloting:
 		print(flight_path)
 		print("------ EXECUTE ACTIONS : End ------")
 		eval(flight_path)
-		
+
+	def start_velocity_control(self, rate = 10.0, **gains):
+		'''
+		Switches to continuous control: instead of one moveBy per decision, setpoints are sent
+		at a fixed {rate : float} towards the latest target given to set_velocity_target.
+		Don't mix with move_by/move_to until stop_velocity_control is called.
+
+		Parameters
+		----------
+		rate : float, optional
+			the number of setpoints sent per second (default = 10.0)
+		gains : optional
+			the controller gains and limits, see AnafiVelocityControl
+		'''
+
+		if self.velocity_control is not None and self.velocity_control.running:
+			raise RuntimeError("Illegal state : velocity control already started")
+		self.velocity_control = AnafiVelocityControl(self.drone, rate, **gains)
+		self.velocity_control.start()
+
+	def set_velocity_target(self, x, y, z):
+		'''
+		Replaces the target offset of the continuous control, the latest target wins.
+		Non blocking, can be called at any rate.
+
+		Parameters
+		----------
+		x : float
+			the offset in the x axis, forwards and backwards, in meters
+		y : float
+			the offset in the y axis, left and right, in meters
+		z : float
+			the offset in the z axis in meters, positive up (unlike move_by)
+		'''
+
+		if self.velocity_control is None or not self.velocity_control.running:
+			raise RuntimeError("Illegal state : velocity control not started")
+		self.velocity_control.set_target(x, y, z)
+
+	def stop_velocity_control(self):
+		'''
+		Stops the continuous control and hovers
+
+		Return
+		----------
+		stats : dict
+			the control loop counters, None if it was not started
+		'''
+
+		if self.velocity_control is None:
+			return None
+		self.velocity_control.stop()
+		stats = self.velocity_control.stats()
+		self.velocity_control = None
+		return stats
@@ -0,0 +1,1174 @@
+import os
+import sys
+import json
+import math
+import time
+import types
+import heapq
+import weakref
+import itertools
+import threading
+import collections
+import importlib.abc
+import importlib.machinery
+import cv2
+import numpy as np
+from AnafiClock import AnafiClock
+
+# << Simulated Olympe Backend >>
+# Stand-in for the subset of Olympe used by the Anafi* wrappers and by SoftwarePilot: piloting
+# (TakeOff, Landing, moveBy, moveTo, PCMD), Return To Home, camera photo/recording, state getters,
+# event listeners and the raw video stream, rendered from a synthetic field with a drifting herd.
+# The flight is simple kinematics (straight legs at a constant speed) computed from a clock running
+# ANAFI_SIM_SPEED times faster than real time, missions sleeping through AnafiController.clock
+# finish accordingly faster. The video stream keeps its real frame rate so the stream consumers get
+# the real load.
+#
+# install() must run before anything imports olympe:
+#	ANAFI_SIMULATOR=1          selects the simulator in openpasslite and wildwings
+#	ANAFI_SIM_SPEED            clock seconds per real second (default 100)
+#	ANAFI_SIM_HOME             takeoff location "latitude,longitude"
+#	ANAFI_SIM_FPS              frames per second of the stream (default 30)
+#	ANAFI_SIM_FRAME_SIZE       "widthxheight" of the stream (default 1280x720)
+
+SIM_SPEED = float(os.getenv("ANAFI_SIM_SPEED", "100"))
+SIM_HOME = os.getenv("ANAFI_SIM_HOME", "39.62236389,-82.81881418")
+SIM_FPS = float(os.getenv("ANAFI_SIM_FPS", "30"))
+SIM_FRAME_SIZE = os.getenv("ANAFI_SIM_FRAME_SIZE", "1280x720")
+
+HORIZONTAL_SPEED = 8.0 # m/s of moveBy, moveTo and RTH
+VERTICAL_SPEED = 2.0 # m/s
+YAW_RATE = math.radians(60.0) # rad/s
+TAKEOFF_ALTITUDE = 1.0 # m, hovering height after takeoff
+RTH_MIN_ALTITUDE = 20.0 # m, the drone climbs to it before returning home
+PCMD_SPEED = 15.0 # m/s at 100% roll/pitch
+PCMD_GAZ = 4.0 # m/s at 100% gaz
+PCMD_YAW_RATE = math.radians(90.0) # rad/s at 100% yaw
+BATTERY_MINUTES = 25.0 # flight time of a full battery
+PHOTO_SHUTTER = 0.5 # s until "photo_taken"
+PHOTO_SAVE = 1.5 # s until "photo_saved"
+RECORDING_SAVE = 1.0 # s until a stopped recording is saved
+CAMERA_HFOV = 69.0 # degrees
+METERS_PER_DEGREE = 111320.0
+EVENT_HISTORY = 1000
+
+VDEF_I420 = "I420"
+VDEF_NV12 = "NV12"
+
+# message parameters by module, in the positional order of Olympe
+MESSAGES = {
+	"ardrone3.Piloting": {
+		"TakeOff": (),
+		"Landing": (),
+		"Emergency": (),
+		"moveBy": ("dX", "dY", "dZ", "dPsi"),
+		"moveTo": ("latitude", "longitude", "altitude", "orientation_mode", "heading"),
+		"CancelMoveTo": (),
+		"CancelMoveBy": (),
+		"PCMD": ("flag", "roll", "pitch", "yaw", "gaz", "timestampAndSeqNum"),
+	},
+	"ardrone3.PilotingState": {
+		"FlyingStateChanged": ("state",),
+		"PositionChanged": ("latitude", "longitude", "altitude"),
+		"AttitudeChanged": ("roll", "pitch", "yaw"),
+		"SpeedChanged": ("speedX", "speedY", "speedZ"),
+		"AltitudeChanged": ("altitude",),
+		"moveToChanged": ("latitude", "longitude", "altitude", "orientation_mode", "heading", "status"),
+		"moveByEnd": ("dX", "dY", "dZ", "dPsi", "error"),
+	},
+	"common.CommonState": {
+		"BatteryStateChanged": ("percent",),
+	},
+	"camera": {
+		"set_camera_mode": ("cam_id", "value"),
+		"set_photo_mode": ("cam_id", "mode", "format", "file_format", "burst", "bracketing", "capture_interval"),
+		"set_recording_mode": ("cam_id", "mode", "resolution", "framerate", "hyperlapse"),
+		"set_streaming_mode": ("cam_id", "value"),
+		"take_photo": ("cam_id",),
+		"stop_photo": ("cam_id",),
+		"start_recording": ("cam_id",),
+		"stop_recording": ("cam_id",),
+		"camera_mode": ("cam_id", "mode"),
+		"photo_progress": ("cam_id", "result", "photo_count", "media_id"),
+		"recording_progress": ("cam_id", "result", "media_id"),
+		"reset_zoom": ("cam_id",),
+		"set_zoom_target": ("cam_id", "control_mode", "target"),
+		"reset_alignment_offsets": ("cam_id",),
+		"set_alignment_offsets": ("cam_id", "yaw", "pitch", "roll"),
+		"alignment_offsets": ("cam_id", "current_yaw", "current_pitch", "current_roll"),
+	},
+	"gimbal": {
+		"set_target": (
+			"gimbal_id", "control_mode", "yaw_frame_of_reference", "yaw",
+			"pitch_frame_of_reference", "pitch", "roll_frame_of_reference", "roll",
+		),
+		"attitude": ("gimbal_id", "yaw_relative", "pitch_relative", "roll_relative"),
+	},
+	"rth": {
+		"set_preferred_home_type": ("type",),
+		"set_custom_location": ("latitude", "longitude", "altitude"),
+		"set_auto_trigger_mode": ("mode",),
+		"set_delay": ("delay",),
+		"set_ending_behavior": ("behavior",),
+		"set_ending_hovering_altitude": ("altitude",),
+		"return_to_home": (),
+		"abort": (),
+		"cancel_auto_trigger": (),
+		"state": ("state", "reason"),
+	},
+	"auto_look_at": {
+		"start": ("type",),
+		"stop": (),
+	},
+	"obstacle_avoidance": {
+		"set_mode": ("mode",),
+		"status": ("mode", "state"),
+	},
+}
+
+# events the simulator sends, waiting for any other event succeeds immediately
+EMITTED_EVENTS = {
+	"ardrone3.PilotingState.FlyingStateChanged",
+	"ardrone3.PilotingState.PositionChanged",
+	"ardrone3.PilotingState.AttitudeChanged",
+	"ardrone3.PilotingState.SpeedChanged",
+	"ardrone3.PilotingState.AltitudeChanged",
+	"ardrone3.PilotingState.moveToChanged",
+	"ardrone3.PilotingState.moveByEnd",
+	"common.CommonState.BatteryStateChanged",
+	"camera.camera_mode",
+	"camera.photo_progress",
+	"camera.recording_progress",
+	"rth.state",
+}
+
+_speed = SIM_SPEED
+_aircrafts = {}
+_aircrafts_lock = threading.Lock()
+
+
+# << Messages >>
+class Message:
+	'''
+	Stand-in for an Olympe message, calling it builds the command or the event expectation
+	'''
+
+	def __init__(self, module, name, params = ()):
+		self.module = module
+		self.name = name
+		self.key = "{}.{}".format(module, name)
+		self.params = params
+		self.event = self.key in EMITTED_EVENTS or name.endswith(("Changed", "_progress", "End", "state", "status"))
+
+	def __call__(self, *args, **kwargs):
+		return MessageCall(self, args, kwargs)
+
+	def __rshift__(self, other):
+		return MessageCall(self, (), {}) >> other
+
+	def __repr__(self):
+		return self.key
+
+
+class MessageCall:
+	'''
+	A message with its arguments, {options} are the Olympe "_timeout"/"_policy" arguments
+	'''
+
+	def __init__(self, message, args, kwargs):
+		self.message = message
+		self.args = {}
+		for i, value in enumerate(args):
+			self.args[message.params[i] if i < len(message.params) else "arg{}".format(i)] = value
+		self.options = {}
+		for key, value in kwargs.items():
+			if key.startswith("_"):
+				self.options[key] = value
+			else:
+				self.args[key] = value
+
+	def __rshift__(self, other):
+		return MessageSequence([self]) >> other
+
+	def matches(self, message, args):
+		if message.key != self.message.key:
+			return False
+		return all(key in args and _same(value, args[key]) for key, value in self.args.items())
+
+	def __repr__(self):
+		return "{}({})".format(self.message.key, self.args)
+
+
+class MessageSequence:
+	'''
+	Olympe "a >> b" expression: the steps run in order, an event step waits for the event
+	'''
+
+	def __init__(self, steps):
+		self.steps = steps
+
+	def __rshift__(self, other):
+		return MessageSequence(self.steps + _steps(other))
+
+
+class Event:
+	'''
+	Stand-in for a received Olympe event
+	'''
+
+	def __init__(self, message, args):
+		self.message = message
+		self.args = args
+
+	def __repr__(self):
+		return "{}({})".format(self.message.key, self.args)
+
+
+class EventList:
+	def __init__(self, events):
+		self.events = list(events)
+
+	def last(self):
+		return self.events[-1] if self.events else None
+
+	def __iter__(self):
+		return iter(self.events)
+
+	def __len__(self):
+		return len(self.events)
+
+
+def _steps(expression):
+	if isinstance(expression, Message):
+		return [MessageCall(expression, (), {})]
+	if isinstance(expression, MessageCall):
+		return [expression]
+	if isinstance(expression, MessageSequence):
+		return list(expression.steps)
+	raise RuntimeError("Illegal olympe expression {!r}".format(expression))
+
+def _same(expected, value):
+	if isinstance(expected, str) or isinstance(value, str):
+		return str(getattr(expected, "name", expected)).lower() == str(getattr(value, "name", value)).lower()
+	if isinstance(expected, float) or isinstance(value, float):
+		return math.isclose(float(expected), float(value), abs_tol = 1e-6)
+	return expected == value
+
+
+# << Event Listeners >>
+class EventListener:
+	'''
+	Stand-in for olympe.EventListener: the methods decorated with listen_event are called
+	with (event, scheduler) from the simulator thread once subscribed
+	'''
+
+	def __init__(self, drone, timeout = None):
+		self._drone = drone
+		self._handlers = []
+		for name in dir(type(self)):
+			expectation = getattr(getattr(type(self), name, None), "_listen_event", None)
+			if expectation is not None:
+				self._handlers.append((expectation, getattr(self, name)))
+
+	def subscribe(self):
+		if self not in self._drone._listeners:
+			self._drone._listeners.append(self)
+
+	def unsubscribe(self):
+		if self in self._drone._listeners:
+			self._drone._listeners.remove(self)
+
+	def __enter__(self):
+		self.subscribe()
+		return self
+
+	def __exit__(self, *args):
+		self.unsubscribe()
+
+	def _dispatch(self, event):
+		for expectation, handler in self._handlers:
+			if expectation.matches(event.message, event.args):
+				try:
+					handler(event, None)
+				except Exception as e:
+					print("< Simulator Listener Error : {} >".format(e))
+
+def listen_event(expectation):
+	def decorator(function):
+		function._listen_event = _steps(expectation)[0]
+		return function
+	return decorator
+
+
+# << Expectations >>
+class Expectation:
+	'''
+	Result of drone(expression): the commands are sent in order, an event step waits until the
+	event is received (or is the current state with the default "check_wait" policy)
+	'''
+
+	def __init__(self, aircraft, steps):
+		self.aircraft = aircraft
+		self.steps = steps
+		self.events = []
+		self.result = None
+		self.done = threading.Event()
+		with aircraft.lock:
+			self.since = aircraft.event_seq
+		if all(not step.message.event for step in steps):
+			self._run()
+		else:
+			threading.Thread(target = self._run, name = "Anafi-Simulator-Expectation", daemon = True).start()
+
+	def _run(self):
+		result = True
+		for step in self.steps:
+			if step.message.event:
+				event = self.aircraft.wait_event(step, self.since)
+				if event is None:
+					result = False
+					break
+				self.events.append(event)
+			elif not self.aircraft.command(step):
+				result = False
+				break
+		self.result = result
+		self.done.set()
+
+	def wait(self, timeout = None, _timeout = None):
+		self.aircraft.clock.wait(self.done, timeout if timeout is not None else _timeout)
+		return self
+
+	def success(self):
+		return self.done.is_set() and self.result
+
+	def timedout(self):
+		return not self.done.is_set()
+
+	def received_events(self):
+		return EventList(self.events)
+
+	def __bool__(self):
+		return bool(self.success())
+
+
+# << Video >>
+class VideoFrame:
+	'''
+	Stand-in for olympe.VideoFrame: a rendered I420 frame and its metadata
+	'''
+
+	def __init__(self, yuv, width, height, metadata, timestamp):
+		self.yuv = yuv
+		self.width = width
+		self.height = height
+		self.metadata = metadata
+		self.timestamp = timestamp
+		self.refs = 1
+
+	def ref(self):
+		self.refs += 1
+
+	def unref(self):
+		self.refs -= 1
+
+	def info(self):
+		return {
+			"raw": {"frame": {"info": {"height": self.height, "width": self.width}}},
+			"ntp_raw_timestamp": int(self.timestamp * 1e6),
+		}
+
+	def format(self):
+		return VDEF_I420
+
+	def vmeta(self):
+		return (None, self.metadata)
+
+	def as_ndarray(self):
+		return self.yuv
+
+
+class SimulatedScene:
+	'''
+	Synthetic field seen straight down from the drone: a ground texture and a herd drifting around
+	a point near home
+	'''
+
+	def __init__(self, seed = 0, size = 2048, resolution = 0.25, animals = 12, herd_center = (40.0, 15.0)):
+		rng = np.random.default_rng(seed)
+		self.size = size
+		self.resolution = resolution # meters per texture pixel
+		noise = cv2.resize(rng.random((size // 32, size // 32)).astype(np.float32), (size, size), interpolation = cv2.INTER_CUBIC)
+		detail = rng.random((size, size)).astype(np.float32)
+		shade = 0.75 * noise + 0.25 * detail
+		base = np.array([60, 120, 95], dtype = np.float32) # BGR of dry grass
+		self.texture = np.clip(base * (0.6 + 0.8 * shade[..., None]), 0, 255).astype(np.uint8)
+		self.herd_center = np.array(herd_center, dtype = np.float64)
+		self.offsets = rng.normal(0.0, 5.0, (animals, 2))
+		self.phases = rng.uniform(0, 2 * math.pi, animals)
+		self.background_key = None
+		self.background = None
+
+	def herd(self, t):
+		'''
+		Ground positions (north, east) and headings of the animals at clock time {t}
+		'''
+
+		drift = 20.0 * np.array([math.sin(t / 120.0), math.cos(t / 150.0) - 1.0])
+		wander = 1.5 * np.stack([np.sin(t / 15.0 + self.phases), np.cos(t / 19.0 + self.phases)], axis = 1)
+		return self.herd_center + drift + self.offsets + wander, self.phases + t / 30.0
+
+	def render(self, north, east, up, yaw, t, width, height, hfov = CAMERA_HFOV):
+		'''
+		BGR frame of the camera pointing down from (north, east, up) with heading {yaw}
+		'''
+
+		altitude = max(up, 1.0)
+		mpp = 2 * altitude * math.tan(math.radians(hfov) / 2) / width # ground meters per frame pixel
+		key = (round(north, 2), round(east, 2), round(altitude, 2), round(yaw, 3), width, height)
+		if key != self.background_key:
+			# frame pixel (u, v) -> texture pixel, north is up in the texture
+			c, s = math.cos(yaw), math.sin(yaw)
+			k = mpp / self.resolution
+			m = np.array([
+				[c * k, -s * k, 0.0],
+				[-s * k, -c * k, 0.0],
+			], dtype = np.float64)
+			center = np.array([east / self.resolution, -north / self.resolution]) % self.size
+			m[:, 2] = center - m[:, :2] @ np.array([width / 2, height / 2])
+			self.background = cv2.warpAffine(
+				self.texture, m, (width, height),
+				flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode = cv2.BORDER_WRAP,
+			)
+			self.background_key = key
+		frame = self.background.copy()
+
+		positions, headings = self.herd(t)
+		c, s = math.cos(yaw), math.sin(yaw)
+		for (animal_north, animal_east), heading in zip(positions, headings):
+			dn, de = animal_north - north, animal_east - east
+			forward = c * dn + s * de
+			right = -s * dn + c * de
+			u, v = width / 2 + right / mpp, height / 2 - forward / mpp
+			axes = (max(1, int(1.1 / mpp)), max(1, int(0.5 / mpp)))
+			if -axes[0] <= u <= width + axes[0] and -axes[0] <= v <= height + axes[0]:
+				angle = math.degrees(heading - yaw)
+				cv2.ellipse(frame, (int(u), int(v)), axes, angle, 0, 360, (235, 235, 235), -1)
+				cv2.ellipse(frame, (int(u), int(v)), axes, angle, 0, 360, (30, 30, 30), max(1, axes[1] // 3))
+		return frame
+
+
+class SimulatedStreaming:
+	'''
+	Stand-in for olympe.Drone.streaming: renders the scene at the real frame rate and calls the
+	raw frame callback, optionally recording the stream to a video file
+	'''
+
+	def __init__(self, drone):
+		self.drone = drone
+		self.server_addr = None
+		self.video_path = None
+		self.metadata_path = None
+		self.raw_cb = None
+		self.h264_cb = None
+		self.start_cb = None
+		self.end_cb = None
+		self.flush_raw_cb = None
+		self.thread = None
+		self.running = threading.Event()
+		self.frames = 0
+		self.dropped = 0
+		width, height = SIM_FRAME_SIZE.lower().split("x")
+		self.width, self.height = int(width) & ~1, int(height) & ~1
+		self.fps = SIM_FPS
+
+	def set_output_files(self, video = None, metadata = None, **kwargs):
+		self.video_path = video
+		self.metadata_path = metadata
+
+	def set_callbacks(self, raw_cb = None, h264_cb = None, start_cb = None, end_cb = None, flush_raw_cb = None, **kwargs):
+		self.raw_cb = raw_cb
+		self.h264_cb = h264_cb
+		self.start_cb = start_cb
+		self.end_cb = end_cb
+		self.flush_raw_cb = flush_raw_cb
+
+	def start(self):
+		if self.thread is not None:
+			return True
+		self.running.set()
+		self.thread = threading.Thread(target = self._run, name = "Anafi-Simulator-Stream", daemon = True)
+		self.thread.start()
+		return True
+
+	def stop(self):
+		if self.thread is None:
+			return True
+		self.running.clear()
+		self.thread.join()
+		self.thread = None
+		if self.flush_raw_cb is not None:
+			self.flush_raw_cb({"vdef_format": VDEF_I420})
+		if self.end_cb is not None:
+			self.end_cb()
+		return True
+
+	def _run(self):
+		aircraft = self.drone.aircraft
+		scene = aircraft.scene
+		writer = None
+		if self.video_path is not None:
+			writer = cv2.VideoWriter(self.video_path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (self.width, self.height))
+		metadata = []
+		if self.start_cb is not None:
+			self.start_cb()
+		period = 1.0 / self.fps
+		deadline = time.monotonic()
+		try:
+			while self.running.is_set():
+				now = aircraft.clock.time()
+				with aircraft.lock:
+					(north, east, up), yaw = aircraft.pose(now)
+				with scene_lock(scene):
+					bgr = scene.render(north, east, up, yaw, now, self.width, self.height)
+				if writer is not None:
+					writer.write(bgr)
+				latitude, longitude = aircraft.to_gps(north, east)
+				frame_metadata = {
+					"drone": {"ground_distance": up, "location": {"latitude": latitude, "longitude": longitude, "altitude": up}},
+				}
+				frame = VideoFrame(cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420), self.width, self.height, frame_metadata, now)
+				self.frames += 1
+				if self.metadata_path is not None:
+					metadata.append(dict(frame_metadata, time = now, frame = self.frames))
+				if self.raw_cb is not None:
+					self.raw_cb(frame)
+				frame.unref()
+
+				deadline += period
+				delay = deadline - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+				else:
+					# real frame rate: late frames are skipped, not sent in a burst
+					self.dropped += int(-delay / period)
+					deadline = time.monotonic()
+		finally:
+			if writer is not None:
+				writer.release()
+			if self.metadata_path is not None:
+				with open(self.metadata_path, "w") as file:
+					json.dump(metadata, file)
+
+_scene_locks = weakref.WeakKeyDictionary()
+
+def scene_lock(scene):
+	# one renderer at a time per scene, the background cache is shared
+	return _scene_locks.setdefault(scene, threading.Lock())
+
+
+# << Aircraft >>
+class Leg:
+	'''
+	Straight flight from {start} to {target} (north, east, up in meters from home) at constant speed
+	'''
+
+	def __init__(self, start_time, start, target, start_yaw, target_yaw, duration, state, on_done):
+		self.start_time = start_time
+		self.start = start
+		self.target = target
+		self.start_yaw = start_yaw
+		self.target_yaw = target_yaw
+		self.duration = duration
+		self.state = state
+		self.on_done = on_done
+
+	def at(self, now):
+		f = 1.0 if self.duration <= 0 else min(1.0, max(0.0, (now - self.start_time) / self.duration))
+		position = tuple(a + (b - a) * f for a, b in zip(self.start, self.target))
+		return position, self.start_yaw + (self.target_yaw - self.start_yaw) * f
+
+	def velocity(self, now):
+		if self.duration <= 0 or not self.start_time <= now < self.start_time + self.duration:
+			return (0.0, 0.0, 0.0)
+		return tuple((b - a) / self.duration for a, b in zip(self.start, self.target))
+
+
+class SimulatedAircraft:
+	'''
+	Flight state of a simulated drone shared by the Drone objects of the same ip address, so
+	consecutive missions continue from where the previous one left the drone
+
+	...
+
+	Attributes
+	----------
+	clock : AnafiClock
+		the simulation clock
+	position : tuple
+		(north, east, up) in meters from home at the end of the current leg
+	yaw : float
+		the heading in radians from north
+	flying_state : str
+		landed/takingoff/hovering/flying/landing
+	media : dict[]
+		the photos and recordings taken
+	'''
+
+	def __init__(self, home, clock, scene = None):
+		self.home = home
+		self.clock = clock
+		self.scene = scene if scene is not None else SimulatedScene()
+		self.lock = threading.RLock()
+		self.condition = threading.Condition(self.lock)
+		self.position = (0.0, 0.0, 0.0)
+		self.yaw = 0.0
+		self.flying_state = "landed"
+		self.leg = None
+		self.legs = collections.deque()
+		self.timers = []
+		self.timer_seq = itertools.count()
+		self.events = collections.deque(maxlen = EVENT_HISTORY)
+		self.event_seq = 0
+		self.states = {}
+		self.pending = collections.deque()
+		self.drones = weakref.WeakSet()
+		self.airborne_time = 0.0
+		self.airborne_since = None
+		self.rth = {"type": "takeoff", "location": None, "behavior": "landing", "altitude": 2.0}
+		self.camera = {"mode": "photo", "recording": False}
+		self.media = []
+		self.media_counter = itertools.count(1)
+		self.commands = {
+			"ardrone3.Piloting.TakeOff": self._takeoff,
+			"ardrone3.Piloting.Landing": self._landing,
+			"ardrone3.Piloting.Emergency": self._emergency,
+			"ardrone3.Piloting.moveBy": self._move_by,
+			"ardrone3.Piloting.moveTo": self._move_to,
+			"ardrone3.Piloting.CancelMoveTo": self._cancel_move_to,
+			"ardrone3.Piloting.CancelMoveBy": self._cancel_move_by,
+			"ardrone3.Piloting.PCMD": self._pcmd,
+			"rth.set_preferred_home_type": lambda args, now: self._set_rth("type", args.get("type")),
+			"rth.set_custom_location": lambda args, now: self._set_rth("location", (
+				float(args["latitude"]), float(args["longitude"]), float(args.get("altitude", RTH_MIN_ALTITUDE))
+			)),
+			"rth.set_ending_behavior": lambda args, now: self._set_rth("behavior", args.get("behavior")),
+			"rth.set_ending_hovering_altitude": lambda args, now: self._set_rth("altitude", float(args.get("altitude", 2.0))),
+			"rth.return_to_home": self._return_to_home,
+			"rth.abort": self._hover,
+			"camera.set_camera_mode": self._set_camera_mode,
+			"camera.take_photo": self._take_photo,
+			"camera.start_recording": self._start_recording,
+			"camera.stop_recording": self._stop_recording,
+		}
+		with self.condition:
+			self._emit("ardrone3.PilotingState.FlyingStateChanged", state = self.flying_state)
+		self.thread = threading.Thread(target = self._run, name = "Anafi-Simulator", daemon = True)
+		self.thread.start()
+
+	# << Kinematics >>
+	def pose(self, now):
+		'''
+		Returns ((north, east, up), yaw) at clock time {now}
+		'''
+
+		if self.leg is None:
+			return self.position, self.yaw
+		return self.leg.at(now)
+
+	def to_gps(self, north, east):
+		latitude = self.home[0] + north / METERS_PER_DEGREE
+		longitude = self.home[1] + east / (METERS_PER_DEGREE * math.cos(math.radians(self.home[0])))
+		return latitude, longitude
+
+	def to_local(self, latitude, longitude):
+		north = (float(latitude) - self.home[0]) * METERS_PER_DEGREE
+		east = (float(longitude) - self.home[1]) * METERS_PER_DEGREE * math.cos(math.radians(self.home[0]))
+		return north, east
+
+	def _freeze(self, now):
+		# stop where the drone is now, the pending legs are dropped
+		self.position, self.yaw = self.pose(now)
+		self.leg = None
+		self.legs.clear()
+
+	def _fly(self, now, legs):
+		'''
+		Replaces the flight plan by {legs}: (target, target_yaw, state, on_done) tuples,
+		the duration of each leg comes from the horizontal, vertical and yaw rates
+		'''
+
+		self._freeze(now)
+		self.legs.extend(legs)
+		self._next_leg(now)
+
+	def _next_leg(self, now):
+		if not self.legs:
+			return
+		target, target_yaw, state, on_done = self.legs.popleft()
+		start = self.position
+		horizontal = math.hypot(target[0] - start[0], target[1] - start[1])
+		duration = max(
+			horizontal / HORIZONTAL_SPEED,
+			abs(target[2] - start[2]) / VERTICAL_SPEED,
+			abs(target_yaw - self.yaw) / YAW_RATE,
+		)
+		self._start_leg(Leg(now, start, target, self.yaw, target_yaw, duration, state, on_done))
+
+	def _start_leg(self, leg):
+		self.leg = leg
+		self._set_flying_state(leg.state, leg.start_time)
+		self._schedule(leg.start_time + leg.duration, lambda due: self._end_leg(leg, due))
+
+	def _end_leg(self, leg, due):
+		if self.leg is not leg:
+			return
+		self.position, self.yaw = leg.target, leg.target_yaw
+		self.leg = None
+		if leg.on_done is not None:
+			leg.on_done(due)
+		if self.leg is None:
+			self._next_leg(due)
+
+	def _set_flying_state(self, state, now):
+		if state == self.flying_state:
+			return
+		airborne = state not in ("landed", "emergency")
+		if airborne and self.airborne_since is None:
+			self.airborne_since = now
+		elif not airborne and self.airborne_since is not None:
+			self.airborne_time += now - self.airborne_since
+			self.airborne_since = None
+		self.flying_state = state
+		self._emit("ardrone3.PilotingState.FlyingStateChanged", state = state)
+
+	def _airborne(self):
+		return self.flying_state in ("takingoff", "hovering", "flying")
+
+	# << Commands >>
+	def command(self, call):
+		'''
+		Executes a command message, returns False if the drone rejects it
+		'''
+
+		handler = self.commands.get(call.message.key)
+		with self.condition:
+			result = True if handler is None else handler(call.args, self.clock.time())
+			self.condition.notify_all()
+		return result is not False
+
+	def _takeoff(self, args, now):
+		if self.flying_state != "landed":
+			return True
+		north, east, _ = self.position
+		self._fly(now, [((north, east, TAKEOFF_ALTITUDE), self.yaw, "takingoff", lambda due: self._set_flying_state("hovering", due))])
+
+	def _landing(self, args, now):
+		if self.flying_state == "landed":
+			return True
+		(north, east, _), _ = self.pose(now)
+		self._fly(now, [((north, east, 0.0), self.pose(now)[1], "landing", lambda due: self._set_flying_state("landed", due))])
+
+	def _emergency(self, args, now):
+		self._freeze(now)
+		self.position = (self.position[0], self.position[1], 0.0)
+		self._set_flying_state("landed", now)
+
+	def _hover(self, args, now):
+		if self._airborne():
+			self._freeze(now)
+			self._set_flying_state("hovering", now)
+
+	def _move_by(self, args, now):
+		if not self._airborne():
+			return False
+		if self.leg is not None and self.leg.state == "flying":
+			self._emit("ardrone3.PilotingState.moveByEnd", dX = 0.0, dY = 0.0, dZ = 0.0, dPsi = 0.0, error = "interrupted")
+		(north, east, up), yaw = self.pose(now)
+		dx, dy, dz = float(args.get("dX", 0)), float(args.get("dY", 0)), float(args.get("dZ", 0))
+		dpsi = float(args.get("dPsi", 0))
+		target = (
+			north + math.cos(yaw) * dx - math.sin(yaw) * dy,
+			east + math.sin(yaw) * dx + math.cos(yaw) * dy,
+			max(TAKEOFF_ALTITUDE, up - dz), # moveBy dZ is positive down
+		)
+		def done(due):
+			self._set_flying_state("hovering", due)
+			self._emit("ardrone3.PilotingState.moveByEnd", dX = dx, dY = dy, dZ = dz, dPsi = dpsi, error = "ok")
+		self._fly(now, [(target, yaw + dpsi, "flying", done)])
+
+	def _move_to(self, args, now):
+		if not self._airborne():
+			return False
+		(north, east, up), yaw = self.pose(now)
+		target_north, target_east = self.to_local(args["latitude"], args["longitude"])
+		mode = str(getattr(args.get("orientation_mode", "NONE"), "name", args.get("orientation_mode", "NONE"))).upper()
+		target_yaw = yaw
+		if mode == "TO_TARGET" and math.hypot(target_north - north, target_east - east) > 0.5:
+			target_yaw = math.atan2(target_east - east, target_north - north)
+		elif mode in ("HEADING_START", "HEADING_DURING"):
+			target_yaw = math.radians(float(args.get("heading", 0)))
+		# shortest turn
+		target_yaw = yaw + (target_yaw - yaw + math.pi) % (2 * math.pi) - math.pi
+		status = {key: args.get(key) for key in ("latitude", "longitude", "altitude", "orientation_mode", "heading")}
+		def done(due):
+			self._set_flying_state("hovering", due)
+			self._emit("ardrone3.PilotingState.moveToChanged", status = "DONE", **status)
+		self._emit("ardrone3.PilotingState.moveToChanged", status = "RUNNING", **status)
+		self._fly(now, [((target_north, target_east, max(TAKEOFF_ALTITUDE, float(args["altitude"]))), target_yaw, "flying", done)])
+
+	def _cancel_move_to(self, args, now):
+		self._hover(args, now)
+		self._emit("ardrone3.PilotingState.moveToChanged", status = "CANCELED")
+
+	def _cancel_move_by(self, args, now):
+		self._hover(args, now)
+		self._emit("ardrone3.PilotingState.moveByEnd", dX = 0.0, dY = 0.0, dZ = 0.0, dPsi = 0.0, error = "interrupted")
+
+	def _pcmd(self, args, now):
+		'''
+		Constant body velocity for {piloting_time} seconds, from the roll/pitch/gaz/yaw percentages
+		'''
+
+		if not self._airborne():
+			return False
+		(north, east, up), yaw = self.pose(now)
+		roll, pitch = float(args.get("roll", 0)), float(args.get("pitch", 0))
+		yaw_rate, gaz = float(args.get("yaw", 0)), float(args.get("gaz", 0))
+		duration = float(args.get("piloting_time", 0))
+		self._freeze(now)
+		if duration <= 0 or not (roll or pitch or yaw_rate or gaz):
+			self._set_flying_state("hovering", now)
+			return True
+		forward, right = pitch / 100 * PCMD_SPEED, roll / 100 * PCMD_SPEED
+		target = (
+			north + (math.cos(yaw) * forward - math.sin(yaw) * right) * duration,
+			east + (math.sin(yaw) * forward + math.cos(yaw) * right) * duration,
+			max(0.5, up + gaz / 100 * PCMD_GAZ * duration),
+		)
+		target_yaw = yaw + yaw_rate / 100 * PCMD_YAW_RATE * duration
+		self._start_leg(Leg(now, (north, east, up), target, yaw, target_yaw, duration, "flying",
+			lambda due: self._set_flying_state("hovering", due)))
+
+	def _set_rth(self, key, value):
+		self.rth[key] = value
+
+	def _return_to_home(self, args, now):
+		if not self._airborne():
+			return False
+		(north, east, up), yaw = self.pose(now)
+		if self.rth["type"] == "custom" and self.rth["location"] is not None:
+			home_north, home_east = self.to_local(self.rth["location"][0], self.rth["location"][1])
+		else:
+			home_north, home_east = 0.0, 0.0
+		cruise = max(up, RTH_MIN_ALTITUDE)
+		legs = [
+			((north, east, cruise), yaw, "flying", None),
+			((home_north, home_east, cruise), yaw, "flying", None),
+		]
+		if self.rth["behavior"] == "hovering":
+			def done(due):
+				self._set_flying_state("hovering", due)
+				self._emit("rth.state", state = "available", reason = "finished")
+			legs.append(((home_north, home_east, max(TAKEOFF_ALTITUDE, self.rth["altitude"])), yaw, "flying", done))
+		else:
+			def done(due):
+				self._set_flying_state("landed", due)
+				self._emit("rth.state", state = "available", reason = "finished")
+			legs.append(((home_north, home_east, 0.0), yaw, "landing", done))
+		self._emit("rth.state", state = "in_progress", reason = "user_requested")
+		self._fly(now, legs)
+
+	def _set_camera_mode(self, args, now):
+		self.camera["mode"] = str(args.get("value", "photo"))
+		self._emit("camera.camera_mode", cam_id = 0, mode = self.camera["mode"])
+
+	def _add_media(self, kind, now):
+		media_id = str(10000000 + next(self.media_counter))
+		(north, east, up), _ = self.pose(now)
+		latitude, longitude = self.to_gps(north, east)
+		self.media.append({"media_id": media_id, "type": kind, "time": now, "coordinates": [latitude, longitude, up]})
+		return media_id
+
+	def _take_photo(self, args, now):
+		def taken(due):
+			self._emit("camera.photo_progress", cam_id = 0, result = "photo_taken", photo_count = 1, media_id = "")
+		def saved(due):
+			media_id = self._add_media("photo", due)
+			self._emit("camera.photo_progress", cam_id = 0, result = "photo_saved", photo_count = 1, media_id = media_id)
+		self._schedule(now + PHOTO_SHUTTER, taken)
+		self._schedule(now + PHOTO_SAVE, saved)
+
+	def _start_recording(self, args, now):
+		self.camera["recording"] = True
+		self._emit("camera.recording_progress", cam_id = 0, result = "started", media_id = "")
+
+	def _stop_recording(self, args, now):
+		if not self.camera["recording"]:
+			return False
+		self.camera["recording"] = False
+		def saved(due):
+			media_id = self._add_media("video", due)
+			self._emit("camera.recording_progress", cam_id = 0, result = "stopped", media_id = media_id)
+		self._schedule(now + RECORDING_SAVE, saved)
+
+	# << State and Events >>
+	def get_state(self, message):
+		'''
+		Returns the current state of a state message, raises KeyError if never received
+		'''
+
+		with self.lock:
+			now = self.clock.time()
+			(north, east, up), yaw = self.pose(now)
+			key = message.key
+			if key == "ardrone3.PilotingState.PositionChanged":
+				latitude, longitude = self.to_gps(north, east)
+				return {"latitude": latitude, "longitude": longitude, "altitude": up}
+			if key == "ardrone3.PilotingState.AttitudeChanged":
+				return {"roll": 0.0, "pitch": 0.0, "yaw": (yaw + math.pi) % (2 * math.pi) - math.pi}
+			if key == "ardrone3.PilotingState.SpeedChanged":
+				velocity = self.leg.velocity(now) if self.leg is not None else (0.0, 0.0, 0.0)
+				return {"speedX": velocity[0], "speedY": velocity[1], "speedZ": -velocity[2]}
+			if key == "ardrone3.PilotingState.AltitudeChanged":
+				return {"altitude": up}
+			if key == "common.CommonState.BatteryStateChanged":
+				airborne = self.airborne_time + (now - self.airborne_since if self.airborne_since is not None else 0.0)
+				return {"percent": max(0, int(100 - 100 * airborne / (BATTERY_MINUTES * 60)))}
+			return dict(self.states[key])
+
+	def _emit(self, key, **args):
+		message = _message(key)
+		self.states[key] = dict(args)
+		self.event_seq += 1
+		event = Event(message, args)
+		self.events.append((self.event_seq, event))
+		self.pending.append(event)
+		self.condition.notify_all()
+
+	def wait_event(self, call, since):
+		'''
+		Waits for an event matching {call} received after {since}, or the current state with the
+		default "check_wait" policy. Returns the event, None on timeout
+		'''
+
+		if call.message.key not in EMITTED_EVENTS:
+			return Event(call.message, dict(call.args))
+		policy = call.options.get("_policy", "check_wait")
+		timeout = call.options.get("_timeout")
+
+		def received():
+			for seq, event in self.events:
+				if seq > since and call.matches(event.message, event.args):
+					return event
+			if policy in ("check", "check_wait") and call.message.key in self.states:
+				state = self.get_state(call.message)
+				if call.matches(call.message, state):
+					return Event(call.message, state)
+			return None
+
+		with self.condition:
+			if policy == "check":
+				return received()
+			event = None
+			deadline = None if timeout is None else self.clock.time() + float(timeout)
+			while event is None:
+				event = received()
+				if event is not None:
+					break
+				if deadline is not None:
+					remaining = deadline - self.clock.time()
+					if remaining <= 0:
+						break
+					self.condition.wait(self.clock.real_seconds(remaining))
+				else:
+					self.condition.wait()
+			return event
+
+	def _schedule(self, due, callback):
+		heapq.heappush(self.timers, (due, next(self.timer_seq), callback))
+		self.condition.notify_all()
+
+	def _run(self):
+		# timers (end of legs, photos saved) and the listener callbacks run on this thread
+		while True:
+			with self.condition:
+				now = self.clock.time()
+				while self.timers and self.timers[0][0] <= now:
+					due, _, callback = heapq.heappop(self.timers)
+					try:
+						callback(due)
+					except Exception as e:
+						print("< Simulator Error : {} >".format(e))
+				events = list(self.pending)
+				self.pending.clear()
+				if not events:
+					timeout = self.clock.real_seconds(self.timers[0][0] - now) if self.timers else None
+					self.condition.wait(timeout)
+			for event in events:
+				for drone in list(self.drones):
+					for listener in list(drone._listeners):
+						listener._dispatch(event)
+
+
+def aircraft(ip):
+	'''
+	Returns the simulated aircraft of {ip}, created landed at ANAFI_SIM_HOME on first use
+	'''
+
+	with _aircrafts_lock:
+		if ip not in _aircrafts:
+			home = tuple(float(value) for value in SIM_HOME.split(","))
+			_aircrafts[ip] = SimulatedAircraft(home, AnafiClock(_speed))
+		return _aircrafts[ip]
+
+
+# << Drone >>
+class Drone:
+	'''
+	Stand-in for olympe.Drone
+
+	...
+
+	Attributes
+	----------
+	aircraft : SimulatedAircraft
+		the simulated flight state
+	clock : AnafiClock
+		the simulation clock, missions sleep through it
+	streaming : SimulatedStreaming
+		the simulated video stream
+	'''
+
+	def __init__(self, ip, name = None, **kwargs):
+		self.ip = ip
+		self.aircraft = aircraft(ip)
+		self.clock = self.aircraft.clock
+		self.streaming = SimulatedStreaming(self)
+		self.connected = False
+		self._listeners = []
+		self.aircraft.drones.add(self)
+
+	def connect(self, retry = 1, timeout = None, **kwargs):
+		self.connected = True
+		return True
+
+	def disconnect(self, timeout = None):
+		self.connected = False
+		return True
+
+	def connection_state(self):
+		return self.connected
+
+	def __call__(self, expression):
+		return Expectation(self.aircraft, _steps(expression))
+
+	def get_state(self, message):
+		return self.aircraft.get_state(_steps(message)[0].message)
+
+	def check_state(self, message, **args):
+		try:
+			return MessageCall(_steps(message)[0].message, (), args).matches(_steps(message)[0].message, self.get_state(message))
+		except KeyError:
+			return False
+
+	def start_piloting(self):
+		return True
+
+	def stop_piloting(self):
+		return True
+
+	def piloting(self, roll, pitch, yaw, gaz, piloting_time):
+		return self.aircraft.command(MessageCall(_message("ardrone3.Piloting.PCMD"), (), {
+			"roll": roll, "pitch": pitch, "yaw": yaw, "gaz": gaz, "piloting_time": piloting_time,
+		}))
+
+
+# << olympe Module >>
+_message_cache = {}
+
+def _message(key):
+	if key not in _message_cache:
+		module, name = key.rsplit(".", 1)
+		_message_cache[key] = Message(module, name, MESSAGES.get(module, {}).get(name, ()))
+	return _message_cache[key]
+
+def _messages_module(fullname):
+	module = types.ModuleType(fullname)
+	module.__path__ = []
+	relative = fullname[len("olympe.messages."):] if fullname.startswith("olympe.messages.") else fullname
+	for name in MESSAGES.get(relative, {}):
+		setattr(module, name, _message("{}.{}".format(relative, name)))
+	def __getattr__(name):
+		# messages the simulator does not know are accepted and do nothing
+		if name.startswith("__"):
+			raise AttributeError(name)
+		message = _message("{}.{}".format(relative, name))
+		setattr(module, name, message)
+		return message
+	module.__getattr__ = __getattr__
+	return module
+
+
+class _OlympeFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+	# creates the olympe submodules the simulator does not define, for the imports of SoftwarePilot
+	def find_spec(self, fullname, path, target = None):
+		if fullname.startswith("olympe.") and fullname not in sys.modules:
+			return importlib.machinery.ModuleSpec(fullname, self, is_package = True)
+		return None
+
+	def create_module(self, spec):
+		return _messages_module(spec.name)
+
+	def exec_module(self, module):
+		pass
+
+
+def install(speed = None):
+	'''
+	Installs the simulator as the olympe module, must be called before anything imports olympe
+
+	Parameters
+	----------
+	speed : float, optional
+		the clock seconds per real second (default = ANAFI_SIM_SPEED)
+	'''
+
+	global _speed
+	if speed is not None:
+		_speed = speed
+	current = sys.modules.get("olympe")
+	if current is not None:
+		if getattr(current, "SIMULATED", False):
+			return current
+		raise RuntimeError("Illegal state : olympe already imported")
+
+	olympe = types.ModuleType("olympe")
+	olympe.__path__ = []
+	olympe.SIMULATED = True
+	olympe.Drone = Drone
+	olympe.EventListener = EventListener
+	olympe.listen_event = listen_event
+	olympe.VideoFrame = VideoFrame
+	olympe.VDEF_I420 = VDEF_I420
+	olympe.VDEF_NV12 = VDEF_NV12
+	log = types.ModuleType("olympe.log")
+	log.update_config = lambda *args, **kwargs: None
+	olympe.log = log
+	sys.modules["olympe"] = olympe
+	sys.modules["olympe.log"] = log
+
+	modules = {"olympe.messages": _messages_module("olympe.messages")}
+	for relative in MESSAGES:
+		parts = relative.split(".")
+		for i in range(1, len(parts) + 1):
+			fullname = "olympe.messages." + ".".join(parts[:i])
+			if fullname not in modules:
+				modules[fullname] = _messages_module(fullname)
+	for fullname, module in modules.items():
+		sys.modules[fullname] = module
+		parent, _, name = fullname.rpartition(".")
+		setattr(sys.modules[parent], name, module)
+	sys.meta_path.insert(0, _OlympeFinder())
+	print("< Simulated Drone : {}x >".format(_speed))
+	return olympe
@@ -0,0 +1,195 @@
+import os
+import csv
+import math
+import time
+import threading
+import collections
+
+# << H264 Stream Statistics Methods >>
+class AnafiStreamStats:
+	'''
+	Sliding window statistics of the h264 stream. Every frame is added in constant time:
+	the window sums are updated incrementally instead of being recomputed, in integer
+	microseconds and bytes so they never drift. The window also slides while no frame
+	arrives, so fps and bitrate fall to 0 when the stream stalls.
+
+	...
+
+	Attributes
+	----------
+	window : float
+		the length of the sliding window in seconds
+	frames : int
+		the total number of frames seen
+	keyframes : int
+		the total number of sync (IDR) frames seen
+	keyframe_interval : int
+		the number of frames between the last two sync frames
+	keyframe_interval_s : float
+		the time in seconds between the last two sync frames
+
+	Methods
+	-------
+	add(timestamp, size, is_sync)
+		Adds a frame to the window
+	snapshot()
+		Returns the current statistics
+	start_flush(path, interval)
+		Periodically appends snapshots to a csv file from a background thread
+	stop_flush()
+		Stops the background flush and writes the last snapshot
+	'''
+
+	FIELDS = ["time", "fps", "bitrate", "keyframe_interval", "keyframe_interval_s", "jitter_ms", "frames", "keyframes"]
+
+	def __init__(self, window = 1.0):
+		'''
+		Parameters
+		----------
+		window : float, optional
+			the length of the sliding window in seconds (default = 1.0)
+		'''
+
+		self.window = window
+		self.lock = threading.Lock()
+		self.samples = collections.deque()
+		self.sum_size = 0
+		self.sum_interval = 0
+		self.sum_interval_sq = 0
+		self.last_ts = None
+		self.last_arrival = None
+
+		self.frames = 0
+		self.keyframes = 0
+		self.last_keyframe_frame = None
+		self.last_keyframe_ts = None
+		self.keyframe_interval = None
+		self.keyframe_interval_s = None
+
+		self.flush_thread = None
+		self.flush_stop = threading.Event()
+
+	def add(self, timestamp, size, is_sync = False):
+		'''
+		Adds a frame to the window, evicting the frames older than {window : float}
+
+		Parameters
+		----------
+		timestamp : int
+			the frame timestamp in microseconds (ntp_raw_timestamp)
+		size : int
+			the frame size in bytes
+		is_sync : bool, optional
+			True if the frame is a sync (IDR) frame
+		'''
+
+		timestamp, size = int(timestamp), int(size)
+		with self.lock:
+			interval = 0 if self.last_ts is None else timestamp - self.last_ts
+			self.last_ts = timestamp
+			self.last_arrival = time.monotonic()
+
+			self.samples.append((timestamp, size, interval))
+			self.sum_size += size
+			self.sum_interval += interval
+			self.sum_interval_sq += interval * interval
+			self._evict(timestamp)
+
+			self.frames += 1
+			if is_sync:
+				if self.last_keyframe_frame is not None:
+					self.keyframe_interval = self.frames - self.last_keyframe_frame
+					self.keyframe_interval_s = (timestamp - self.last_keyframe_ts) / 1e6
+				self.last_keyframe_frame = self.frames
+				self.last_keyframe_ts = timestamp
+				self.keyframes += 1
+
+	def _evict(self, now):
+		# drops the frames older than the window, {now : int} in stream microseconds
+		window_us = self.window * 1e6
+		samples = self.samples
+		while samples and samples[0][0] + window_us < now:
+			_, old_size, old_interval = samples.popleft()
+			self.sum_size -= old_size
+			self.sum_interval -= old_interval
+			self.sum_interval_sq -= old_interval * old_interval
+
+	def snapshot(self):
+		'''
+		Returns the current statistics
+
+		Return
+		----------
+		stats : dict
+			fps and bitrate (bit/s) over the window, keyframe interval (frames and seconds),
+			jitter (standard deviation of the frame interval in ms) and total frame counts
+		'''
+
+		with self.lock:
+			if self.last_ts is not None:
+				# the stream time now, extrapolated from the arrival of the last frame
+				self._evict(self.last_ts + int((time.monotonic() - self.last_arrival) * 1e6))
+			count = len(self.samples)
+			# the first interval of the window belongs to a frame that has been evicted
+			intervals = count - 1 if count > 1 else 0
+			if intervals > 0:
+				first_interval = self.samples[0][2]
+				sum_interval = self.sum_interval - first_interval
+				sum_interval_sq = self.sum_interval_sq - first_interval * first_interval
+				# exact in integer microseconds, converted to ms at the end
+				variance = (sum_interval_sq * intervals - sum_interval * sum_interval) / (intervals * intervals)
+				jitter = math.sqrt(max(variance, 0.0)) / 1e3
+			else:
+				jitter = 0.0
+			return {
+				"time": time.time(),
+				"fps": count / self.window,
+				"bitrate": 8 * self.sum_size / self.window,
+				"keyframe_interval": self.keyframe_interval,
+				"keyframe_interval_s": self.keyframe_interval_s,
+				"jitter_ms": jitter,
+				"frames": self.frames,
+				"keyframes": self.keyframes,
+			}
+
+	def start_flush(self, path, interval = 1.0):
+		'''
+		Periodically appends snapshots to a csv file from a background thread,
+		so the video callback never touches the disk
+
+		Parameters
+		----------
+		path : str
+			the location of the csv file, it is overwritten
+		interval : float, optional
+			the time in seconds between two snapshots (default = 1.0)
+		'''
+
+		self.stop_flush()
+		self.flush_stop.clear()
+		self.flush_thread = threading.Thread(
+			target = self._flush_loop, args = (path, interval), name = "H264-Stats-Flush", daemon = True
+		)
+		self.flush_thread.start()
+
+	def stop_flush(self):
+		'''
+		Stops the background flush and writes the last snapshot
+		'''
+
+		if self.flush_thread is not None:
+			self.flush_stop.set()
+			self.flush_thread.join()
+			self.flush_thread = None
+
+	def _flush_loop(self, path, interval):
+		directory = os.path.dirname(path)
+		if directory:
+			os.makedirs(directory, exist_ok = True)
+		with open(path, "w", newline = "") as stats_file:
+			writer = csv.DictWriter(stats_file, self.FIELDS)
+			writer.writeheader()
+			while not self.flush_stop.wait(interval):
+				writer.writerow(self.snapshot())
+				stats_file.flush()
+			writer.writerow(self.snapshot())
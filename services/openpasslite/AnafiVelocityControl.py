@@ -0,0 +1,281 @@
+import math
+import threading
+from olympe.messages.ardrone3.PilotingState import SpeedChanged, AttitudeChanged
+from AnafiClock import AnafiClock
+
+# << Continuous Velocity Control Methods >>
+class AnafiVelocityControl:
+	'''
+	Closed-loop piloting towards the latest target offset. A PD controller (PID with {ki : float} > 0)
+	turns the remaining offset into roll, pitch and gaz setpoints sent at a fixed rate from a
+	background thread. Targets are coalesced: a new target replaces the previous one, however many
+	arrive between two ticks, so the drone always flies towards the latest herd estimate.
+
+	...
+
+	Attributes
+	----------
+	drone : olympe.Drone
+		the drone object
+	clock : AnafiClock
+		the time source of the loop, the clock of the drone if it has one
+	rate : float
+		the number of setpoints sent per second
+	running : bool
+		True while the control loop is running
+
+	Methods
+	-------
+	start()
+		Starts the piloting interface and the control loop
+	stop()
+		Stops the control loop and hovers
+	set_target(x, y, z)
+		Replaces the target offset
+	clear_target()
+		Drops the target, the drone brakes and hovers
+	stats()
+		Returns the control loop counters
+	'''
+
+	def __init__(self, drone_object, rate = 10.0, kp = 6.0, ki = 0.0, kd = 3.0, kp_z = 15.0, kd_z = 3.0,
+			max_tilt = 30.0, max_gaz = 30.0, max_step = 10.0, tolerance = 0.5, target_timeout = 3.0):
+		'''
+		Parameters
+		----------
+		drone_object : olympe.Drone
+			the drone object
+		rate : float, optional
+			the number of setpoints sent per second (default = 10.0)
+		kp, ki, kd : float, optional
+			horizontal gains in percent of the maximum tilt per meter, meter second and meter per second
+			(default = 6.0, 0.0, 3.0)
+		kp_z, kd_z : float, optional
+			vertical gains in percent of the maximum vertical speed per meter and meter per second
+			(default = 15.0, 3.0)
+		max_tilt : float, optional
+			the largest roll and pitch setpoints in percent (default = 30.0)
+		max_gaz : float, optional
+			the largest gaz setpoint in percent (default = 30.0)
+		max_step : float, optional
+			the largest change of a setpoint in percent between two ticks (default = 10.0)
+		tolerance : float, optional
+			the remaining distance in meters at which a target is reached (default = 0.5)
+		target_timeout : float, optional
+			the time in seconds after which a target that was not refreshed is dropped (default = 3.0)
+		'''
+
+		if rate <= 0 or max_tilt <= 0 or max_gaz <= 0 or max_step <= 0:
+			raise RuntimeError("Illegal object parameter")
+		self.drone = drone_object
+		self.clock = getattr(drone_object, "clock", None) or AnafiClock()
+		self.rate = rate
+		self.kp, self.ki, self.kd = kp, ki, kd
+		self.kp_z, self.kd_z = kp_z, kd_z
+		self.max_tilt = min(max_tilt, 100.0)
+		self.max_gaz = min(max_gaz, 100.0)
+		self.max_step = max_step
+		self.tolerance = tolerance
+		self.target_timeout = target_timeout
+
+		self.lock = threading.Lock()
+		self.stop_event = threading.Event()
+		self.thread = None
+		self.running = False
+
+		# latest target, written by set_target and consumed by the control loop
+		self._pending = None
+		self._target = None
+		self._target_time = None
+		self._travelled = [0.0, 0.0, 0.0]
+		self._integral = [0.0, 0.0]
+		self._command = (0, 0, 0)
+		self._sent_time = 0.0
+
+		self.targets = 0
+		self.coalesced = 0
+		self.reached = 0
+		self.expired = 0
+		self.sent = 0
+		self.ticks = 0
+		self.overruns = 0
+
+	def start(self):
+		'''
+		Starts the piloting interface of the drone and the control loop
+		'''
+
+		if self.running:
+			return
+		assert self.drone.start_piloting()
+		self.stop_event.clear()
+		self.running = True
+		self.thread = threading.Thread(target = self._loop, name = "Anafi-Velocity-Control", daemon = True)
+		self.thread.start()
+		print("< Velocity Control Started >")
+
+	def stop(self):
+		'''
+		Stops the control loop, zeroes the setpoints and stops the piloting interface
+		'''
+
+		if not self.running:
+			return
+		self.stop_event.set()
+		self.thread.join()
+		self.thread = None
+		self.running = False
+		self.drone.piloting(0, 0, 0, 0, 0)
+		self.drone.stop_piloting()
+		self._command = (0, 0, 0)
+		print("< Velocity Control Stopped >")
+
+	def set_target(self, x, y, z):
+		'''
+		Replaces the target offset, relative to the current position of the drone.
+		Cheap and non blocking, the control loop picks it up on its next tick.
+
+		Parameters
+		----------
+		x : float
+			the offset forwards (negative backwards) in meters
+		y : float
+			the offset to the right (negative left) in meters
+		z : float
+			the offset upwards (negative downwards) in meters
+		'''
+
+		with self.lock:
+			if self._pending is not None:
+				# the previous target was never flown, the latest one wins
+				self.coalesced += 1
+			self._pending = (float(x), float(y), float(z), self.clock.time())
+			self.targets += 1
+
+	def clear_target(self):
+		'''
+		Drops the target, the drone brakes and hovers
+		'''
+
+		with self.lock:
+			self._pending = None
+			self._target = None
+
+	def stats(self):
+		'''
+		Returns the control loop counters
+
+		Return
+		----------
+		stats : dict
+			targets received, coalesced (replaced before being flown), reached and expired,
+			setpoints sent (unchanged ones are refreshed every other tick), ticks, late ticks
+			and the current (roll, pitch, gaz) setpoint
+		'''
+
+		with self.lock:
+			return {
+				"rate": self.rate,
+				"targets": self.targets,
+				"coalesced": self.coalesced,
+				"reached": self.reached,
+				"expired": self.expired,
+				"sent": self.sent,
+				"ticks": self.ticks,
+				"overruns": self.overruns,
+				"command": self._command,
+			}
+
+	def _body_velocity(self):
+		'''
+		Measured velocity (forward, right, up) in m/s, None if the drone did not report it yet
+		'''
+
+		try:
+			speed = self.drone.get_state(SpeedChanged)
+			yaw = self.drone.get_state(AttitudeChanged)["yaw"]
+		except Exception:
+			return None
+		# NED speeds rotated into the body frame of the drone
+		north, east, down = speed["speedX"], speed["speedY"], speed["speedZ"]
+		forward = math.cos(yaw) * north + math.sin(yaw) * east
+		right = -math.sin(yaw) * north + math.cos(yaw) * east
+		return forward, right, -down
+
+	def _limit(self, value, previous, limit):
+		value = max(-limit, min(limit, value))
+		# slew rate limit, no lurch when the target jumps
+		return max(previous - self.max_step, min(previous + self.max_step, value))
+
+	def _tick(self, now, dt):
+		with self.lock:
+			if self._pending is not None:
+				x, y, z, self._target_time = self._pending
+				self._target = (x, y, z)
+				self._pending = None
+				self._travelled = [0.0, 0.0, 0.0]
+				self._integral = [0.0, 0.0]
+			target = self._target
+			if target is not None and now - self._target_time > self.target_timeout:
+				self._target = target = None
+				self.expired += 1
+
+		velocity = self._body_velocity()
+		if velocity is None:
+			# no speed feedback yet, the target is only dropped once it expires
+			velocity = (0.0, 0.0, 0.0)
+		# the target is relative to where the drone was when it was set
+		for axis in range(3):
+			self._travelled[axis] += velocity[axis] * dt
+
+		roll, pitch, gaz = 0.0, 0.0, 0.0
+		if target is not None:
+			error = [target[axis] - self._travelled[axis] for axis in range(3)]
+			if math.hypot(error[0], error[1]) < self.tolerance and abs(error[2]) < self.tolerance:
+				with self.lock:
+					if self._target is target:
+						self._target = None
+						self.reached += 1
+				error = [0.0, 0.0, 0.0]
+			if self.ki:
+				for axis in range(2):
+					self._integral[axis] += error[axis] * dt
+			# the derivative term is taken on the measured velocity: a new target doesn't kick the setpoints
+			pitch = self.kp * error[0] + self.ki * self._integral[0] - self.kd * velocity[0]
+			roll = self.kp * error[1] + self.ki * self._integral[1] - self.kd * velocity[1]
+			gaz = self.kp_z * error[2] - self.kd_z * velocity[2]
+
+		previous_roll, previous_pitch, previous_gaz = self._command
+		command = (
+			int(round(self._limit(roll, previous_roll, self.max_tilt))),
+			int(round(self._limit(pitch, previous_pitch, self.max_tilt))),
+			int(round(self._limit(gaz, previous_gaz, self.max_gaz))),
+		)
+		with self.lock:
+			self.ticks += 1
+			# an unchanged setpoint is only refreshed every other tick
+			if command == self._command and now - self._sent_time < 2.0 / self.rate:
+				return
+			self._command = command
+			self._sent_time = now
+			self.sent += 1
+		# the setpoint holds for a few ticks only: the drone hovers if the loop stalls
+		self.drone.piloting(command[0], command[1], 0, command[2], 3.0 / self.rate)
+
+	def _loop(self):
+		period = 1.0 / self.rate
+		last = self.clock.time()
+		deadline = last + period
+		while not self.clock.wait(self.stop_event, max(0.0, deadline - self.clock.time())):
+			now = self.clock.time()
+			try:
+				self._tick(now, now - last)
+			except Exception as e:
+				print("< Velocity Control Error : {} >".format(e))
+			last = now
+			deadline += period
+			if deadline < now:
+				# fixed rate: late ticks are dropped, not sent in a burst
+				with self.lock:
+					self.overruns += 1
+				deadline = now + period
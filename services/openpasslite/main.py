@@ -1,10 +1,16 @@
+import time
+# process start, the import-time report measures how long the HTTP API takes to come up
+STARTED = time.perf_counter()
+import os
 import logging
 import toml
-from AnafiController import AnafiController
+from AnafiLoader import AnafiLoader
 import threading
 import importlib
+import asyncio
 from typing import Optional
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
@@ -28,13 +34,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger("openpasslite")
 
+def install_simulator():
+    # the simulated drone replaces olympe, before anything imports it
+    if os.getenv("ANAFI_SIMULATOR", "0") == "1":
+        import AnafiSimulator
+        AnafiSimulator.install()
+
+def warm_up_stream():
+    # first JPEG encoding of the live preview, off the first mission
+    import cv2
+    import numpy as np
+    cv2.imencode(".jpg", np.zeros((720, 1280, 3), dtype=np.uint8))
+
+# olympe, cv2 and the Anafi wrapper chain are imported in the background, the HTTP API comes up first
+drone_stack = AnafiLoader({
+    "streaming": ["cv2", "AnafiFrameSlot", "AnafiFrameChannel", warm_up_stream],
+    "drone": ["olympe", "AnafiController"],
+}, before=install_simulator)
+http_up = None
+
 # Global mission state
 mission_thread = None
 stop_mission_flag = threading.Event()
+current_drone = None
 
 def run_mission_background(mission_name: str, lat: Optional[str], long: Optional[str]):
     """Execute mission in background thread"""
-    global stop_mission_flag
+    global stop_mission_flag, current_drone
     try:
         if stop_mission_flag.is_set():
             logger.info(f"Mission {mission_name} stopped before execution")
@@ -43,7 +69,9 @@ def run_mission_background(mission_name: str, lat: Optional[str], long: Optional
         logger.info(f"Starting mission: {mission_name}")
         mission_module = importlib.import_module(f"mission.{mission_name}.script")
 
+        AnafiController = drone_stack.module("AnafiController").AnafiController
         drone = AnafiController(connection_type=1)
+        current_drone = drone
         
         if hasattr(mission_module, 'run'):
             logger.info(f"Executing mission {mission_name}")
@@ -55,12 +83,17 @@ def run_mission_background(mission_name: str, lat: Optional[str], long: Optional
     except Exception as e:
         logger.error(f"Mission {mission_name} failed: {str(e)}")
     finally:
+        current_drone = None
         stop_mission_flag.clear()
         logger.info(f"Mission {mission_name} thread finished")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global http_up
     logger.info("OpenPassLite service starting up")
+    drone_stack.start()
+    http_up = time.perf_counter() - STARTED
+    logger.info(f"HTTP API up {http_up:.2f}s after process start")
     yield
     logger.info("OpenPassLite service shutting down")
     # Ensure any running mission is stopped on shutdown
@@ -91,6 +124,27 @@ async def root():
     logger.info("Root endpoint accessed")
     return {"message": "OpenPassLite Service", "status": "running"}
 
+@app.get("/livez")
+async def livez():
+    return {"status": "alive", "uptime": time.perf_counter() - STARTED}
+
+@app.get("/readyz")
+async def readyz():
+    # ready once olympe, the Anafi wrappers and the stream pipeline are imported and warm
+    ready = drone_stack.ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "warming",
+            "checks": drone_stack.checks(),
+            "drone_connected": current_drone is not None
+        }
+    )
+
+@app.get("/startup")
+async def startup():
+    return {"http_up": http_up, **drone_stack.report()}
+
 @app.post("/start_mission")
 async def start_mission(name: str, lat: Optional[str] = None, long: Optional[str] = None):
     logger.info(f"Start mission endpoint accessed - Mission: {name}")
@@ -166,6 +220,84 @@ async def mission_status():
         "stop_requested": stop_mission_flag.is_set()
     }
 
+def get_frame_slot():
+    if current_drone is None:
+        raise HTTPException(status_code=503, detail="No mission running")
+    return current_drone.camera.media.frame_slot
+
+@app.get("/stream/frame")
+async def stream_frame():
+    frame_slot = get_frame_slot()
+    jpeg, metadata = await asyncio.to_thread(frame_slot.get_jpeg)
+    if jpeg is None:
+        raise HTTPException(status_code=404, detail="No frame available")
+    return Response(
+        content=jpeg,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "no-cache", "X-Frame-Seq": str(metadata["seq"])}
+    )
+
+@app.get("/stream/frame_data")
+async def stream_frame_data():
+    metadata = get_frame_slot().get_metadata()
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="No frame available")
+    return metadata
+
+@app.get("/stream/stats")
+async def stream_stats():
+    if current_drone is None:
+        raise HTTPException(status_code=503, detail="No mission running")
+    media = current_drone.camera.media
+    frame_channel = getattr(media, "frame_channel", None)
+    h264_stats = getattr(media, "h264_stats", None)
+    return {
+        "frames": frame_channel.stats() if frame_channel is not None else None,
+        "h264": h264_stats.snapshot() if h264_stats is not None else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    lines = []
+    media = current_drone.camera.media if current_drone is not None else None
+    frame_channel = getattr(media, "frame_channel", None)
+    h264_stats = getattr(media, "h264_stats", None)
+    if frame_channel is not None:
+        for key, value in frame_channel.stats().items():
+            if isinstance(value, int):
+                lines.append(f"openpasslite_frame_channel_{key} {value}")
+    if h264_stats is not None:
+        for key, value in h264_stats.snapshot().items():
+            if key != "time" and value is not None:
+                lines.append(f"openpasslite_h264_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+@app.get("/stream/mjpeg")
+async def stream_mjpeg():
+    frame_slot = get_frame_slot()
+    logger.info("MJPEG stream viewer connected")
+
+    async def mjpeg_generator():
+        seq = 0
+        while current_drone is not None and current_drone.camera.media.frame_slot is frame_slot:
+            # no thread per viewer: the slot wakes the task up when a frame is published
+            new_seq = await frame_slot.wait_next_async(seq, 1.0)
+            if new_seq == seq:
+                continue
+            jpeg, metadata = await asyncio.to_thread(frame_slot.get_jpeg)
+            seq = metadata["seq"]
+            yield (
+                b"--frame\r\nContent-Type: image/jpeg\r\n"
+                + f"Content-Length: {len(jpeg)}\r\nX-Frame-Seq: {seq}\r\n\r\n".encode()
+                + jpeg + b"\r\n"
+            )
+
+    return StreamingResponse(
+        mjpeg_generator(),
+        media_type="multipart/x-mixed-replace; boundary=frame",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 @app.get("/logs")
 async def get_logs(lines: int = 100):
     logger.info(f"Logs endpoint accessed - requesting {lines} lines")
@@ -1,7 +1,6 @@
 import json
 import csv
 from pathlib import Path
-import time
 
 def run(drone, lat=None, long=None):
     mission_dir = Path(__file__).parent
@@ -21,7 +20,7 @@ def run(drone, lat=None, long=None):
         print("Connected successfully")
         
         print("=== WAITING FOR GPS STABILIZATION ===")
-        time.sleep(10)
+        drone.clock.sleep(10)
         
         print("=== CHECKING GPS STATUS ===")
         coordinates = drone.get_drone_coordinates()
@@ -35,7 +34,7 @@ def run(drone, lat=None, long=None):
         print("✓ Takeoff completed")
         
         print("=== STABILIZING AFTER TAKEOFF ===")
-        time.sleep(5)
+        drone.clock.sleep(5)
         
         print(f"=== NAVIGATING TO TARGET COORDINATES ===")
         print(f"Target: Lat={lat_float:.6f}, Lon={long_float:.6f}, Alt={20}m")
@@ -65,7 +64,7 @@ def run(drone, lat=None, long=None):
             )
             print("Navigation command sent (not waiting for completion)")
             
-            time.sleep(15)
+            drone.clock.sleep(15)
             
         print("=== CHECKING FINAL POSITION ===")
         final_coords = drone.get_drone_coordinates()
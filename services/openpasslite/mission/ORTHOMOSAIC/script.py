@@ -1,7 +1,6 @@
 import json
 import csv
 from pathlib import Path
-import time
 
 def run(drone,lat_sample=None, long_sample=None):
     mission_dir = Path(__file__).parent
@@ -32,7 +31,7 @@ def run(drone,lat_sample=None, long_sample=None):
         print("Connected successfully")
         
         print("=== WAITING FOR GPS STABILIZATION ===")
-        time.sleep(10)
+        drone.clock.sleep(10)
 
         print("=== SETTING UP IMAGE MODE ===")
         drone.camera.media.setup_photo()
@@ -49,8 +48,10 @@ def run(drone,lat_sample=None, long_sample=None):
         print("✓ Takeoff completed")
         
         print("=== STABILIZING AFTER TAKEOFF ===")
-        time.sleep(5)
+        drone.clock.sleep(5)
         
+        photo_futures = []
+
         print(f"=== STARTING ORTHOMOSAIC MISSION ===")
         print(f"Total waypoints: {len(waypoints)} at {height}m altitude")
         
@@ -82,16 +83,26 @@ def run(drone,lat_sample=None, long_sample=None):
                     wait=False
                 )
                 print("Navigation command sent (not waiting for completion)")
-                time.sleep(3)
+                drone.clock.sleep(3)
             
             print("=== CAPTURING IMAGE ===")
             try:
-                drone.camera.media.take_photo()
+                # only wait for the shutter, the photo is saved while flying to the next waypoint
+                photo_futures.append(drone.camera.media.take_photo_async())
+                drone.camera.media.wait_camera_ready(timeout=5)
                 print("✓ Image captured")
             except Exception as e:
                 print(f"Photo capture failed: {e}")
-            
-            time.sleep(2)
+        
+        print("=== WAITING FOR IMAGES TO BE SAVED ===")
+        saved = 0
+        for future in photo_futures:
+            try:
+                future.result(timeout=30)
+                saved += 1
+            except Exception as e:
+                print(f"Photo save failed: {e}")
+        print(f"✓ {saved}/{len(waypoints)} images saved")
         
         print("=== RETURNING TO HOME ===")
         drone.rth.setup_rth()
@@ -1,5 +1,4 @@
 import json
-import time
 import csv
 import os
 from pathlib import Path
@@ -14,13 +13,13 @@ def run(drone, lat=None, long=None):
         print("=== INITIALIZING DRONE ===")
         print("=== CONNECTING TO DRONE ===")
         drone.connect()
-        time.sleep(3)
+        drone.clock.sleep(3)
         print("=== SETTING UP RETURN TO HOME ===")
         drone.rth.setup_rth()
         print("=== RETURNING BACK HOME ===")
         drone.rth.return_to_home()
         print("=== MISSION COMPLETED SUCCESSFULLY ===")
-        time.sleep(3)
+        drone.clock.sleep(3)
         print("=== DISCONNECTING FROM DRONE ===")
         drone.disconnect()
         
@@ -1,14 +1,20 @@
 import cv2
 import time
 import queue
-import olympe
-from SoftwarePilot import SoftwarePilot
-from ultralytics import YOLO
+import threading
+import numpy as np
 import navigation as navigation
+import geometry
+from pipeline import LatestFrameSlot, DecisionRate, MotionGate, StageTimer
+from detectors import load_detector, DEFAULT_PROFILE
+from evidence import EvidenceWriter
+from mission_log import MissionLog, FLUSH_INTERVAL
+from yuv import YuvFrame, YUV_PREPROCESS, cvt_color_flags
+from velocity import VelocityControl
 import sys
 import json
 import time
-import csv 
+import csv
 import os
 import datetime
 import logging
@@ -20,134 +26,404 @@ import logging
 # User-defined mission parameters
 # 5 minutes is 300 seconds
 DURATION = 200 # duration in seconds
+TARGET_DECISION_HZ = 1.0 # how often the drone decides where to move, lowered automatically if inference is slower
+MOTION_GATING = os.getenv("WILDWINGS_MOTION_GATING", "1") == "1" # reuse the last decision while the scene and the drone don't change
+VELOCITY_CONTROL = os.getenv("WILDWINGS_VELOCITY_CONTROL", "0") == "1" # fly towards the latest decision continuously instead of one moveBy per decision
+VELOCITY_CONTROL_RATE = 10.0 # setpoints per second in velocity control
 
-# Retrieve the filename from command-line arguments
-if len(sys.argv) < 2:
-    print("Usage: python controller.py <output_directory>")
-    sys.exit(1)
-
-output_directory = sys.argv[1]
-
-# Setup logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Define CSV file path to store telemetry data
-# Define the CSV file path
-csv_file_path = os.path.join(output_directory, 'telemetry_log.csv')
-
-# Ensure the CSV file has a header row
-if not os.path.exists(csv_file_path):
-    with open(csv_file_path, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["timestamp", "x", "y", "z", "move_x", "move_y", "move_z", "frame"])
+logger = logging.getLogger("wildwings.mission")
 
 
 # Runs what to do on every yuv_frame of the stream, modify it as needed
 class Tracker:
-    def __init__(self, drone, model):
+    def __init__(self, drone, model, output_directory, detector=None, profile=DEFAULT_PROFILE):
         self.drone = drone
         self.media = drone.camera.media
-        self.model = model
+        # tiling / ROI inference strategies, with their own state for this mission
+        self.model = navigation.mission_detector(model) if model is not None else None
+        # animal tracks and herd filter of this mission, only the inference process has them when there is one
+        self.herd = navigation.mission_herd() if model is not None and detector is None else None
+        # annotated frames are rendered and written by worker threads, off the decision path
+        self.evidence = EvidenceWriter() if model is not None else None
+        # optional shm_ring.RemoteDetector running the inference in a separate process
+        self.detector = detector
+        # classes and thresholds of this mission, applied inside the inference call
+        self.profile = profile
+        self.output_directory = output_directory
+        # olympe is imported by the drone connection, not when the module loads
+        self.cvt_color_flags = cvt_color_flags()
+        try:
+            from olympe.messages.ardrone3.PilotingState import AltitudeChanged, AttitudeChanged
+        except ImportError:
+            # offline replays run without the Parrot SDK, their drone has the state getters
+            AltitudeChanged = AttitudeChanged = None
+        self.altitude_changed = AltitudeChanged
+        self.attitude_changed = AttitudeChanged
         self.frame = None
         self.FPS = 1/60
         self.FPS_MS = int(self.FPS * 1000)
 
+        # frame intake -> newest frame slot -> inference worker
+        self.latest_frame = LatestFrameSlot(release=lambda frame: frame.unref())
+        self.decision_rate = DecisionRate(target_hz=TARGET_DECISION_HZ)
+        self.stop_event = threading.Event()
+        self.inference_thread = None
+        self.motion_gate = MotionGate() if MOTION_GATING else None
+        self.last_move = None
+        # durations of the stages of every decision, and an optional callback receiving the trace of every decision
+        self.stages = StageTimer()
+        self.on_decision = None
+        # continuous piloting towards the latest decision, through the piloting interface of the olympe drone.
+        # Replays have no olympe drone, their moves are recorded as moveBy
+        self.velocity_control = (
+            VelocityControl(drone.drone, VELOCITY_CONTROL_RATE) if VELOCITY_CONTROL and hasattr(drone, "drone") else None
+        )
+
+        # keep the detection settings with the mission results
+        with open(os.path.join(output_directory, 'detection_profile.json'), 'w') as file:
+            json.dump(profile.to_dict(), file, indent=2)
+
+        # telemetry and detections of every decision, columnar (see mission_log.py)
+        self.mission_log = MissionLog(output_directory)
+
+        # Define CSV file path to store telemetry data
+        self.csv_file_path = os.path.join(output_directory, 'telemetry_log.csv')
+
+        # the CSV file stays open for the mission and is flushed with the mission log
+        new_file = not os.path.exists(self.csv_file_path)
+        self.csv_file = open(self.csv_file_path, mode='a', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        # Ensure the CSV file has a header row
+        if new_file:
+            self.csv_writer.writerow(["timestamp", "x", "y", "z", "move_x", "move_y", "move_z", "frame", "reused"])
+        self.csv_flushed = time.monotonic()
+
     def track(self):
+        """
+        Frame intake, runs on the stream processing thread: only keeps the newest frame
+        so the inference worker always decides on the freshest image
+        """
+        self.stop_event.clear()
+        self.inference_thread = threading.Thread(target=self.infer, name="WildWings-Inference")
+        self.inference_thread.start()
+
         while self.media.running:
             try:
                 yuv_frame = self.media.frame_queue.get(timeout=0.1)
-                self.media.frame_counter += 1
-
-                if (self.media.frame_counter % 40) == 0: # note: adjust this number to change how often the drone moves (every 20 frames in this case)
-                    # the VideoFrame.info() dictionary contains some useful information
-                    # such as the video resolution
-                    info = yuv_frame.info()
-
-                    height, width = (  # noqa
-                        info["raw"]["frame"]["info"]["height"],
-                        info["raw"]["frame"]["info"]["width"],
-                    )
-
-                    # yuv_frame.vmeta() returns a dictionary that contains additional
-                    # metadata from the drone (GPS coordinates, battery percentage, ...)
-
-                    # convert pdraw YUV flag to OpenCV YUV flag
-                    cv2_cvt_color_flag = {
-                        olympe.VDEF_I420: cv2.COLOR_YUV2BGR_I420,
-                        olympe.VDEF_NV12: cv2.COLOR_YUV2BGR_NV12,
-                    }[yuv_frame.format()]
-
-                    cv2frame = cv2.cvtColor(yuv_frame.as_ndarray(), cv2_cvt_color_flag)
-
-                    x_direction, y_direction, z_direction = navigation.get_next_action(cv2frame, self.model, output_directory, self.media.frame_counter)  # KEY LINE
-                    #self.update_frame(cv2.imread('result.jpg'))
-
-                    # save telemetry 
-                   
-                    telemetry = drone.get_drone_coordinates()
-                
-                     # Convert time.time() to datetime object
-                    timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-                    # Append telemetry data to CSV file
-                    with open(csv_file_path, mode='a', newline='') as file:
-                        writer = csv.writer(file)
-                        writer.writerow([timestamp, telemetry[0], telemetry[1], telemetry[2], x_direction, y_direction, z_direction, self.media.frame_counter])
-
-                    self.drone.piloting.move_by(x_direction, y_direction, z_direction, 0)
-
-                # cv2.imwrite(os.path.join(self.download_dir, "test{}.jpg".format(self.frame_counter)), cv2frame)
-               
             except queue.Empty:
                 continue
-
-        # You should process your frames here and release (unref) them when you're done.
-        # Don't hold a reference on your frames for too long to avoid memory leaks and/or memory
-        # pool exhaustion.
-        yuv_frame.unref()
-
-
-# Setup a parrot anafi drone, connected through a controller, without a specific download directory
-sp = SoftwarePilot()
-model = YOLO('yolov5su')
-
-# Connect to the drone
-drone = sp.setup_drone("parrot_anafi", 1, "None")
-drone.connect()
-
-# wait for drone to stabilize
-time.sleep(5)
-
-# Create a tracker object
-tracker = Tracker(drone, model)
-
-# set up recording
-drone.camera.media.setup_recording()
-drone.camera.media.start_recording()
-
-# wait for drone to stabilize
-time.sleep(5)
-
-# Start the stream
-drone.camera.media.setup_stream(yuv_frame_processing=tracker.track)
-drone.camera.media.start_stream() 
-
-# set window properties (with error handling for headless environments)
-try:
-    cv2.namedWindow('tracking', cv2.WINDOW_KEEPRATIO)
-    cv2.resizeWindow('tracking', 500, 500)
-    cv2.moveWindow('tracking', 0, 0)
-    logger.info("Display window created successfully")
-except Exception as e:
-    logger.warning(f"Could not create display window: {e}. Continuing in headless mode.")
-
-# set track duration in seconds
-time.sleep(DURATION)
-drone.camera.media.stop_stream()
-
-# stop recording
-drone.camera.media.stop_recording()
-drone.camera.media.download_last_media()
-
-# Disconnect the drone
-drone.disconnect()
\ No newline at end of file
+            self.media.frame_counter += 1
+            self.latest_frame.put(yuv_frame, self.media.frame_counter)
+
+        self.stop_event.set()
+        self.inference_thread.join()
+        self.latest_frame.clear()
+        # release the frames queued after the stream stopped
+        while True:
+            try:
+                self.media.frame_queue.get_nowait().unref()
+            except queue.Empty:
+                break
+
+        logger.info(
+            f"Tracking stats: {self.latest_frame.received} frames received, "
+            f"{self.latest_frame.replaced} skipped, {self.decision_rate.stats()}"
+        )
+        if self.model is not None:
+            logger.info(f"Detector stats: {self.model.stats()}")
+        if self.motion_gate is not None:
+            logger.info(f"Motion gating: {self.motion_gate.stats()}")
+        if self.herd is not None:
+            logger.info(f"Herd tracking: {self.herd.stats()}")
+        logger.info(f"Decision stages: {self.stages.stats()}")
+        self.close()
+
+    def close(self):
+        """
+        Write the pending evidence frames and mission data, can be called more than once
+        """
+        if self.detector is not None and (self.inference_thread is None or not self.inference_thread.is_alive()):
+            # the inference process writes its detections and evidence now, not when the next mission starts
+            try:
+                self.detector.end_mission(self.output_directory)
+            except (TimeoutError, OSError) as e:
+                logger.warning(f"Inference process could not finish the mission: {e}")
+            self.detector = None
+        if self.evidence is not None:
+            self.evidence.close()
+            logger.info(f"Evidence: {self.evidence.stats()}")
+            self.evidence = None
+        if not self.csv_file.closed:
+            self.mission_log.close()
+            self.csv_file.close()
+            logger.info(f"Mission log: {self.mission_log.stats()}")
+
+    def infer(self):
+        """
+        Inference worker: takes the newest frame when a decision is due and releases it once done
+        """
+        while not self.stop_event.is_set():
+            if not self.decision_rate.wait(self.stop_event):
+                break
+            yuv_frame, frame_number = self.latest_frame.take(timeout=0.5)
+            if yuv_frame is None:
+                continue
+            start = time.perf_counter()
+            try:
+                self.decide(yuv_frame, frame_number)
+            except Exception as e:
+                logger.error(f"Decision on frame {frame_number} failed: {e}")
+            finally:
+                # Don't hold a reference on your frames for too long to avoid memory leaks and/or memory
+                # pool exhaustion.
+                yuv_frame.unref()
+            self.decision_rate.record(time.perf_counter() - start)
+
+    def drone_state(self, getter, message, key):
+        """
+        A piloting state of the drone, from its `getter` when it has one (AnafiController, replays),
+        else `key` of the olympe `message` state. None when the drone doesn't report it
+        """
+        if hasattr(self.drone, getter):
+            return getattr(self.drone, getter)()
+        try:
+            return self.drone.drone.get_state(message)[key]
+        except (AttributeError, KeyError, RuntimeError):
+            return None
+
+    def drone_height(self):
+        """
+        Height above the takeoff point (AltitudeChanged), None when the drone doesn't report it.
+        The altitude of get_drone_coordinates() is above sea level and can't size the moves
+        """
+        return self.drone_state("get_drone_height", self.altitude_changed, "altitude")
+
+    def drone_position(self, telemetry, height):
+        """
+        (latitude, longitude, height above takeoff, yaw) of the drone at a frame, measures the displacement
+        it actually flew between frames (navigation.follow_flight). None without a GPS fix, height or heading
+        """
+        latitude, longitude = float(telemetry[0]), float(telemetry[1])
+        # the drone reports 500 while it has no GPS fix
+        if height is None or abs(latitude) > 90 or abs(longitude) > 180:
+            return None
+        yaw = self.drone_state("get_drone_heading", self.attitude_changed, "yaw")
+        if yaw is None:
+            return None
+        return latitude, longitude, float(height), float(yaw)
+
+    def fly(self, frame_number, move, reused=False, hold=False):
+        """
+        Send a decision to the drone. Decisions are (x forward, y right, z up) in meters, like
+        navigation.herd_move; each actuator gets them in its own convention. `hold` sends nothing
+        """
+        x, y, z = move
+        suffix = " (reused)" if reused else ""
+        if hold:
+            # the drone is still flying towards the last target (or moveBy), sending it again would restart it
+            logger.info(f"Frame {frame_number}: keeping the current target" + suffix)
+        elif self.velocity_control is not None:
+            # latest wins: the control loop flies towards this target until the next decision replaces it
+            logger.info(f"Frame {frame_number}: target({x}, {y}, {z})" + suffix)
+            self.velocity_control.set_target(x, y, z)
+        else:
+            # Olympe moveBy dZ is positive down
+            logger.info(f"Frame {frame_number}: move_by({x}, {y}, {-z})" + suffix)
+            self.drone.piloting.move_by(x, y, -z, 0)
+
+    def decide(self, yuv_frame, frame_number):
+        # the VideoFrame.info() dictionary contains some useful information
+        # such as the video resolution
+        self.stages.start()
+        info = yuv_frame.info()
+
+        height, width = (  # noqa
+            info["raw"]["frame"]["info"]["height"],
+            info["raw"]["frame"]["info"]["width"],
+        )
+
+        # yuv_frame.vmeta() returns a dictionary that contains additional
+        # metadata from the drone (GPS coordinates, battery percentage, ...)
+
+        # convert pdraw YUV flag to OpenCV YUV flag
+        cv2_cvt_color_flag = self.cvt_color_flags[yuv_frame.format()]
+
+        # telemetry and camera pose at the time of the frame, the pose picks the tiling and sizes the moves
+        telemetry = self.drone.get_drone_coordinates()
+        drone_height = self.drone_height()
+        pose = geometry.camera_pose(yuv_frame.vmeta(), drone_height)
+        position = self.drone_position(telemetry, drone_height)
+        yuv = yuv_frame.as_ndarray()
+        self.stages.mark("telemetry")
+
+        # skip the inference while neither the scene nor the drone changed, the last decision still holds
+        reused = (
+            self.motion_gate is not None
+            and self.last_move is not None
+            and not self.motion_gate.check(yuv, height, telemetry, drone_height)
+        )
+        self.stages.mark("gate")
+        # the herd filters are in the pixels of the last frame, shift them by the displacement flown since
+        navigation.follow_flight(self.herd, position, (height, width), pose)
+        state = None
+        if reused:
+            # follow the predicted herd between inferences, hold the last move if there is no herd estimate
+            state = self.herd.predict(self.herd.clock()) if self.herd is not None else None
+            if state is not None:
+                x_direction, y_direction, z_direction = navigation.herd_move(state.centroid, state.bbox, (height, width), pose)
+            else:
+                x_direction, y_direction, z_direction = self.last_move
+        elif self.detector is not None:
+            # the YUV frame is copied once into shared memory and converted by the inference process
+            move = self.detector.get_next_action(yuv, cv2_cvt_color_flag, frame_number, self.output_directory, self.profile, pose, position)
+            if move is None:
+                return
+            x_direction, y_direction, z_direction = move
+        else:
+            if YUV_PREPROCESS:
+                # cropped and resized on the YUV planes by the detector, only the model input is converted
+                frame = YuvFrame(yuv, cv2_cvt_color_flag, height, width)
+            else:
+                frame = cv2.cvtColor(yuv, cv2_cvt_color_flag)
+
+            x_direction, y_direction, z_direction = navigation.get_next_action(
+                frame, self.model, self.output_directory, frame_number, self.profile, pose, self.herd, self.evidence, self.mission_log
+            )  # KEY LINE
+        self.last_move = (x_direction, y_direction, z_direction)
+        self.stages.mark("detect")
+
+        # save telemetry
+        now = time.time()
+        self.mission_log.add_telemetry(frame_number, telemetry, pose, (height, width), self.last_move, reused, now)
+        # Convert time.time() to datetime object
+        timestamp = datetime.datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+        # Append telemetry data to CSV file
+        self.csv_writer.writerow([timestamp, telemetry[0], telemetry[1], telemetry[2], x_direction, y_direction, z_direction, frame_number, int(reused)])
+        if time.monotonic() - self.csv_flushed >= FLUSH_INTERVAL:
+            self.csv_file.flush()
+            self.csv_flushed = time.monotonic()
+        self.stages.mark("log")
+
+        self.fly(frame_number, self.last_move, reused, hold=reused and state is None)
+        self.stages.mark("move")
+
+        if self.on_decision is not None:
+            self.on_decision({
+                "frame": frame_number,
+                "timestamp": now,
+                "telemetry": [float(value) for value in telemetry[:3]],
+                "pose": {"altitude": pose.altitude, "pitch": pose.pitch},
+                "reused": bool(reused),
+                "move": [float(value) for value in self.last_move],
+                "stages": dict(self.stages.current),
+            })
+
+
+def load_model():
+    """
+    Load the detector of the animals from the local model store, checksummed and warmed up,
+    on the backend selected by WILDWINGS_DETECTOR (torch, onnx, onnx-int8, openvino, openvino-int8)
+    """
+    return load_detector('yolov5su')
+
+def warm_up_stream(width=1280, height=720):
+    """
+    Convert a blank I420 frame once, so the first decision of a mission doesn't pay for the
+    OpenCV dispatch and thread pool setup
+    """
+    frame = YuvFrame(np.full((height * 3 // 2, width), 128, dtype=np.uint8), cv2.COLOR_YUV2BGR_I420, height, width)
+    return frame.bgr().shape
+
+def run_mission(output_directory, model, software_pilot=None, stop_event=None, duration=DURATION, detector=None, profile=None):
+    """
+    Connect to the drone, track the herd for `duration` seconds (or until `stop_event` is set)
+    and download the mission recording into `output_directory`.
+    If a `detector` is given the inference runs in its process instead of using `model`.
+    `profile` is the DetectionProfile of the mission, the animal classes with the default thresholds if None
+    """
+    if profile is None:
+        profile = DEFAULT_PROFILE
+
+    # SoftwarePilot and olympe load the whole drone stack, they are only imported when a mission runs
+    import olympe
+    if software_pilot is None:
+        from SoftwarePilot import SoftwarePilot
+        software_pilot = SoftwarePilot()
+
+    # Setup a parrot anafi drone, connected through a controller, without a specific download directory
+    drone = software_pilot.setup_drone("parrot_anafi", 1, "None")
+    logger.info("Connecting to the drone")
+    drone.connect()
+
+    tracker = None
+    try:
+        # Create a tracker object
+        tracker = Tracker(drone, model, output_directory, detector, profile)
+
+        # set up recording, no settling delay is needed: connect() returns once the drone state is
+        # synchronized and start_recording() once the drone acknowledged it, tracking starts right away
+        drone.camera.media.setup_recording()
+        drone.camera.media.start_recording()
+        logger.info("Recording started")
+
+        if tracker.velocity_control is not None:
+            tracker.velocity_control.start()
+
+        # Start the stream
+        drone.camera.media.setup_stream(yuv_frame_processing=tracker.track)
+        drone.camera.media.start_stream()
+        logger.info("Tracking started")
+
+        # set track duration in seconds, in real time even on the simulated Anafi: the stream,
+        # the decision rate and the herd filter are real time
+        if stop_event is None:
+            time.sleep(duration)
+        elif stop_event.wait(duration):
+            logger.info("Mission stop requested")
+        drone.camera.media.stop_stream()
+        logger.info("Tracking stopped")
+        if tracker.velocity_control is not None:
+            logger.info(f"Velocity control: {tracker.velocity_control.stop()}")
+
+        # stop recording
+        drone.camera.media.stop_recording()
+        if getattr(olympe, "SIMULATED", False):
+            # the simulated drone has no media server, the stream recording is the only video
+            logger.info("Recording kept on the simulated drone")
+        else:
+            drone.camera.media.download_last_media()
+            logger.info("Recording downloaded")
+
+    finally:
+        # the mission data is written even if the mission failed
+        if tracker is not None:
+            tracker.close()
+            # never leave the control loop piloting a disconnected drone
+            if tracker.velocity_control is not None:
+                tracker.velocity_control.stop()
+        # Disconnect the drone
+        drone.disconnect()
+        logger.info("Drone disconnected")
+
+
+if __name__ == "__main__":
+    # Retrieve the filename from command-line arguments
+    if len(sys.argv) < 2:
+        print("Usage: python controller.py <output_directory>")
+        sys.exit(1)
+
+    # Setup logging
+    logging.basicConfig(level=logging.INFO)
+
+    model = load_model()
+
+    # set window properties (with error handling for headless environments)
+    try:
+        cv2.namedWindow('tracking', cv2.WINDOW_KEEPRATIO)
+        cv2.resizeWindow('tracking', 500, 500)
+        cv2.moveWindow('tracking', 0, 0)
+        logger.info("Display window created successfully")
+    except Exception as e:
+        logger.warning(f"Could not create display window: {e}. Continuing in headless mode.")
+
+    run_mission(sys.argv[1], model)
\ No newline at end of file
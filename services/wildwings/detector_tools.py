@@ -0,0 +1,224 @@
+# Build and compare the CPU detector backends.
+# The ONNX weights are exported once from the torch weights of the model store (needs ultralytics
+# and torch, at build time only), quantized to INT8 with calibration frames from real missions, and
+# registered in the model store next to the torch weights with their own checksum.
+#
+# Usage:
+#   python detector_tools.py export yolov5su [imgsz] [batch]   # batch > 1 registers yolov5su-onnx-b<batch> for the tiles (WILDWINGS_TILING)
+#   python detector_tools.py quantize yolov5su <frames directory or video> [max frames]
+#   python detector_tools.py benchmark <frames directory or video> [backends] [max frames]
+#       backends defaults to torch,onnx,onnx-int8, torch is the accuracy reference
+
+import os
+import sys
+import json
+import time
+import logging
+
+import cv2
+import numpy as np
+
+from model_store import store as model_store, latency_stats, DEFAULT_MODEL
+from detectors import letterbox_blob, load_detector, exported_name, INPUT_SIZE
+import navigation
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+CALIBRATION_FRAMES = 200
+BENCHMARK_FRAMES = 100
+MATCH_IOU = 0.5
+
+logger = logging.getLogger("wildwings.detectors")
+
+
+def load_frames(source, limit):
+    """
+    Read up to `limit` BGR frames from a directory of images or evenly spaced from a video.
+    Use raw frames (e.g. from the mission recordings), not the annotated evidence images
+    """
+    frames = []
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        step = max(1, len(names) // limit)
+        for name in names[::step][:limit]:
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                frames.append(frame)
+    else:
+        capture = cv2.VideoCapture(source)
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        step = max(1, total // limit)
+        for index in range(0, total, step):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+            if len(frames) >= limit:
+                break
+        capture.release()
+    if not frames:
+        raise ValueError(f"No frames found in {source}")
+    return frames
+
+
+def export(model_name=DEFAULT_MODEL, imgsz=INPUT_SIZE, batch=1, opset=12):
+    """
+    Export the torch weights to ONNX (static batchx3ximgszximgsz input) and register them as '<model>-onnx',
+    or '<model>-onnx-b<batch>' for batch > 1 so the batch 1 model the other tools use is kept
+    """
+    from ultralytics import YOLO
+
+    path = model_store.verify(model_name)
+    onnx_path = YOLO(path).export(format="onnx", imgsz=imgsz, batch=batch, opset=opset, simplify=True, dynamic=False)
+    if batch > 1:
+        # ultralytics always writes <weights>.onnx, the batched model gets its own file
+        batched_path = onnx_path.replace(".onnx", f"-b{batch}.onnx")
+        os.replace(onnx_path, batched_path)
+        onnx_path = batched_path
+    version = model_store.registry()[model_name].get("version")
+    return model_store.add(exported_name(model_name, batch=batch), onnx_path, version)
+
+
+class FrameCalibrationReader:
+    """
+    Feed the calibration frames to the ONNX Runtime quantizer with the same letterbox as inference
+    """
+    def __init__(self, frames, input_name, input_size):
+        self.input_name = input_name
+        self.blobs = iter([letterbox_blob(frame, input_size)[0] for frame in frames])
+
+    def get_next(self):
+        blob = next(self.blobs, None)
+        return None if blob is None else {self.input_name: blob}
+
+
+def quantize(model_name, source, limit=CALIBRATION_FRAMES):
+    """
+    Quantize '<model>-onnx' to INT8 (QDQ, per-channel weights) calibrated on real frames and register
+    it as '<model>-onnx-int8'. Only the convolutions are quantized, the box decoding stays in float
+    """
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType, CalibrationMethod
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    fp32_path = model_store.verify(f"{model_name}-onnx")
+    prepared_path = fp32_path.replace(".onnx", "-prep.onnx")
+    int8_path = fp32_path.replace(".onnx", "-int8.onnx")
+
+    session = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"])
+    model_input = session.get_inputs()[0]
+    frames = load_frames(source, limit)
+    logger.info(f"Calibrating on {len(frames)} frames from {source}")
+
+    quant_pre_process(fp32_path, prepared_path)
+    try:
+        quantize_static(
+            prepared_path,
+            int8_path,
+            FrameCalibrationReader(frames, model_input.name, model_input.shape[2]),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            op_types_to_quantize=["Conv"],
+            calibrate_method=CalibrationMethod.Percentile,
+        )
+    finally:
+        os.remove(prepared_path)
+
+    version = model_store.registry()[f"{model_name}-onnx"].get("version")
+    return model_store.add(f"{model_name}-onnx-int8", int8_path, version)
+
+
+def box_iou(a, b):
+    """
+    Pairwise IoU between two sets of xyxy boxes
+    """
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+def match(reference, detections, iou_threshold=MATCH_IOU):
+    """
+    Greedily match detections to the reference ones of the same class, returns the number of matches
+    """
+    if len(reference) == 0 or len(detections) == 0:
+        return 0
+    iou = box_iou(reference.xyxy, detections.xyxy)
+    iou[reference.cls[:, None] != detections.cls[None, :]] = 0
+    matches = 0
+    for j in np.argsort(-detections.conf):
+        i = iou[:, j].argmax()
+        if iou[i, j] >= iou_threshold:
+            matches += 1
+            iou[i, :] = 0
+    return matches
+
+def herd_centroid(detections):
+    return detections.xywh[:, :2].mean(axis=0) if len(detections) else None
+
+
+def benchmark(source, backends=("torch", "onnx", "onnx-int8"), limit=BENCHMARK_FRAMES, model_name=DEFAULT_MODEL):
+    """
+    Latency of every backend on the same frames, and its agreement with the torch detections:
+    precision/recall of the boxes, frames with the same animal count and herd centroid shift in pixels
+    """
+    frames = load_frames(source, limit)
+    reference = [load_detector(model_name, "torch")(frame) for frame in frames]
+
+    report = {}
+    for backend in backends:
+        detector = load_detector(model_name, backend)
+        latencies, matched, found, expected, same_count, shifts = [], 0, 0, 0, 0, []
+        for frame, ref in zip(frames, reference):
+            start = time.perf_counter()
+            detections = detector(frame)
+            latencies.append(time.perf_counter() - start)
+
+            matched += match(ref, detections)
+            found += len(detections)
+            expected += len(ref)
+            same_count += navigation.count_animals(detections) == navigation.count_animals(ref)
+            ref_centroid, centroid = herd_centroid(ref), herd_centroid(detections)
+            if ref_centroid is not None and centroid is not None:
+                shifts.append(float(np.linalg.norm(centroid - ref_centroid)))
+
+        report[backend] = dict(
+            latency_stats(latencies),
+            frames=len(frames),
+            fps=len(frames) / sum(latencies),
+            precision=matched / found if found else None,
+            recall=matched / expected if expected else None,
+            same_count=same_count / len(frames),
+            centroid_shift_px=sum(shifts) / len(shifts) if shifts else None,
+        )
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 3 or sys.argv[1] not in ("export", "quantize", "benchmark"):
+        print(
+            "Usage: python detector_tools.py export <name> [imgsz] [batch]"
+            " | quantize <name> <frames> [max frames]"
+            " | benchmark <frames> [torch,onnx,onnx-int8] [max frames]"
+        )
+        sys.exit(1)
+
+    if sys.argv[1] == "export":
+        print(export(
+            sys.argv[2],
+            int(sys.argv[3]) if len(sys.argv) > 3 else INPUT_SIZE,
+            int(sys.argv[4]) if len(sys.argv) > 4 else 1
+        ))
+    elif sys.argv[1] == "quantize":
+        print(quantize(sys.argv[2], sys.argv[3], int(sys.argv[4]) if len(sys.argv) > 4 else CALIBRATION_FRAMES))
+    else:
+        backends = sys.argv[3].split(",") if len(sys.argv) > 3 else ("torch", "onnx", "onnx-int8")
+        limit = int(sys.argv[4]) if len(sys.argv) > 4 else BENCHMARK_FRAMES
+        print(json.dumps(benchmark(sys.argv[2], backends, limit), indent=2))
@@ -0,0 +1,501 @@
+# Pluggable detector backends for wildwings.
+# Every backend returns the same Detections (numpy arrays), so navigation doesn't depend on
+# ultralytics result objects. The CPU backends run YOLO models exported to ONNX, optionally
+# quantized to INT8 (see detector_tools.py), without torch at runtime.
+#
+# The backend is chosen with the WILDWINGS_DETECTOR environment variable:
+#   torch     ultralytics + torch (default)
+#   onnx      ONNX Runtime on CPU, weights "<model>-onnx" from the model store
+#   onnx-int8 ONNX Runtime on CPU, weights "<model>-onnx-int8"
+#   openvino  OpenVINO on CPU, weights "<model>-onnx" (or "<model>-onnx-int8" with openvino-int8)
+# WILDWINGS_DETECTOR_BATCH > 1 loads the static batch export "<model>-onnx-b<N>" instead, for the tiles.
+
+import os
+import abc
+import time
+import threading
+import collections
+
+import cv2
+import numpy as np
+
+from model_store import store as model_store, latency_stats, DEFAULT_MODEL
+from yuv import YuvFrame, YuvLetterbox
+
+DETECTOR_BACKEND = os.environ.get("WILDWINGS_DETECTOR", "torch")
+DETECTOR_BATCH = int(os.environ.get("WILDWINGS_DETECTOR_BATCH", "1"))
+INPUT_SIZE = 640
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.45
+MAX_DETECTIONS = 300
+# COCO classes counted as animals: person 0, dog 16, zebra 17, sheep 18, cow 19, horse 22
+ANIMAL_CLASSES = (0, 16, 17, 18, 19, 22)
+
+
+class DetectionProfile:
+    """
+    Per-mission detection settings, applied inside the inference call so NMS and post-processing
+    only see the relevant classes. `classes=None` keeps every class. `imgsz` only applies to the
+    torch backend, the exported models have a fixed input size
+    """
+    def __init__(self, classes=ANIMAL_CLASSES, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, max_det=MAX_DETECTIONS, imgsz=INPUT_SIZE):
+        if classes is not None:
+            classes = tuple(sorted(int(c) for c in classes))
+            if not classes or classes[0] < 0 or classes[-1] > 255:
+                raise ValueError(f"Illegal detection classes {classes}")
+        if not 0.0 <= conf <= 1.0 or not 0.0 <= iou <= 1.0:
+            raise ValueError(f"Illegal conf {conf} or iou {iou}, they must be between 0 and 1")
+        if max_det < 1 or imgsz < 32 or imgsz % 32 != 0:
+            raise ValueError(f"Illegal max_det {max_det} or imgsz {imgsz} (a multiple of 32)")
+        self.classes = classes
+        self.conf = float(conf)
+        self.iou = float(iou)
+        self.max_det = int(max_det)
+        self.imgsz = int(imgsz)
+
+        # lookup table indexed by class id, so filtering and counting are a single gather
+        self.class_mask = np.zeros(256, dtype=bool)
+        if classes is None:
+            self.class_mask[:] = True
+        else:
+            self.class_mask[list(classes)] = True
+
+    @classmethod
+    def from_dict(cls, profile):
+        return cls(**{key: value for key, value in profile.items() if value is not None or key == "classes"})
+
+    def to_dict(self):
+        return {
+            "classes": list(self.classes) if self.classes is not None else None,
+            "conf": self.conf,
+            "iou": self.iou,
+            "max_det": self.max_det,
+            "imgsz": self.imgsz,
+        }
+
+DEFAULT_PROFILE = DetectionProfile()
+
+
+class Detections:
+    """
+    Boxes found in one frame: xyxy (N, 4) in frame pixels, conf (N,), cls (N,).
+    `image` is the BGR frame or the yuv.YuvFrame it was detected on
+    """
+    def __init__(self, xyxy, conf, cls, orig_shape, image=None, results=None, names=None):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.int64).reshape(-1)
+        self.orig_shape = tuple(orig_shape[:2]) # (height, width)
+        self.image = image
+        self.results = results
+        self.names = names
+
+    def __len__(self):
+        return len(self.cls)
+
+    def select(self, index):
+        """
+        Keep a subset of the boxes (boolean mask or indices)
+        """
+        return Detections(self.xyxy[index], self.conf[index], self.cls[index], self.orig_shape, self.image, self.results, self.names)
+
+    @property
+    def xywh(self):
+        xywh = np.empty_like(self.xyxy)
+        xywh[:, 0] = (self.xyxy[:, 0] + self.xyxy[:, 2]) / 2
+        xywh[:, 1] = (self.xyxy[:, 1] + self.xyxy[:, 3]) / 2
+        xywh[:, 2] = self.xyxy[:, 2] - self.xyxy[:, 0]
+        xywh[:, 3] = self.xyxy[:, 3] - self.xyxy[:, 1]
+        return xywh
+
+    def plot(self):
+        """
+        Draw the boxes on a copy of the frame
+        """
+        if self.results is not None:
+            return self.results[0].plot()
+        image = self.image.bgr() if isinstance(self.image, YuvFrame) else self.image.copy()
+        for (x1, y1, x2, y2), conf, cls in zip(self.xyxy.astype(int), self.conf, self.cls):
+            label = self.names.get(int(cls), str(cls)) if self.names else str(cls)
+            cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(image, f"{label} {conf:.2f}", (x1, max(y1 - 5, 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        return image
+
+    def save(self, path):
+        """
+        Save the frame with the boxes drawn on it
+        """
+        if self.results is not None:
+            self.results[0].save(path)
+        else:
+            cv2.imwrite(path, self.plot())
+
+
+def nms(boxes, scores, iou_threshold):
+    """
+    Greedy non-maximum suppression on xyxy boxes, returns the kept indices by decreasing score
+    """
+    order = np.argsort(-scores)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        rest = order[1:]
+        xx1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+def batched_nms(boxes, scores, classes, iou_threshold):
+    """
+    Class-aware NMS: boxes of different classes never suppress each other
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = classes.astype(np.float32)[:, None] * (boxes.max() + 1)
+    return nms(boxes + offsets, scores, iou_threshold)
+
+
+class Detector(abc.ABC):
+    """
+    Base class of the detector backends, times every call like model_store.ManagedModel
+    """
+    backend = "base"
+
+    def __init__(self, name):
+        self.name = name
+        self.version = None
+        self.load_time = None
+        self.warmup_latencies = []
+        self.latencies = collections.deque(maxlen=200)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    @abc.abstractmethod
+    def detect(self, frame, profile=DEFAULT_PROFILE, altitude=None):
+        """
+        Detect the boxes of a frame, `altitude` (meters) is only used by the detectors that adapt to it
+        """
+
+    def detect_batch(self, frames, profile=DEFAULT_PROFILE):
+        """
+        Detect the boxes of several images, in one inference call when the backend supports batches
+        """
+        return [self.detect(frame, profile) for frame in frames]
+
+    def check_profile(self, profile):
+        """
+        Raise a ValueError if the classes of a DetectionProfile don't exist in the model
+        """
+
+    def __call__(self, frame, profile=DEFAULT_PROFILE, altitude=None):
+        start = time.perf_counter()
+        detections = self.detect(frame, profile, altitude)
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(latency)
+            self.calls += 1
+        return detections
+
+    def warmup(self, runs=3, shape=(1080, 1920)):
+        frame = np.zeros((shape[0], shape[1], 3), dtype=np.uint8)
+        for _ in range(runs):
+            start = time.perf_counter()
+            self.detect(frame)
+            self.warmup_latencies.append(time.perf_counter() - start)
+
+    def stats(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            calls = self.calls
+        return dict(
+            latency_stats(latencies),
+            name=self.name,
+            backend=self.backend,
+            version=self.version,
+            load_time=self.load_time,
+            warmup_latencies=self.warmup_latencies,
+            calls=calls,
+        )
+
+
+class UltralyticsDetector(Detector):
+    """
+    The ultralytics + torch path
+    """
+    backend = "torch"
+
+    def __init__(self, model, name=DEFAULT_MODEL):
+        super().__init__(name)
+        self.model = model
+        self.version = getattr(model, "version", None)
+        self.load_time = getattr(model, "load_time", None)
+        self.warmup_latencies = list(getattr(model, "warmup_latencies", []))
+        self.yuv_letterboxes = {}
+
+    def detect(self, frame, profile=DEFAULT_PROFILE, altitude=None):
+        return self.detect_batch([frame], profile)[0]
+
+    def detect_batch(self, frames, profile=DEFAULT_PROFILE):
+        # YUV frames are reduced to the inference size before the conversion, ultralytics only pads them
+        # (the shared buffers can only be used for a single image)
+        scales = [1.0] * len(frames)
+        images = list(frames)
+        for i, frame in enumerate(frames):
+            if isinstance(frame, YuvFrame):
+                letterbox = self.yuv_letterboxes.setdefault(profile.imgsz, YuvLetterbox(profile.imgsz))
+                images[i], scales[i], _, _ = letterbox(frame, pad=False, reuse=len(frames) == 1)
+
+        # a list of images is inferred as one batch
+        results = self.model(
+            images,
+            classes=list(profile.classes) if profile.classes is not None else None,
+            conf=profile.conf,
+            iou=profile.iou,
+            max_det=profile.max_det,
+            imgsz=profile.imgsz,
+            verbose=False
+        )
+        detections = []
+        for frame, scale, result in zip(frames, scales, results):
+            if isinstance(frame, YuvFrame):
+                # back to frame pixels, the result draws on the reduced image so it isn't kept
+                xyxy = result.boxes.xyxy.cpu().numpy() / scale
+                xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, frame.shape[1])
+                xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, frame.shape[0])
+                detections.append(Detections(
+                    xyxy, result.boxes.conf.cpu().numpy(), result.boxes.cls.cpu().numpy(), frame.shape,
+                    image=frame, names=result.names,
+                ))
+            else:
+                detections.append(Detections(
+                    result.boxes.xyxy.cpu().numpy(),
+                    result.boxes.conf.cpu().numpy(),
+                    result.boxes.cls.cpu().numpy(),
+                    result.orig_shape,
+                    results=[result],
+                    names=result.names,
+                ))
+        return detections
+
+    def warmup(self, runs=3, shape=(1080, 1920)):
+        # already warmed up by the model store
+        if not self.warmup_latencies:
+            super().warmup(runs, shape)
+
+
+def letterbox_blob(frame, input_size):
+    """
+    Letterbox a BGR frame into the (1, 3, input_size, input_size) RGB blob of the exported models,
+    returns the blob with the scale and padding to map the boxes back
+    """
+    height, width = frame.shape[:2]
+    scale = min(input_size / height, input_size / width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    pad_x, pad_y = (input_size - new_w) // 2, (input_size - new_h) // 2
+    canvas = np.full((input_size, input_size, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)
+    return blob, scale, pad_x, pad_y
+
+
+class ExportedDetector(Detector):
+    """
+    Common pre/post-processing of YOLOv5u/YOLOv8 models exported to ONNX:
+    letterboxed RGB input, (batch, 4 + classes, anchors) output with xywh boxes and class scores
+    """
+    def __init__(self, name, input_size=INPUT_SIZE):
+        super().__init__(name)
+        self.input_size = input_size
+        # static batch size of the exported model, None if the batch dimension is dynamic
+        self.batch_size = 1
+        self.names = None
+        # number of classes of the model output, from its shape or its class names
+        self.num_classes = None
+        self.yuv_letterbox = None
+
+    def preprocess(self, frame):
+        if isinstance(frame, YuvFrame):
+            # resized on the YUV planes, only the model input is converted
+            if self.yuv_letterbox is None or self.yuv_letterbox.input_size != self.input_size:
+                self.yuv_letterbox = YuvLetterbox(self.input_size)
+            canvas, scale, pad_x, pad_y = self.yuv_letterbox(frame)
+            return cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True), scale, pad_x, pad_y
+        return letterbox_blob(frame, self.input_size)
+
+    def postprocess(self, output, frame, scale, pad_x, pad_y, profile=DEFAULT_PROFILE):
+        predictions = output.T # (anchors, 4 + classes) of one image
+        # only score the classes of the profile, the other ones never reach the NMS
+        if profile.classes is None:
+            classes = np.arange(predictions.shape[1] - 4)
+            class_scores = predictions[:, 4:]
+        else:
+            classes = np.asarray(profile.classes)
+            class_scores = predictions[:, 4 + classes]
+        best = class_scores.argmax(axis=1)
+        conf = class_scores[np.arange(len(best)), best]
+        mask = conf >= profile.conf
+        predictions, cls, conf = predictions[mask], classes[best[mask]], conf[mask]
+
+        xyxy = np.empty((len(predictions), 4), dtype=np.float32)
+        xyxy[:, 0] = predictions[:, 0] - predictions[:, 2] / 2
+        xyxy[:, 1] = predictions[:, 1] - predictions[:, 3] / 2
+        xyxy[:, 2] = predictions[:, 0] + predictions[:, 2] / 2
+        xyxy[:, 3] = predictions[:, 1] + predictions[:, 3] / 2
+
+        keep = batched_nms(xyxy, conf, cls, profile.iou)[:profile.max_det]
+        xyxy, conf, cls = xyxy[keep], conf[keep], cls[keep]
+
+        # undo the letterbox
+        xyxy[:, [0, 2]] = (xyxy[:, [0, 2]] - pad_x) / scale
+        xyxy[:, [1, 3]] = (xyxy[:, [1, 3]] - pad_y) / scale
+        height, width = frame.shape[:2]
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, width)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, height)
+        return Detections(xyxy, conf, cls, frame.shape, image=frame, names=self.names)
+
+    @abc.abstractmethod
+    def run(self, blob):
+        """
+        Infer a (batch, 3, input_size, input_size) blob, returns the (batch, 4 + classes, anchors) output
+        """
+
+    def check_profile(self, profile):
+        num_classes = self.num_classes if self.num_classes is not None else (len(self.names) if self.names else None)
+        # profile.classes is sorted, the scores of the profile classes are gathered from the output
+        if profile.classes is not None and num_classes is not None and profile.classes[-1] >= num_classes:
+            raise ValueError(f"Illegal detection classes {profile.classes}, model '{self.name}' has {num_classes} classes")
+
+    def detect(self, frame, profile=DEFAULT_PROFILE, altitude=None):
+        return self.detect_batch([frame], profile)[0]
+
+    def detect_batch(self, frames, profile=DEFAULT_PROFILE):
+        self.check_profile(profile)
+        inputs = [self.preprocess(frame) for frame in frames]
+        blobs = np.concatenate([blob for blob, _, _, _ in inputs])
+        batch_size = self.batch_size or len(frames)
+        outputs = []
+        for start in range(0, len(frames), batch_size):
+            batch = blobs[start:start + batch_size]
+            if len(batch) < batch_size:
+                # static batch models need a full batch
+                batch = np.concatenate([batch, np.zeros((batch_size - len(batch),) + batch.shape[1:], dtype=batch.dtype)])
+            outputs.append(self.run(batch)[:len(frames) - start])
+        outputs = np.concatenate(outputs)
+        return [
+            self.postprocess(output, frame, scale, pad_x, pad_y, profile)
+            for output, frame, (_, scale, pad_x, pad_y) in zip(outputs, frames, inputs)
+        ]
+
+
+class OnnxDetector(ExportedDetector):
+    """
+    ONNX Runtime on CPU, FP32 or INT8 (QDQ) models
+    """
+    backend = "onnx"
+
+    def __init__(self, path, name, threads=None):
+        super().__init__(name)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_size = model_input.shape[2]
+        self.batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        channels = self.session.get_outputs()[0].shape[1]
+        self.num_classes = channels - 4 if isinstance(channels, int) else None
+        names = self.session.get_modelmeta().custom_metadata_map.get("names")
+        if names:
+            # ultralytics stores the class names as a python dict literal
+            import ast
+            self.names = ast.literal_eval(names)
+
+    def run(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVinoDetector(ExportedDetector):
+    """
+    OpenVINO on CPU, reads the same ONNX files (INT8 QDQ models run as INT8)
+    """
+    backend = "openvino"
+
+    def __init__(self, path, name):
+        super().__init__(name)
+        import openvino as ov
+
+        core = ov.Core()
+        self.compiled = core.compile_model(core.read_model(path), "CPU", {"PERFORMANCE_HINT": "LATENCY"})
+        self.request = self.compiled.create_infer_request()
+        shape = self.compiled.input(0).partial_shape
+        self.input_size = shape[2].get_length()
+        self.batch_size = shape[0].get_length() if shape[0].is_static else None
+        channels = self.compiled.output(0).partial_shape[1]
+        self.num_classes = channels.get_length() - 4 if channels.is_static else None
+
+    def run(self, blob):
+        self.request.infer({0: blob})
+        # the output tensor is reused by the next inference
+        return self.request.get_output_tensor(0).data.copy()
+
+
+def exported_name(model_name, int8=False, batch=1):
+    """
+    Model store entry of an exported model: '<model>-onnx', '<model>-onnx-int8', or '<model>-onnx-b<N>'
+    for a static batch of N (the INT8 model is quantized from the batch 1 export)
+    """
+    if int8:
+        return f"{model_name}-onnx-int8"
+    return f"{model_name}-onnx" if batch <= 1 else f"{model_name}-onnx-b{batch}"
+
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+def load_detector(model_name=DEFAULT_MODEL, backend=DETECTOR_BACKEND):
+    """
+    Load the detector of a model for a backend once, warm it up and share it across mission runs
+    """
+    with _detectors_lock:
+        key = (model_name, backend)
+        if key in _detectors:
+            return _detectors[key]
+
+        if backend == "torch":
+            detector = UltralyticsDetector(model_store.load(model_name), model_name)
+        else:
+            entry_name = exported_name(model_name, backend.endswith("-int8"), DETECTOR_BATCH)
+            path = model_store.verify(entry_name)
+            start = time.perf_counter()
+            if backend.startswith("onnx"):
+                detector = OnnxDetector(path, entry_name)
+            elif backend.startswith("openvino"):
+                detector = OpenVinoDetector(path, entry_name)
+            else:
+                raise ValueError(f"Unknown detector backend '{backend}'")
+            detector.load_time = time.perf_counter() - start
+            detector.version = model_store.registry()[entry_name].get("version")
+            detector.warmup()
+            # report the exported model on /models next to the torch one
+            model_store.loaded[entry_name] = detector
+
+        _detectors[key] = detector
+        return detector
+
+def as_detector(model):
+    """
+    Accept a Detector or a plain ultralytics model
+    """
+    return model if isinstance(model, Detector) else UltralyticsDetector(model)
@@ -0,0 +1,201 @@
+# Annotated evidence frames written off the control path.
+# The decision only hands the frame and its detections to a bounded queue; a small pool of worker
+# threads draws the boxes, downsizes, JPEG encodes and writes the files (OpenCV releases the GIL
+# while encoding). When the workers fall behind the oldest pending frame is dropped, the decision
+# never waits for the disk or the encoder.
+#
+# Which decision frames are kept is set by a sampling policy, any matching rule saves the frame:
+#   WILDWINGS_EVIDENCE_EVERY       every N decisions, 0 to disable the rule (default 1, every decision)
+#   WILDWINGS_EVIDENCE_ON_CHANGE   when the animal count changes (default 0)
+#   WILDWINGS_EVIDENCE_MIN_COUNT   when at least this many animals are seen, 0 to disable the rule (default 0)
+# and encoded with WILDWINGS_EVIDENCE_QUALITY (JPEG quality) and WILDWINGS_EVIDENCE_MAX_SIZE
+# (longest side in pixels, 0 for the full frame).
+
+import os
+import time
+import logging
+import threading
+import collections
+
+import cv2
+
+from model_store import latency_stats
+from yuv import YuvFrame
+
+EVIDENCE_EVERY = int(os.getenv("WILDWINGS_EVIDENCE_EVERY", "1"))
+EVIDENCE_ON_CHANGE = os.getenv("WILDWINGS_EVIDENCE_ON_CHANGE", "0") == "1"
+EVIDENCE_MIN_COUNT = int(os.getenv("WILDWINGS_EVIDENCE_MIN_COUNT", "0"))
+EVIDENCE_QUALITY = int(os.getenv("WILDWINGS_EVIDENCE_QUALITY", "90"))
+EVIDENCE_MAX_SIZE = int(os.getenv("WILDWINGS_EVIDENCE_MAX_SIZE", "0"))
+EVIDENCE_WORKERS = 2
+EVIDENCE_QUEUE = 8 # frames waiting for a worker, the oldest is dropped beyond
+
+logger = logging.getLogger("wildwings.evidence")
+
+
+class SamplingPolicy:
+    """
+    Decide which decision frames are saved: every `every` decisions, when the count changes,
+    or when at least `min_count` animals are seen. The state is per mission
+    """
+    def __init__(self, every=EVIDENCE_EVERY, on_change=EVIDENCE_ON_CHANGE, min_count=EVIDENCE_MIN_COUNT):
+        if every < 0 or min_count < 0:
+            raise ValueError(f"Illegal sampling policy: every={every}, min_count={min_count}")
+        self.every = every
+        self.on_change = on_change
+        self.min_count = min_count
+        self.reset()
+
+    def reset(self):
+        self.decisions = 0
+        self.last_count = None
+
+    def should_save(self, count):
+        self.decisions += 1
+        changed = self.last_count is not None and count != self.last_count
+        self.last_count = count
+        return (
+            (self.every > 0 and (self.decisions - 1) % self.every == 0)
+            or (self.on_change and changed)
+            or (self.min_count > 0 and count >= self.min_count)
+        )
+
+    def to_dict(self):
+        return {"every": self.every, "on_change": self.on_change, "min_count": self.min_count}
+
+
+def encode(detections, quality=EVIDENCE_QUALITY, max_size=EVIDENCE_MAX_SIZE):
+    """
+    Draw the boxes on the frame, downsize its longest side to `max_size` and JPEG encode it
+    """
+    image = detections.plot()
+    height, width = image.shape[:2]
+    if max_size and max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("JPEG encoding failed")
+    return buffer
+
+
+class EvidenceWriter:
+    """
+    Bounded queue of (detections, path) and the worker threads rendering and writing them
+    """
+    def __init__(self, policy=None, quality=EVIDENCE_QUALITY, max_size=EVIDENCE_MAX_SIZE, workers=EVIDENCE_WORKERS, max_queue=EVIDENCE_QUEUE):
+        if not 1 <= quality <= 100 or max_size < 0 or workers < 1 or max_queue < 1:
+            raise ValueError(f"Illegal evidence settings: quality={quality}, max_size={max_size}, workers={workers}, max_queue={max_queue}")
+        self.policy = policy if policy is not None else SamplingPolicy()
+        self.quality = quality
+        self.max_size = max_size
+        self.max_queue = max_queue
+        self.condition = threading.Condition()
+        self.pending = collections.deque()
+        self.busy = 0
+        self.closed = False
+
+        self.submitted = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self.encode_latencies = collections.deque(maxlen=1000)
+
+        self.workers = [
+            threading.Thread(target=self._work, name=f"WildWings-Evidence-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def reset(self):
+        """
+        Start the sampling of a new mission
+        """
+        self.policy.reset()
+
+    def submit(self, detections, path, count):
+        """
+        Queue the annotated frame for `path` if the sampling policy keeps it, never blocks.
+        The BGR frame of `detections` must not be modified afterwards, a yuv.YuvFrame is copied
+        """
+        self.submitted += 1
+        if not self.policy.should_save(count):
+            self.sampled_out += 1
+            return False
+        if isinstance(detections.image, YuvFrame):
+            # the stream frame is released after the decision, keep a copy of its planes
+            detections.image.detach()
+        with self.condition:
+            if self.closed:
+                return False
+            if len(self.pending) >= self.max_queue:
+                # the workers are behind, keep the freshest evidence
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append((detections, path))
+            self.condition.notify()
+        return True
+
+    def _work(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                detections, path = self.pending.popleft()
+                self.busy += 1
+            try:
+                start = time.perf_counter()
+                buffer = encode(detections, self.quality, self.max_size)
+                self.encode_latencies.append(time.perf_counter() - start)
+                # written under a temporary name, a partial file is never left with the final name
+                temporary = path + ".tmp"
+                with open(temporary, "wb") as file:
+                    file.write(buffer.tobytes())
+                os.replace(temporary, path)
+                with self.condition:
+                    self.written += 1
+            except Exception as e:
+                with self.condition:
+                    self.errors += 1
+                logger.error(f"Writing evidence {path} failed: {e}")
+            finally:
+                with self.condition:
+                    self.busy -= 1
+                    self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until the queued frames are written, returns False on timeout
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and self.busy == 0, timeout)
+
+    def close(self, timeout=10.0):
+        """
+        Write the queued frames and stop the workers
+        """
+        self.flush(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def stats(self):
+        with self.condition:
+            stats = {
+                "policy": self.policy.to_dict(),
+                "quality": self.quality,
+                "max_size": self.max_size,
+                "submitted": self.submitted,
+                "sampled_out": self.sampled_out,
+                "dropped": self.dropped,
+                "written": self.written,
+                "errors": self.errors,
+                "pending": len(self.pending),
+            }
+        stats["encode"] = latency_stats(list(self.encode_latencies))
+        return stats
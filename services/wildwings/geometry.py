@@ -0,0 +1,188 @@
+# Camera geometry of the drone: projects pixels of the stream to ground offsets in meters.
+# The herd offset from the image center becomes a proportional, clamped move, so the herd is
+# re-centered in one or two decisions instead of many fixed 10 m steps.
+#
+# Disabled with WILDWINGS_GEOMETRY=0 (back to the fixed steps of navigation.py), the fixed steps are
+# also used for the frames whose height above ground is unknown.
+
+import os
+import math
+
+GEOMETRY_ENABLED = os.getenv("WILDWINGS_GEOMETRY", "1") == "1"
+CAMERA_HFOV = 69.0 # degrees, horizontal field of view of the Anafi stream
+DEFAULT_GIMBAL_PITCH = float(os.getenv("WILDWINGS_GIMBAL_PITCH", "-90")) # degrees, used when the frame metadata has no attitude
+MAX_RANGE = 200.0 # meters, ground distance used for rays at or above the horizon
+METERS_PER_DEGREE = 111320.0 # meters per degree of latitude, equirectangular approximation
+
+GAIN = 0.8 # fraction of the ground offset moved in one decision, < 1 to avoid overshooting
+MAX_STEP = 15.0 # meters, largest horizontal move of one decision
+MAX_VERTICAL_STEP = 5.0 # meters
+DEADBAND = 1/8 # fraction of the frame around the center where the herd is considered centered
+TARGET_FILL = (0.1, 0.75) # fraction of the frame the herd extent should span
+MIN_ALTITUDE, MAX_ALTITUDE = 10.0, 40.0 # meters above ground
+
+
+class CameraPose:
+    """
+    Height above ground (meters, None when unknown), camera pitch (degrees, 0 at the horizon, -90 pointing down)
+    and horizontal field of view of a frame
+    """
+    def __init__(self, altitude, pitch=DEFAULT_GIMBAL_PITCH, hfov=CAMERA_HFOV):
+        self.altitude = altitude
+        self.pitch = pitch
+        self.hfov = hfov
+
+    def to_dict(self):
+        return {"altitude": self.altitude, "pitch": self.pitch, "hfov": self.hfov}
+
+    @classmethod
+    def from_dict(cls, pose):
+        return cls(**pose) if pose is not None else None
+
+
+def quaternion_pitch(quat):
+    """
+    Pitch in degrees of a {w, x, y, z} attitude quaternion (NED frame)
+    """
+    w, x, y, z = (float(quat[key]) for key in ("w", "x", "y", "z"))
+    return math.degrees(math.asin(max(-1.0, min(1.0, 2 * (w * y - z * x)))))
+
+def camera_pose(vmeta, height=None, hfov=CAMERA_HFOV):
+    """
+    Camera pose of a frame from its video metadata (yuv_frame.vmeta()), falling back to `height`
+    (above the takeoff point, AltitudeChanged) and DEFAULT_GIMBAL_PITCH for what the metadata doesn't have.
+    The altitude is None when neither is known: the telemetry altitude is above sea level, not above ground
+    """
+    altitude = float(height) if height is not None else None
+    pitch = DEFAULT_GIMBAL_PITCH
+    metadata = vmeta[1] if isinstance(vmeta, (tuple, list)) and len(vmeta) > 1 else vmeta
+    if isinstance(metadata, dict):
+        # v3 metadata has a "base" section, v2 has "drone" and "camera" sections
+        base = metadata.get("base", {})
+        drone = metadata.get("drone", {})
+        camera = metadata.get("camera", {})
+        ground_distance = base.get("ground_distance", drone.get("ground_distance"))
+        if ground_distance:
+            altitude = float(ground_distance)
+        quat = base.get("frame_quat", camera.get("quat"))
+        if quat:
+            pitch = quaternion_pitch(quat)
+    return CameraPose(altitude, pitch, hfov)
+
+
+def focal_length_px(width, hfov=CAMERA_HFOV):
+    return (width / 2) / math.tan(math.radians(hfov) / 2)
+
+def pixel_to_ground(px, py, shape, pose):
+    """
+    Ground point (forward, right) in meters from the drone of the ray through pixel (px, py)
+    """
+    height, width = shape[:2]
+    focal = focal_length_px(width, pose.hfov)
+    u = (px - width / 2) / focal
+    v = (py - height / 2) / focal
+    depression = math.radians(-pose.pitch)
+    # ray in the drone frame (forward, right, down)
+    forward = math.cos(depression) - math.sin(depression) * v
+    down = math.sin(depression) + math.cos(depression) * v
+    right = u
+    if down <= 1e-6:
+        # at or above the horizon, the ground is out of reach
+        horizontal = math.hypot(forward, right) or 1.0
+        return MAX_RANGE * forward / horizontal, MAX_RANGE * right / horizontal
+    t = pose.altitude / down
+    forward, right = t * forward, t * right
+    distance = math.hypot(forward, right)
+    if distance > MAX_RANGE:
+        forward, right = forward * MAX_RANGE / distance, right * MAX_RANGE / distance
+    return forward, right
+
+def ground_to_pixel(forward, right, shape, pose):
+    """
+    Pixel (px, py) of the ground point (forward, right) in meters from the drone, None behind the camera
+    """
+    height, width = shape[:2]
+    focal = focal_length_px(width, pose.hfov)
+    depression = math.radians(-pose.pitch)
+    # depth along the optical axis, then the image axes (right, and down in the image)
+    depth = forward * math.cos(depression) + pose.altitude * math.sin(depression)
+    if depth <= 1e-6:
+        return None
+    u = right / depth
+    v = (pose.altitude * math.cos(depression) - forward * math.sin(depression)) / depth
+    return width / 2 + u * focal, height / 2 + v * focal
+
+def moved_pixels(points, move, shape, pose):
+    """
+    Where the ground seen at pixels `points` ((N, 2) array) appears once the drone made `move`
+    (x forward, y right, z up, in meters). Points that would leave the camera are kept in place
+    """
+    forward, right, up = move
+    after = CameraPose(max(pose.altitude + up, 1.0), pose.pitch, pose.hfov)
+    moved = []
+    for px, py in points:
+        ground_forward, ground_right = pixel_to_ground(px, py, shape, pose)
+        pixel = ground_to_pixel(ground_forward - forward, ground_right - right, shape, after)
+        moved.append(pixel if pixel is not None else (px, py))
+    return moved
+
+def flown_move(before, after):
+    """
+    Displacement (x forward, y right, z up) in meters of the drone between two positions
+    (latitude, longitude, height above takeoff, yaw in radians from north), in the body frame of `before`
+    """
+    latitude, longitude, height, yaw = before
+    north = (after[0] - latitude) * METERS_PER_DEGREE
+    east = (after[1] - longitude) * METERS_PER_DEGREE * math.cos(math.radians(latitude))
+    return (
+        north * math.cos(yaw) + east * math.sin(yaw),
+        -north * math.sin(yaw) + east * math.cos(yaw),
+        after[2] - height,
+    )
+
+def ground_offset(px, py, shape, pose):
+    """
+    Ground offset (forward, right) in meters between pixel (px, py) and the image center
+    """
+    height, width = shape[:2]
+    target_forward, target_right = pixel_to_ground(px, py, shape, pose)
+    center_forward, center_right = pixel_to_ground(width / 2, height / 2, shape, pose)
+    return target_forward - center_forward, target_right - center_right
+
+def clamp(value, limit):
+    return max(-limit, min(limit, value))
+
+def herd_move(centroid_herd, herd_bbox, shape, pose, gain=GAIN, max_step=MAX_STEP):
+    """
+    Move (x forward, y right, z up, in meters, same convention as navigation.herd_move) bringing the
+    herd centroid to the image center, proportional to its ground offset and clamped to `max_step`.
+    The altitude changes to keep the herd extent within TARGET_FILL of the frame
+    """
+    height, width = shape[:2]
+    cx, cy = centroid_herd
+    direction_x = direction_y = direction_z = 0.0
+
+    if abs(cx - width / 2) > width * DEADBAND or abs(cy - height / 2) > height * DEADBAND:
+        forward, right = ground_offset(cx, cy, shape, pose)
+        # a proportional move along the offset, the direction is kept when clamping
+        forward, right = gain * forward, gain * right
+        distance = math.hypot(forward, right)
+        if distance > max_step:
+            forward, right = forward * max_step / distance, right * max_step / distance
+        direction_x, direction_y = forward, right
+
+    x1, y1, x2, y2 = herd_bbox
+    fill = max((x2 - x1) / width, (y2 - y1) / height)
+    if fill > TARGET_FILL[1]:
+        # the footprint grows linearly with the altitude
+        direction_z = pose.altitude * (fill / TARGET_FILL[1] - 1)
+    elif 0 < fill < TARGET_FILL[0]:
+        direction_z = -pose.altitude * (1 - fill / TARGET_FILL[0])
+    direction_z = clamp(direction_z, MAX_VERTICAL_STEP)
+    # never climb above MAX_ALTITUDE nor descend below MIN_ALTITUDE, whichever way the move goes
+    if direction_z > 0:
+        direction_z = max(0.0, min(direction_z, MAX_ALTITUDE - pose.altitude))
+    elif direction_z < 0:
+        direction_z = min(0.0, max(direction_z, MIN_ALTITUDE - pose.altitude))
+
+    return round(direction_x, 2), round(direction_y, 2), round(direction_z, 2)
@@ -1,25 +1,30 @@
+import time
+# process start, the import-time report measures how long the HTTP API takes to come up
+STARTED = time.perf_counter()
 import logging
 import toml
-import threading
-import subprocess
 import datetime
 import os
-import time
 import json
 import asyncio
-from typing import List
+from typing import List, Optional
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
 from pathlib import Path
+from worker import MissionWorker
+# model_store and detectors (numpy, cv2) are imported by the endpoints that need them, after the worker
+# has loaded them in the background, so the HTTP API comes up without them
 
 config_path = Path("/app/config.toml")
 if not config_path.exists():
     config_path = Path(__file__).parent.parent.parent / "config.toml"
 config = toml.load(config_path)
 wildwings_config = config["wildwings"]
+# default detection profile of the missions, each field can be overridden per mission on /start_mission
+detection_config = wildwings_config.get("detection", {})
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,10 +38,21 @@ logger = logging.getLogger("wildwings")
 
 logs: List[str] = []
 is_running = False
-current_process = None
+http_up = None
+worker = MissionWorker(log_callback=logs.append)
 
-def run_mission():
-    global logs, is_running, current_process
+def on_mission_finished(error):
+    global is_running
+    if error is None:
+        logs.append("Mission completed")
+        logger.info("Mission completed successfully")
+    else:
+        logs.append(f"Error: {error}")
+        logger.error(f"Mission failed: {error}")
+    is_running = False
+
+def run_mission(profile):
+    global logs, is_running
     try:
         is_running = True
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -45,35 +61,15 @@ def run_mission():
         os.makedirs("logs", exist_ok=True)
         
         logs.append(f"Starting mission at {timestamp}")
-        logger.info(f"Starting mission with output directory: {output_dir}")
-        
-        current_process = subprocess.Popen(
-            ["conda", "run", "-n", "wildwing", "python", "controller.py", output_dir],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
+        logger.info(f"Starting mission with output directory: {output_dir}, detection profile: {profile.to_dict()}")
         
-        for line in current_process.stdout:
-            if current_process.poll() is None or line:
-                log_entry = line.strip()
-                if log_entry:  # Only add non-empty lines
-                    logs.append(log_entry)
-                    logger.info(f"Mission log: {log_entry}")
-            else:
-                break
-        
-        current_process.wait()
-        logs.append("Mission completed")
-        logger.info("Mission completed successfully")
+        worker.start_mission(output_dir, on_finished=on_mission_finished, profile=profile)
         
     except Exception as e:
         error_msg = f"Error: {str(e)}"
         logs.append(error_msg)
         logger.error(f"Mission failed: {str(e)}")
-    finally:
         is_running = False
-        current_process = None
 
 async def log_stream_generator():
     yield f"data: {json.dumps({'message': 'Mission started', 'status': 'running'})}\n\n"
@@ -93,14 +89,17 @@ async def log_stream_generator():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global http_up
     logger.info("WildWings service starting up")
+    worker.start_loading()
+    http_up = time.perf_counter() - STARTED
+    logger.info(f"HTTP API up {http_up:.2f}s after process start")
     yield
     logger.info("WildWings service shutting down")
-    global current_process, is_running
-    if current_process and is_running:
-        logger.info("Terminating running mission during shutdown")
-        current_process.terminate()
-        is_running = False
+    if worker.is_running:
+        logger.info("Stopping running mission during shutdown")
+        worker.stop_mission(timeout=10.0)
+    worker.close()
 
 app = FastAPI(
     title="WildWings Service",
@@ -123,10 +122,32 @@ async def root():
     return {"message": "WildWings Service", "status": "running"}
 
 @app.post("/start_mission")
-async def start_mission():
+async def start_mission(
+    classes: Optional[str] = None,
+    conf: Optional[float] = None,
+    iou: Optional[float] = None,
+    max_det: Optional[int] = None,
+    imgsz: Optional[int] = None
+):
     logger.info("Start mission endpoint accessed")
     
     global logs, is_running
+    from detectors import DetectionProfile
+
+    # classes is a comma separated list of COCO class ids, or "all"
+    overrides = {"conf": conf, "iou": iou, "max_det": max_det, "imgsz": imgsz}
+    if classes is not None:
+        try:
+            overrides["classes"] = None if classes == "all" else [int(c) for c in classes.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid classes '{classes}'")
+    try:
+        profile = DetectionProfile.from_dict({
+            **detection_config,
+            **{key: value for key, value in overrides.items() if value is not None or key == "classes"}
+        })
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     if is_running:
         async def error_stream():
@@ -143,7 +164,7 @@ async def start_mission():
         )
     
     logs.clear()
-    threading.Thread(target=run_mission, name="WildWings-Mission").start()
+    run_mission(profile)
     
     return StreamingResponse(
         log_stream_generator(),
@@ -159,29 +180,22 @@ async def start_mission():
 async def stop_mission():
     logger.info("Stop mission endpoint accessed")
     
-    global is_running, current_process
-    
     if not is_running:
         logger.error("No mission currently running")
         raise HTTPException(status_code=400, detail="No mission running")
     
-    if current_process:
-        try:
-            current_process.terminate()
-            logs.append("Mission stopped by user")
-            is_running = False
-            logger.info("Mission stopped by user request")
-            
-            return {
-                "message": "Mission stopped", 
-                "status": "stopped"
-            }
-        except Exception as e:
-            logger.error(f"Failed to stop mission: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to stop mission: {str(e)}")
-    else:
-        logger.error("No process to terminate")
-        raise HTTPException(status_code=400, detail="No process to terminate")
+    try:
+        worker.stop_mission()
+        logs.append("Mission stopped by user")
+        logger.info("Mission stopped by user request")
+        
+        return {
+            "message": "Mission stopped", 
+            "status": "stopped"
+        }
+    except Exception as e:
+        logger.error(f"Failed to stop mission: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to stop mission: {str(e)}")
 
 @app.get("/mission_status")
 async def mission_status():
@@ -194,7 +208,38 @@ async def mission_status():
         "status": status,
         "is_running": is_running,
         "total_logs": len(logs),
-        "recent_logs": recent_logs
+        "recent_logs": recent_logs,
+        "worker": worker.status()
+    }
+
+@app.get("/livez")
+async def livez():
+    return {"status": "alive", "uptime": time.perf_counter() - STARTED}
+
+@app.get("/readyz")
+async def readyz():
+    # ready once the frame pipeline, the drone stack and the model are warm
+    checks = worker.startup.checks()
+    ready = worker.startup.ready() and worker.load_error is None
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "warming", "checks": checks, "error": worker.load_error}
+    )
+
+@app.get("/startup")
+async def startup():
+    return {
+        "http_up": http_up,
+        "load_time": worker.load_time,
+        **worker.startup.report()
+    }
+
+@app.get("/models")
+async def models():
+    from model_store import store as model_store
+    return {
+        "models": model_store.describe(),
+        "worker": worker.status()
     }
 
 @app.get("/logs")
@@ -0,0 +1,245 @@
+# Columnar mission data: telemetry and detections of every decision.
+# Rows are buffered in preallocated numpy structured arrays and written as chunk files
+# (<table>-<n>.npy) when a chunk is full or every `flush_interval` seconds, so a decision never
+# opens a file and a crash loses at most the last few seconds. The dtype of every table is stored
+# in schema.json next to the chunks, and a whole mission loads back with one np.load per chunk.
+#
+# Usage:
+#   python mission_log.py <mission directory> [<export directory>]   # summary, CSV export of every table
+
+import os
+import sys
+import json
+import time
+import glob
+import threading
+
+import numpy as np
+
+LOG_DIRECTORY = "mission_log"
+SCHEMA_VERSION = 1
+CHUNK_ROWS = 4096
+FLUSH_INTERVAL = 5.0 # seconds
+
+TELEMETRY_DTYPE = np.dtype([
+    ("timestamp", "f8"), # unix time of the decision
+    ("frame", "i8"),
+    ("latitude", "f8"),
+    ("longitude", "f8"),
+    ("altitude", "f4"), # meters, telemetry
+    ("ground_distance", "f4"), # meters, height above ground of the camera pose
+    ("pitch", "f4"), # degrees, camera pitch
+    ("width", "i4"),
+    ("height", "i4"),
+    ("move_x", "f4"),
+    ("move_y", "f4"),
+    ("move_z", "f4"),
+    ("reused", "?"),
+])
+DETECTIONS_DTYPE = np.dtype([
+    ("timestamp", "f8"),
+    ("frame", "i8"),
+    ("x1", "f4"),
+    ("y1", "f4"),
+    ("x2", "f4"),
+    ("y2", "f4"),
+    ("conf", "f4"),
+    ("cls", "i2"),
+])
+TABLES = {"telemetry": TELEMETRY_DTYPE, "detections": DETECTIONS_DTYPE}
+
+
+def dtype_to_schema(dtype):
+    return [[name, dtype.fields[name][0].str] for name in dtype.names]
+
+def schema_to_dtype(schema):
+    return np.dtype([(name, type_str) for name, type_str in schema])
+
+
+class ChunkedTable:
+    """
+    Append-only table buffered in a structured array of `chunk_rows` rows, written as .npy chunks
+    """
+    def __init__(self, directory, name, dtype, chunk_rows=CHUNK_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.name = name
+        self.dtype = dtype
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.buffer = np.zeros(chunk_rows, dtype=dtype)
+        self.size = 0
+        # never overwrite the chunks of a previous run in the same directory
+        self.next_chunk = len(glob.glob(os.path.join(directory, f"{name}-*.npy")))
+        self.last_flush = time.monotonic()
+        self.rows = 0
+        self.chunks = 0
+
+    def append(self, row):
+        """
+        Append one row given as a tuple in the order of the dtype fields
+        """
+        with self.lock:
+            self.buffer[self.size] = row
+            self.size += 1
+            self.rows += 1
+            if self.size == len(self.buffer) or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def extend(self, rows):
+        """
+        Append a structured array of rows with the dtype of the table
+        """
+        with self.lock:
+            start = 0
+            while start < len(rows):
+                count = min(len(rows) - start, len(self.buffer) - self.size)
+                self.buffer[self.size:self.size + count] = rows[start:start + count]
+                self.size += count
+                start += count
+                if self.size == len(self.buffer):
+                    self._flush()
+            self.rows += len(rows)
+            if self.size and time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if self.size == 0:
+            return
+        path = os.path.join(self.directory, f"{self.name}-{self.next_chunk:05d}.npy")
+        # written under a temporary name, the reader never sees a partial chunk
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, self.buffer[:self.size])
+        os.replace(temporary, path)
+        self.next_chunk += 1
+        self.chunks += 1
+        self.size = 0
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+
+class MissionLog:
+    """
+    Telemetry and detection tables of a mission, in `<output_directory>/mission_log`.
+    Tables are created on first use, so the stream process and the inference process can each
+    write their own tables of the same mission
+    """
+    def __init__(self, output_directory, chunk_rows=CHUNK_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.directory = os.path.join(output_directory, LOG_DIRECTORY)
+        os.makedirs(self.directory, exist_ok=True)
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.tables = {}
+        schema_path = os.path.join(self.directory, "schema.json")
+        if not os.path.exists(schema_path):
+            schema = {
+                "version": SCHEMA_VERSION,
+                "tables": {name: dtype_to_schema(dtype) for name, dtype in TABLES.items()},
+            }
+            temporary = f"{schema_path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as file:
+                json.dump(schema, file, indent=2)
+            os.replace(temporary, schema_path)
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = ChunkedTable(self.directory, name, TABLES[name], self.chunk_rows, self.flush_interval)
+        return self.tables[name]
+
+    def add_telemetry(self, frame_number, telemetry, pose, shape, move, reused, timestamp=None):
+        """
+        Log a decision: drone position, camera pose, frame size and the move sent
+        """
+        ground_distance, pitch = (pose.altitude, pose.pitch) if pose is not None else (np.nan, np.nan)
+        if ground_distance is None:
+            ground_distance = np.nan
+        self.table("telemetry").append((
+            time.time() if timestamp is None else timestamp, frame_number,
+            telemetry[0], telemetry[1], telemetry[2], ground_distance, pitch,
+            shape[1], shape[0], move[0], move[1], move[2], reused,
+        ))
+
+    def add_detections(self, frame_number, detections, timestamp=None):
+        """
+        Log the boxes of a decision frame, one row per box
+        """
+        n = len(detections)
+        if n == 0:
+            return
+        rows = np.empty(n, dtype=DETECTIONS_DTYPE)
+        rows["timestamp"] = time.time() if timestamp is None else timestamp
+        rows["frame"] = frame_number
+        xyxy = np.asarray(detections.xyxy)
+        rows["x1"], rows["y1"], rows["x2"], rows["y2"] = xyxy[:, 0], xyxy[:, 1], xyxy[:, 2], xyxy[:, 3]
+        rows["conf"] = detections.conf
+        rows["cls"] = detections.cls
+        self.table("detections").extend(rows)
+
+    def flush(self):
+        for table in self.tables.values():
+            table.flush()
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        return {name: {"rows": table.rows, "chunks": table.chunks} for name, table in self.tables.items()}
+
+
+def read_table(output_directory, name):
+    """
+    Load a whole table of a mission as one structured array (empty if nothing was logged)
+    """
+    directory = os.path.join(output_directory, LOG_DIRECTORY)
+    with open(os.path.join(directory, "schema.json")) as file:
+        schema = json.load(file)
+    dtype = schema_to_dtype(schema["tables"][name])
+    chunks = [np.load(path) for path in sorted(glob.glob(os.path.join(directory, f"{name}-*.npy")))]
+    if not chunks:
+        return np.zeros(0, dtype=dtype)
+    table = np.concatenate([chunk.astype(dtype, copy=False) for chunk in chunks])
+    # the chunks of several runs in the same directory are ordered by time
+    return table[np.argsort(table["timestamp"], kind="stable")]
+
+def load_mission(output_directory):
+    """
+    Load every table of a mission, {name: structured array}
+    """
+    return {name: read_table(output_directory, name) for name in TABLES}
+
+def to_dataframe(table):
+    """
+    pandas DataFrame of a table, for the analysis notebooks
+    """
+    import pandas as pd
+    return pd.DataFrame({name: table[name] for name in table.dtype.names})
+
+def counts_by_frame(detections):
+    """
+    Number of boxes of every frame with detections, (frames, counts)
+    """
+    return np.unique(detections["frame"], return_counts=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python mission_log.py <mission directory> [<export directory>]")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    mission = load_mission(sys.argv[1])
+    elapsed = time.perf_counter() - start
+    for name, table in mission.items():
+        print(f"{name}: {len(table)} rows")
+    frames, counts = counts_by_frame(mission["detections"])
+    if len(frames):
+        print(f"frames with detections: {len(frames)}, max boxes in a frame: {counts.max()}")
+    print(f"loaded in {elapsed * 1000:.1f} ms")
+
+    if len(sys.argv) > 2:
+        os.makedirs(sys.argv[2], exist_ok=True)
+        for name, table in mission.items():
+            to_dataframe(table).to_csv(os.path.join(sys.argv[2], f"{name}.csv"), index=False)
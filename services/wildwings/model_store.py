@@ -0,0 +1,258 @@
+# Local model registry for wildwings.
+# Weights are stored in the models directory with a pinned sha256 and a version, so missions
+# never download anything at runtime. Each model is loaded once, warmed up with dummy
+# inferences and shared by every mission run.
+#
+# Usage:
+#   python model_store.py fetch yolov5su   # download the weights of a registry entry and check their pinned checksum (build time)
+#   python model_store.py add <name> <weights.pt> [version]
+#   python model_store.py verify
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+import collections
+import urllib.request
+
+import numpy as np
+
+# never let ultralytics reach the network at runtime, it only reads "True" as enabled
+os.environ.setdefault("YOLO_OFFLINE", "True")
+
+MODELS_DIR = os.environ.get("WILDWINGS_MODELS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+DEFAULT_MODEL = "yolov5su"
+WARMUP_RUNS = 3
+WARMUP_SIZE = (1080, 1920) # height, width of the drone stream frames
+
+logger = logging.getLogger("wildwings.models")
+
+
+def sha256sum(path, chunk_size=1 << 20):
+    """
+    Compute the sha256 of a file without loading it in memory
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def latency_stats(latencies):
+    """
+    Mean, median and 95th percentile of a list of latencies in seconds
+    """
+    latencies = sorted(latencies)
+    return {
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+        "latency_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+    }
+
+
+class ManagedModel:
+    """
+    Wrap a loaded model to time every inference, everything else is delegated to the model
+    """
+    def __init__(self, name, model, version=None, load_time=None):
+        self.name = name
+        self.model = model
+        self.version = version
+        self.load_time = load_time
+        self.warmup_latencies = []
+        self.latencies = collections.deque(maxlen=200)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        results = self.model(*args, **kwargs)
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(latency)
+            self.calls += 1
+        return results
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def warmup(self, runs=WARMUP_RUNS, shape=WARMUP_SIZE):
+        """
+        Run dummy inferences so the first real frame doesn't pay the lazy initialization
+        """
+        frame = np.zeros((shape[0], shape[1], 3), dtype=np.uint8)
+        for _ in range(runs):
+            start = time.perf_counter()
+            self.model(frame, verbose=False)
+            self.warmup_latencies.append(time.perf_counter() - start)
+
+    def stats(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            calls = self.calls
+        return dict(
+            latency_stats(latencies),
+            name=self.name,
+            backend="torch",
+            version=self.version,
+            load_time=self.load_time,
+            warmup_latencies=self.warmup_latencies,
+            calls=calls,
+        )
+
+
+class ModelStore:
+    """
+    Versioned, checksummed weights on disk and the models loaded from them
+    """
+    def __init__(self, models_dir=MODELS_DIR):
+        self.models_dir = models_dir
+        self.registry_path = os.path.join(models_dir, "registry.json")
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def registry(self):
+        if not os.path.exists(self.registry_path):
+            return {}
+        with open(self.registry_path, "r") as file:
+            return json.load(file)
+
+    def save_registry(self, registry):
+        os.makedirs(self.models_dir, exist_ok=True)
+        tmp_path = self.registry_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(registry, file, indent=2, sort_keys=True)
+            file.write("\n")
+        os.replace(tmp_path, self.registry_path)
+
+    def path(self, name):
+        entry = self.registry().get(name)
+        if entry is None:
+            raise KeyError(f"Model '{name}' is not in the registry {self.registry_path}")
+        return os.path.join(self.models_dir, entry["file"])
+
+    def verify(self, name):
+        """
+        Check that the weights of a registry entry exist and match their pinned checksum
+        """
+        entry = self.registry().get(name)
+        if entry is None:
+            raise KeyError(f"Model '{name}' is not in the registry {self.registry_path}")
+        path = os.path.join(self.models_dir, entry["file"])
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Weights of model '{name}' not found at {path}, run `python model_store.py fetch {name}`")
+        digest = sha256sum(path)
+        if entry.get("sha256") is None:
+            logger.warning(f"Model '{name}' has no pinned checksum, commit the sha256 of {path} in {self.registry_path}")
+        elif digest != entry["sha256"]:
+            raise ValueError(f"Checksum mismatch for model '{name}': expected {entry['sha256']}, got {digest}")
+        return path
+
+    def add(self, name, weights_path, version=None, url=None):
+        """
+        Register weights already on disk, pinning their checksum
+        """
+        registry = self.registry()
+        entry = registry.get(name, {})
+        file_name = os.path.basename(weights_path)
+        target = os.path.join(self.models_dir, file_name)
+        if os.path.abspath(weights_path) != os.path.abspath(target):
+            os.makedirs(self.models_dir, exist_ok=True)
+            with open(weights_path, "rb") as src, open(target, "wb") as dst:
+                for chunk in iter(lambda: src.read(1 << 20), b""):
+                    dst.write(chunk)
+        entry.update({
+            "file": file_name,
+            "sha256": sha256sum(target),
+            "version": version if version is not None else entry.get("version"),
+        })
+        if url is not None:
+            entry["url"] = url
+        registry[name] = entry
+        self.save_registry(registry)
+        return entry
+
+    def fetch(self, name):
+        """
+        Download the weights of a registry entry from its url and check them against the pinned checksum,
+        meant for image builds. An entry without a checksum is pinned on first use until one is committed
+        """
+        entry = self.registry().get(name)
+        if entry is None or not entry.get("url"):
+            raise KeyError(f"Model '{name}' has no download url in the registry")
+        if entry.get("sha256") is None:
+            logger.warning(f"Model '{name}' has no pinned checksum, pinning the downloaded weights, commit {self.registry_path}")
+        path = os.path.join(self.models_dir, entry["file"])
+        if not os.path.exists(path):
+            os.makedirs(self.models_dir, exist_ok=True)
+            tmp_path = path + ".part"
+            urllib.request.urlretrieve(entry["url"], tmp_path)
+            os.replace(tmp_path, path)
+        digest = sha256sum(path)
+        if entry.get("sha256") is not None and entry["sha256"] != digest:
+            os.remove(path)
+            raise ValueError(f"Checksum mismatch for model '{name}': expected {entry['sha256']}, got {digest}")
+        return self.add(name, path, entry.get("version"))
+
+    def load(self, name=DEFAULT_MODEL, warmup=True):
+        """
+        Load a model once and return the shared, warmed up instance
+        """
+        with self.lock:
+            if name in self.loaded:
+                return self.loaded[name]
+
+            path = self.verify(name)
+            from ultralytics import YOLO
+
+            start = time.perf_counter()
+            model = ManagedModel(name, YOLO(path), self.registry()[name].get("version"))
+            model.load_time = time.perf_counter() - start
+            if warmup:
+                model.warmup()
+            logger.info(
+                f"Model '{name}' loaded in {model.load_time:.2f}s, warmup latencies "
+                + ", ".join(f"{latency * 1000:.0f}ms" for latency in model.warmup_latencies)
+            )
+            self.loaded[name] = model
+            return model
+
+    def describe(self):
+        """
+        Report every registry entry with the load time and latency of the loaded ones
+        """
+        models = []
+        for name, entry in sorted(self.registry().items()):
+            description = {
+                "name": name,
+                "version": entry.get("version"),
+                "file": entry.get("file"),
+                "sha256": entry.get("sha256"),
+                "available": os.path.exists(os.path.join(self.models_dir, entry.get("file", ""))),
+                "loaded": name in self.loaded,
+            }
+            if name in self.loaded:
+                description.update(self.loaded[name].stats())
+            models.append(description)
+        return models
+
+
+store = ModelStore()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] not in ("fetch", "add", "verify"):
+        print("Usage: python model_store.py fetch <name> | add <name> <weights.pt> [version] | verify")
+        sys.exit(1)
+
+    if sys.argv[1] == "fetch":
+        print(store.fetch(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_MODEL))
+    elif sys.argv[1] == "add":
+        print(store.add(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None))
+    else:
+        for name in store.registry():
+            print(name, store.verify(name))
@@ -4,79 +4,119 @@
 import math
 import cv2
 import sys
-from ultralytics import YOLO
-from PIL import Image
-import pandas as pd
+import numpy as np
 import time
 import datetime
 import json
 
+from detectors import as_detector, ANIMAL_CLASSES, DEFAULT_PROFILE
+from roi import RoiDetector, ROI_ENABLED
+from tiling import TiledDetector, TILING_ENABLED
+from tracking import HerdTracker, HERD_TRACKING
+import geometry
+
 # Generate a unique filename using the current timestamp
 timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
 frame_counter = 0
 
-# constants for how much to move in each direction
+# constants for how much to move in each direction when the camera pose is unknown or geometry.GEOMETRY_ENABLED is off,
+# otherwise the moves are computed from the ground offset of the herd by geometry.herd_move
 # NOTE these are arbitrary values and need to be adjusted based on drone speed and camera resolution
 x_dist = 10 # move +/- X meters in forward/backward plane
 x_dist_no_subject = 20 # move +/- X meters forward if no subject detected
 y_dist = 10 # move +/- X meters in left/right plane
 z_dist = 10 # move +/- X meters in up/down plane
 
-def crop_image(image):
+# lookup table indexed by class id of the ANIMAL_CLASSES, so counting is a single gather instead of a loop of comparisons
+ANIMAL_CLASS_MASK = DEFAULT_PROFILE.class_mask
+
+def count_animals(detections, class_mask=ANIMAL_CLASS_MASK):
     """
-    Crop the image to focus on the herd and improve YOLO results
+    Count the number of animals in the frame
     """
-    im = Image.open(image)
-    width, height = im.size
-    crop_image = im.crop((int(width/3), int(height/4), int(width/3*2), int(height/4*3)))
-    # width_third = int(width/3)
-    # height_quarter = int(height/4)
-    # crop_image = image[int(height_quarter):int(height_quarter*3), int(width_third):int(width_third*2)]
-    return crop_image
-
-def count_animals(results):
+    if len(detections) == 0:
+        return 0
+    return int(np.count_nonzero(class_mask[detections.cls]))
+
+def mission_detector(model):
     """
-    Count the number of animals in the frame
+    Wrap the shared detector with the inference strategies enabled for the missions (tiling, then ROI),
+    they keep per-mission state so a new one is needed for every mission
     """
-    count = 0
-    for i in results[0].boxes.cls:
-        # cows: 19
-        # horses: 22
-        # sheep: 18
-        # zebras: 17
-        # dog: 16
-        # person: 0
-        if i == 19 or i == 22 or i == 18 or i == 17 or i==16 or i == 0: 
-            count += 1
-    return count
-
-def detect_animals(frame, model):
+    detector = as_detector(model)
+    if TILING_ENABLED:
+        detector = TiledDetector(detector)
+    if ROI_ENABLED:
+        detector = RoiDetector(detector)
+    return detector
+
+def mission_herd():
     """
-    Detect the animals in the frame
+    Herd tracker of a mission, None if disabled
     """
-    results = model(frame)
-    count, results = count_animals(results), results
-    return count, results 
+    return HerdTracker() if HERD_TRACKING else None
+
+def follow_flight(herd, position, shape, pose):
+    """
+    Compensate the herd tracker for the displacement the drone flew since the last frame it saw, so its filters
+    don't take the drone's own motion for the herd's. `position` is the (latitude, longitude, height above takeoff,
+    yaw) of the drone at this frame, None when unknown. The commanded moves are not used: a moveBy takes seconds
+    and the next decision interrupts it
+    """
+    if herd is None:
+        return
+    previous, herd.flight = herd.flight, (position, pose)
+    if previous is None or position is None or previous[0] is None:
+        return
+    previous_position, previous_pose = previous
+    if previous_pose is None or previous_pose.altitude is None or previous_pose.altitude <= 0:
+        return
+    move = geometry.flown_move(previous_position, position)
+    if any(move):
+        herd.compensate(lambda points: np.asarray(geometry.moved_pixels(points, move, shape, previous_pose)))
+
+def detect_animals(frame, model, profile=DEFAULT_PROFILE, altitude=None):
+    """
+    Detect the animals in the frame (BGR or yuv.YuvFrame) with the classes and thresholds of the mission detection profile,
+    `model` is a detectors.Detector (any backend) or an ultralytics model, `altitude` in meters is used by the tiling.
+    The count and the herd position are computed on the same filtered boxes
+    """
+    detections = as_detector(model)(frame, profile, altitude)
+    # the backends already filter the classes inside the inference call, this only guards the others
+    relevant = profile.class_mask[detections.cls]
+    if not relevant.all():
+        detections = detections.select(relevant)
+    return len(detections), detections
+
+def auto_navigation(detections, pose=None):
+    # boxes as x1, y1, x2, y2 columns, reduced to scalars without building per-frame tables
+    xyxy = detections.xyxy
+    n = len(xyxy)
+
+    # get centroid of herd (mean of the box centers)
+    centroid_herd = (
+        float(xyxy[:, 0].sum() + xyxy[:, 2].sum()) / (2 * n),
+        float(xyxy[:, 1].sum() + xyxy[:, 3].sum()) / (2 * n),
+    )
+    # get range of x and y values for herd
+    herd_bbox = (float(xyxy[:, 0].min()), float(xyxy[:, 1].min()), float(xyxy[:, 2].max()), float(xyxy[:, 3].max()))
 
-def auto_navigation(results):
     # orig_shape outputs (height, width)
-    centroid_camera = (results[0].orig_shape[1]/2, results[0].orig_shape[0]/2)
-    
-    #px = pd.DataFrame((results[0].boxes.boxes).numpy(), columns = ('x1', 'y1','x2', 'y2', 'confidence', 'class'))
-    px = pd.DataFrame((results[0].boxes.xyxy).numpy(), columns = ('x1', 'y1','x2', 'y2'))
-    # get x, y, w, h for results and convert to dataframe
-    pxywh = pd.DataFrame((results[0].boxes.xywh).numpy(), columns = ('x', 'y','w', 'h'))
-    px = px.join(pxywh)
-
-    # calculate bounding box sizes in terms of pixel width and height
-    bbox_sizes = []
-    for b in results[0].boxes.xywh:
-        bbox_sizes.append((b[2], b[3])) # get width and height of bounding box
-
-    # get centroid of herd
-    centroid_herd = (px['x'].mean(), px['y'].mean())
-
-    image_shape_h, image_shape_w = results[0].orig_shape
+    return herd_move(centroid_herd, herd_bbox, detections.orig_shape, pose)
+
+def herd_move(centroid_herd, herd_bbox, shape, pose=None):
+    """
+    Next move from the herd centroid and extent (x1, y1, x2, y2) in a frame of `shape` (height, width),
+    measured on a frame or estimated by tracking.HerdTracker.
+    With the geometry.CameraPose of the frame the move is proportional to the ground offset of the herd,
+    the fixed steps are used when its height above ground is unknown
+    """
+    if geometry.GEOMETRY_ENABLED and pose is not None and pose.altitude is not None and pose.altitude > 0:
+        return geometry.herd_move(centroid_herd, herd_bbox, shape, pose)
+
+    image_shape_h, image_shape_w = shape[:2]
+    centroid_camera = (image_shape_w/2, image_shape_h/2)
+
     x_center_range = image_shape_w/2 - image_shape_w/8, image_shape_w/2 + image_shape_w/8
     y_center_range = image_shape_h/2 - image_shape_h/8, image_shape_h/2 + image_shape_h/8
 
@@ -85,77 +125,67 @@ def auto_navigation(results):
     dif_y = centroid_herd[1] - centroid_camera[1]
 
     # get the middle 75% of the image, i.e. 12.5% on each side
-    left_range = results[0].orig_shape[1]/8
-    right_range = results[0].orig_shape[1] - left_range
-    top_range = results[0].orig_shape[0]/8
-    bottom_range = results[0].orig_shape[0] - top_range
+    left_range = image_shape_w/8
+    right_range = image_shape_w - left_range
+    top_range = image_shape_h/8
+    bottom_range = image_shape_h - top_range
 
-    # get range of x values for herd
-    x_min_herd, x_max_herd = px['x1'].min(), px['x2'].max()
-    y_min_herd, y_max_herd = px['y1'].min(), px['y2'].max()
+    x_min_herd, y_min_herd, x_max_herd, y_max_herd = herd_bbox
 
     # Calculate next move for drone in x, y, z direction
 
     # navigation policy: move x, y, z, yaw until herd is in center of camera frame, keep checking every 1 sec to adjust
     # continuous adjustments allows us to avoid complex calculations and avoid overshooting
-    # direction_x = "No movement in x-axis"
-    # direction_y = "No movement in y-axis"
-    # direction_z = "No movement in z-axis"
     direction_x = 0
     direction_y = 0
     direction_z = 0
 
-    if (centroid_herd[0] < x_center_range[0]) | (centroid_herd[0] > x_center_range[1]):
+    if centroid_herd[0] < x_center_range[0] or centroid_herd[0] > x_center_range[1]:
         if dif_x > 0:
-            #print("y-axis: Move right")
             direction_y = +y_dist # move right
         elif dif_x < 0:
-            #print("y-axis: Move left")
             direction_y = -y_dist # move left
-        else:
-            #print("y-axis: No movement in y-axis")
-            direction_y = 0
-    else:
-        #print("y-axis: No movement in y-axis")
-        direction_y = 0
 
     # if no movement left or right, move forward or backward
     if direction_y == 0:
         # check to see if herd is in center 75% of camera frame
-        if (x_min_herd >= left_range) | (x_max_herd <= right_range):
-            #print("x-axis: Move forward")
+        if x_min_herd >= left_range or x_max_herd <= right_range:
             direction_x = x_dist # move forward
-        elif (x_min_herd <= left_range) | (x_max_herd >= right_range):
-            #print("x-axis: Move backward")
+        elif x_min_herd <= left_range or x_max_herd >= right_range:
             direction_y = -x_dist # move backward
     else:
-        #print("No movement in x-axis")
         direction_y = 0
 
     # note: y-axis in image is actually z-axis in drone; y-axis in image is inverted (0,0 is top left corner)
 
-    if (centroid_herd[1] < y_center_range[0]) | (centroid_herd[1] > y_center_range[1]):
-        if (dif_y >= 0.0) & (y_min_herd >= bottom_range):
-            #print("z-axis: Move down")
+    if centroid_herd[1] < y_center_range[0] or centroid_herd[1] > y_center_range[1]:
+        if dif_y >= 0.0 and y_min_herd >= bottom_range:
             direction_z = -z_dist # move down
-        elif (dif_y <= 0.0) & (y_max_herd <= bottom_range):
-            #print("z-axis: Move up")
+        elif dif_y <= 0.0 and y_max_herd <= bottom_range:
             direction_z = z_dist # move up
-        else:
-            #print("No movement in z-axis")
-            direction_z = 0
-    else:
-        #print("No movement in z-axis")
-        direction_z = 0
 
     return  direction_x, direction_y, direction_z
 
-def get_next_action(frame, model, directory, frame_counter):
+def get_next_action(frame, model, directory, frame_counter, profile=DEFAULT_PROFILE, pose=None, herd=None, evidence=None, mission_log=None):
     # Get the position of the herd in the frame
-    count, results = detect_animals(frame, model)
+    count, detections = detect_animals(frame, model, profile, pose.altitude if pose is not None else None)
+
+    # keep the boxes with the mission data (mission_log.MissionLog)
+    if mission_log is not None:
+        mission_log.add_detections(frame_counter, detections)
 
-    # save the frame with bounding boxes
-    results[0].save(directory + '/' + str(frame_counter) + '.jpg')
+    # save the frame with bounding boxes, by the evidence.EvidenceWriter workers when there is one
+    path = directory + '/' + str(frame_counter) + '.jpg'
+    if evidence is not None:
+        evidence.submit(detections, path, count)
+    else:
+        detections.save(path)
+
+    if herd is not None:
+        # decide on the filtered herd state, it is predicted for a few seconds when the detections drop out
+        state = herd.update(detections, herd.clock())
+        if state is not None:
+            return herd_move(state.centroid, state.bbox, detections.orig_shape, pose)
 
     if count == 0:
         # no animals detected, continue mission"
@@ -166,24 +196,23 @@ def get_next_action(frame, model, directory, frame_counter):
         return x, y, z
     else:
         # animals detected, determine where to move
-        x, y, z, = auto_navigation(results)
+        x, y, z, = auto_navigation(detections, pose)
         return x, y, z
 
 def main(image_path, directory):
     # Get the frame from the drone video
-    #image = cv2.imread(image_path)
-
-    # crop the frame to focus on center of image
-    frame = crop_image(image_path)
+    # (cropping around the herd is done by roi.RoiDetector during missions)
+    frame = cv2.imread(image_path)
 
-    # Load the YOLO model to detect animals
-    model = YOLO('yolov5su')
+    # Load the detector of the configured backend (WILDWINGS_DETECTOR)
+    from detectors import load_detector
+    model = load_detector('yolov5su')
 
     # Determine where the drone should move to keep the herd in the frame
     # sleep for 1 second to allow drone to move
     time.sleep(1)
     # get the next action for the drone
-    actions = get_next_action(frame, model, directory)
+    actions = get_next_action(frame, model, directory, 0)
 
     return print("actions: ", actions)
 
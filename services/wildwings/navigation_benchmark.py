@@ -0,0 +1,104 @@
+# Micro-benchmark of the per-frame navigation cost (counting + herd decision), without inference.
+# Compares the vectorized navigation core with the previous pandas implementation, kept here as
+# the baseline, on synthetic 1080p detections, and checks both take the same decisions.
+#
+# Usage:
+#   python navigation_benchmark.py [frames] [boxes per frame, comma separated]
+
+import sys
+import time
+
+import numpy as np
+
+import navigation
+from detectors import Detections
+
+FRAME_SHAPE = (1080, 1920)
+
+
+def legacy_count_animals(detections):
+    count = 0
+    for i in detections.cls:
+        if i == 19 or i == 22 or i == 18 or i == 17 or i==16 or i == 0:
+            count += 1
+    return count
+
+def legacy_auto_navigation(detections):
+    import pandas as pd
+
+    centroid_camera = (detections.orig_shape[1]/2, detections.orig_shape[0]/2)
+    px = pd.DataFrame(detections.xyxy, columns = ('x1', 'y1','x2', 'y2'))
+    pxywh = pd.DataFrame(detections.xywh, columns = ('x', 'y','w', 'h'))
+    px = px.join(pxywh)
+    bbox_sizes = []
+    for b in detections.xywh:
+        bbox_sizes.append((b[2], b[3]))
+    centroid_herd = (px['x'].mean(), px['y'].mean())
+    image_shape_h, image_shape_w = detections.orig_shape
+    x_center_range = image_shape_w/2 - image_shape_w/8, image_shape_w/2 + image_shape_w/8
+    y_center_range = image_shape_h/2 - image_shape_h/8, image_shape_h/2 + image_shape_h/8
+    dif_x = centroid_herd[0] - centroid_camera[0]
+    dif_y = centroid_herd[1] - centroid_camera[1]
+    left_range = detections.orig_shape[1]/8
+    right_range = detections.orig_shape[1] - left_range
+    bottom_range = detections.orig_shape[0] - detections.orig_shape[0]/8
+    x_min_herd, x_max_herd = px['x1'].min(), px['x2'].max()
+    y_min_herd, y_max_herd = px['y1'].min(), px['y2'].max()
+    direction_x = direction_y = direction_z = 0
+    if (centroid_herd[0] < x_center_range[0]) | (centroid_herd[0] > x_center_range[1]):
+        if dif_x > 0:
+            direction_y = +navigation.y_dist
+        elif dif_x < 0:
+            direction_y = -navigation.y_dist
+    if direction_y == 0:
+        if (x_min_herd >= left_range) | (x_max_herd <= right_range):
+            direction_x = navigation.x_dist
+        elif (x_min_herd <= left_range) | (x_max_herd >= right_range):
+            direction_y = -navigation.x_dist
+    else:
+        direction_y = 0
+    if (centroid_herd[1] < y_center_range[0]) | (centroid_herd[1] > y_center_range[1]):
+        if (dif_y >= 0.0) & (y_min_herd >= bottom_range):
+            direction_z = -navigation.z_dist
+        elif (dif_y <= 0.0) & (y_max_herd <= bottom_range):
+            direction_z = navigation.z_dist
+    return direction_x, direction_y, direction_z
+
+
+def synthetic_detections(rng, boxes):
+    """
+    Random boxes of a herd somewhere in a 1080p frame, with a mix of animal and other classes
+    """
+    height, width = FRAME_SHAPE
+    center = rng.uniform((0, 0), (width, height))
+    centers = center + rng.normal(0, 150, (boxes, 2))
+    sizes = rng.uniform(20, 120, (boxes, 2))
+    xyxy = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1).clip(0, (width, height, width, height))
+    cls = rng.choice([0, 2, 16, 17, 18, 19, 22, 56], boxes)
+    return Detections(xyxy, rng.uniform(0.25, 1, boxes), cls, FRAME_SHAPE)
+
+def per_frame_cost(count, navigate, samples):
+    start = time.perf_counter()
+    for detections in samples:
+        if count(detections):
+            navigate(detections)
+    return (time.perf_counter() - start) / len(samples)
+
+
+def run(frames=2000, box_counts=(1, 10, 50, 200)):
+    rng = np.random.default_rng(0)
+    for boxes in box_counts:
+        samples = [synthetic_detections(rng, boxes) for _ in range(frames)]
+        for detections in samples:
+            assert navigation.count_animals(detections) == legacy_count_animals(detections)
+            assert navigation.auto_navigation(detections) == legacy_auto_navigation(detections)
+
+        before = per_frame_cost(legacy_count_animals, legacy_auto_navigation, samples)
+        after = per_frame_cost(navigation.count_animals, navigation.auto_navigation, samples)
+        print(f"{boxes:4d} boxes: before {before * 1e6:8.1f} us/frame, after {after * 1e6:6.1f} us/frame, {before / after:5.1f}x")
+
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    box_counts = tuple(int(n) for n in sys.argv[2].split(",")) if len(sys.argv) > 2 else (1, 10, 50, 200)
+    run(frames, box_counts)
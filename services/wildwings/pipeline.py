@@ -0,0 +1,236 @@
+# Building blocks of the tracking pipeline.
+# The frame intake only keeps the newest frame, and the inference worker takes it when it is
+# ready to decide, at a rate that adapts to the measured inference latency, and skips the
+# inference when neither the scene nor the drone changed since the last one.
+
+import math
+import time
+import threading
+import collections
+
+import numpy as np
+
+from model_store import latency_stats
+
+
+class LatestFrameSlot:
+    """
+    Hold only the newest frame, a frame replaced before being taken is released immediately
+    """
+    def __init__(self, release=None):
+        self.release = release
+        self.condition = threading.Condition()
+        self.item = None
+        self.seq = None
+        self.received = 0
+        self.replaced = 0
+
+    def put(self, item, seq):
+        with self.condition:
+            old = self.item
+            self.item = item
+            self.seq = seq
+            self.received += 1
+            if old is not None:
+                self.replaced += 1
+            self.condition.notify_all()
+        if old is not None and self.release is not None:
+            self.release(old)
+
+    def take(self, timeout=None):
+        """
+        Take ownership of the newest frame, returns (None, None) if no frame arrived before the timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.item is not None, timeout):
+                return None, None
+            item, seq = self.item, self.seq
+            self.item = None
+            self.seq = None
+            return item, seq
+
+    def clear(self):
+        with self.condition:
+            old = self.item
+            self.item = None
+            self.seq = None
+        if old is not None and self.release is not None:
+            self.release(old)
+
+
+class DecisionRate:
+    """
+    Pace the decisions at `target_hz`, slowed down to what the measured inference latency allows
+    """
+    def __init__(self, target_hz=1.0, min_hz=0.2, smoothing=0.2, headroom=1.1):
+        self.target_hz = target_hz
+        self.min_hz = min_hz
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.latency = None
+        self.decisions = 0
+        self.next_time = None
+        self.started = None
+
+    def record(self, latency):
+        """
+        Record the latency of a decision (exponential moving average)
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        self.decisions += 1
+
+    @property
+    def period(self):
+        period = 1.0 / self.target_hz
+        if self.latency is not None:
+            period = max(period, self.latency * self.headroom)
+        return min(period, 1.0 / self.min_hz)
+
+    def wait(self, stop_event=None):
+        """
+        Sleep until the next decision is due, returns False if `stop_event` was set meanwhile
+        """
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        if self.next_time is None or self.next_time < now:
+            self.next_time = now
+        delay = self.next_time - now
+        self.next_time += self.period
+        if stop_event is None:
+            time.sleep(delay)
+            return True
+        return not stop_event.wait(delay)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        return {
+            "decisions": self.decisions,
+            "latency": self.latency,
+            "period": self.period,
+            "effective_hz": self.decisions / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class MotionGate:
+    """
+    Decide if a frame is worth an inference: compares a downsampled luma plane taken straight from
+    the YUV buffer and the drone position with the ones of the last inferred frame.
+    A frame is skipped only when neither the scene nor the drone changed, and never more than
+    `max_reuse` times in a row. The scene is compared per tile of `tile` x `tile` samples: a small
+    moving herd barely changes the mean of the whole frame, but changes the tiles it is in
+    """
+    def __init__(self, step=16, tile=4, scene_threshold=8.0, position_threshold=0.5, altitude_threshold=0.3, max_reuse=10):
+        self.step = step
+        self.tile = tile
+        self.scene_threshold = scene_threshold # mean absolute luma difference of the most changed tile, 0-255
+        self.position_threshold = position_threshold # meters
+        self.altitude_threshold = altitude_threshold # meters, height above takeoff
+        self.max_reuse = max_reuse
+        self.reference_luma = None
+        self.reference_position = None
+        self.reused = 0
+        self.checked = 0
+        self.skipped = 0
+
+    def luma(self, yuv, height):
+        """
+        Downsampled Y plane of an I420/NV12 buffer (the first `height` rows), no color conversion
+        """
+        return yuv[:height:self.step, ::self.step].astype(np.int16)
+
+    def scene_change(self, luma):
+        """
+        Mean absolute luma difference of the most changed tile since the last inferred frame
+        """
+        if self.reference_luma is None or self.reference_luma.shape != luma.shape:
+            return float("inf")
+        diff = np.abs(luma - self.reference_luma)
+        rows, cols = diff.shape[0] // self.tile, diff.shape[1] // self.tile
+        if rows == 0 or cols == 0:
+            return float(diff.mean())
+        tiles = diff[:rows * self.tile, :cols * self.tile].reshape(rows, self.tile, cols, self.tile)
+        return float(tiles.mean(axis=(1, 3)).max())
+
+    def drone_moved(self, telemetry, altitude):
+        """
+        Whether the drone moved since the last inferred frame. The telemetry altitude is above sea level
+        and too noisy for the altitude threshold, `altitude` is the height above takeoff (None when unknown)
+        """
+        if self.reference_position is None:
+            return True
+        lat, lon = float(telemetry[0]), float(telemetry[1])
+        ref_lat, ref_lon, ref_altitude = self.reference_position
+        # equirectangular approximation, plenty for sub-meter deltas
+        north = (lat - ref_lat) * 111320.0
+        east = (lon - ref_lon) * 111320.0 * math.cos(math.radians(ref_lat))
+        if math.hypot(north, east) > self.position_threshold:
+            return True
+        if altitude is None or ref_altitude is None:
+            # the height report started or stopped
+            return (altitude is None) != (ref_altitude is None)
+        return abs(altitude - ref_altitude) > self.altitude_threshold
+
+    def check(self, yuv, height, telemetry, altitude=None):
+        """
+        Returns True if the frame must be inferred, False if the previous result can be reused.
+        `altitude` is the height of the drone above takeoff (Tracker.drone_height)
+        """
+        self.checked += 1
+        luma = self.luma(yuv, height)
+        if (
+            self.reused < self.max_reuse
+            and not self.drone_moved(telemetry, altitude)
+            and self.scene_change(luma) <= self.scene_threshold
+        ):
+            self.reused += 1
+            self.skipped += 1
+            return False
+
+        self.reference_luma = luma
+        self.reference_position = (float(telemetry[0]), float(telemetry[1]), altitude)
+        self.reused = 0
+        return True
+
+    def reset(self):
+        self.reference_luma = None
+        self.reference_position = None
+        self.reused = 0
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "inferred": self.checked - self.skipped,
+        }
+
+
+class StageTimer:
+    """
+    Durations of the stages of a decision: `start` it, then `mark` the end of every stage.
+    The last decision is in `current`, `stats` summarizes the last `window` decisions per stage
+    """
+    def __init__(self, window=1000):
+        self.window = window
+        self.samples = {}
+        self.current = {}
+        self.last = None
+
+    def start(self):
+        self.current = {}
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        duration = now - self.last
+        self.last = now
+        self.current[stage] = self.current.get(stage, 0.0) + duration
+        if stage not in self.samples:
+            self.samples[stage] = collections.deque(maxlen=self.window)
+        self.samples[stage].append(duration)
+
+    def stats(self):
+        return {stage: latency_stats(list(samples)) for stage, samples in self.samples.items()}
@@ -0,0 +1,458 @@
+# Offline replay of recorded missions through the tracking pipeline.
+# The frames of a recording (the streaming.mp4 of a mission, or a directory of frames) are fed to a
+# Tracker as I420 stream frames, the drone position comes from the telemetry log of the mission
+# (telemetry_log.csv or the mission_log tables) at the video time of the frame, and the moves are
+# kept by a recorder instead of flying a drone. Every decision is written to replay_trace.jsonl
+# with the duration of its stages, and replay_summary.json has the stage, detector, motion gating
+# and herd statistics of the run.
+#
+# At max speed (default) the decisions are taken in lockstep with the video time at the nominal
+# decision rate, so two runs on the same recording decide on the same frames and can be compared.
+# With --realtime the frames are streamed at their frame rate (times --speed) through the frame
+# intake and the inference worker of the Tracker, like on the drone.
+#
+# Usage:
+#   python replay.py run <recording> <output directory> [<telemetry log>] [--realtime] [--speed=X]
+#   python replay.py batch <missions directory> <output directory> [--workers=N]   # every mission with a recording
+#   python replay.py compare <replay directory> <replay directory>                 # decisions and stage timings
+
+import os
+import sys
+import csv
+import json
+import time
+import glob
+import queue
+import logging
+import datetime
+import threading
+import concurrent.futures
+import multiprocessing as mp
+
+import cv2
+import numpy as np
+
+import mission_log
+from controller import Tracker, load_model, TARGET_DECISION_HZ
+from detectors import DEFAULT_PROFILE
+from pipeline import DecisionRate
+from yuv import frame_format
+
+FRAME_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+DEFAULT_FPS = 30.0 # frame rate of a directory of frames
+DEFAULT_ALTITUDE = 30.0 # meters, when the mission has no telemetry log
+TRACE_FILE = "replay_trace.jsonl"
+SUMMARY_FILE = "replay_summary.json"
+MOVES_FILE = "replay_moves.csv"
+
+logger = logging.getLogger("wildwings.replay")
+
+
+class FrameSource:
+    """
+    Frames of a video file or of a directory of images (sorted by name), with their video time
+    """
+    def __init__(self, path, fps=None):
+        self.path = path
+        self.index = -1
+        if os.path.isdir(path):
+            self.files = sorted(
+                file for file in glob.glob(os.path.join(path, "*")) if file.lower().endswith(FRAME_EXTENSIONS)
+            )
+            if not self.files:
+                raise ValueError(f"Illegal recording {path}: no frames")
+            self.capture = None
+            self.fps = fps or DEFAULT_FPS
+            self.frame_count = len(self.files)
+        else:
+            self.capture = cv2.VideoCapture(path)
+            if not self.capture.isOpened():
+                raise ValueError(f"Illegal recording {path}: cannot be opened")
+            self.files = None
+            self.fps = fps or self.capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+            self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def read(self, skip=0):
+        """
+        Skip `skip` frames without decoding them and return (index, video time, BGR frame), None at the end
+        """
+        if self.capture is None:
+            self.index += skip + 1
+            if self.index >= len(self.files):
+                return None
+            frame = cv2.imread(self.files[self.index])
+            if frame is None:
+                raise ValueError(f"Illegal frame {self.files[self.index]}")
+        else:
+            for _ in range(skip):
+                if not self.capture.grab():
+                    return None
+                self.index += 1
+            ok, frame = self.capture.read()
+            if not ok:
+                return None
+            self.index += 1
+        return self.index, self.index / self.fps, frame
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+class TelemetryLog:
+    """
+    Drone position (latitude, longitude, altitude) of a mission, interpolated at a time relative
+    to its first sample. `offset` is the video time of that first sample.
+    `heights` is the (time, height above ground) of the samples having it, None when the log doesn't
+    """
+    def __init__(self, times, positions, offset=0.0, heights=None):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.offset = offset
+        self.heights = np.asarray(heights, dtype=np.float64).reshape(-1, 2) if heights is not None else None
+
+    @classmethod
+    def load(cls, path, offset=0.0):
+        """
+        Read a telemetry_log.csv, or the telemetry table of a mission directory (mission_log.py).
+        Without a log the drone stays at DEFAULT_ALTITUDE above the ground, the CSV has no height above ground
+        """
+        if path is None:
+            return cls([0.0], [(0.0, 0.0, DEFAULT_ALTITUDE)], offset, [(0.0, DEFAULT_ALTITUDE)])
+        heights = None
+        if os.path.isdir(path):
+            table = mission_log.read_table(path, "telemetry")
+            times = table["timestamp"]
+            positions = np.stack([table["latitude"], table["longitude"], table["altitude"]], axis=1)
+            if "ground_distance" in table.dtype.names and not np.all(np.isnan(table["ground_distance"])):
+                heights = np.asarray(table["ground_distance"], dtype=np.float64)
+        else:
+            times, positions = [], []
+            with open(path, newline="") as file:
+                for row in csv.reader(file):
+                    if not row or row[0] == "timestamp":
+                        continue
+                    times.append(datetime.datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").timestamp())
+                    positions.append([float(value) for value in row[1:4]])
+        if len(times) == 0:
+            return cls([0.0], [(0.0, 0.0, DEFAULT_ALTITUDE)], offset, [(0.0, DEFAULT_ALTITUDE)])
+        times = np.asarray(times, dtype=np.float64)
+        start = times.min()
+        if heights is not None:
+            # decisions without a pose have no height, interpolate over them
+            known = ~np.isnan(heights)
+            heights = np.stack([times[known] - start, heights[known]], axis=1)
+            heights = heights[np.argsort(heights[:, 0], kind="stable")]
+        # the CSV has one second timestamps, keep the first position of every timestamp
+        times, first = np.unique(times, return_index=True)
+        return cls(times - start, np.asarray(positions, dtype=np.float64)[first], offset, heights)
+
+    def at(self, video_time):
+        t = video_time - self.offset
+        return tuple(float(np.interp(t, self.times, self.positions[:, axis])) for axis in range(3))
+
+    def height_at(self, video_time):
+        """
+        Height above ground at `video_time`, None when the log doesn't have it
+        """
+        if self.heights is None:
+            return None
+        return float(np.interp(video_time - self.offset, self.heights[:, 0], self.heights[:, 1]))
+
+
+class ReplayFrame:
+    """
+    Stand-in for an olympe VideoFrame: an I420 frame converted from a recorded BGR frame
+    """
+    def __init__(self, bgr):
+        height, width = bgr.shape[:2]
+        height, width = height & ~1, width & ~1
+        self.height = height
+        self.width = width
+        self.yuv = cv2.cvtColor(bgr[:height, :width], cv2.COLOR_BGR2YUV_I420)
+
+    def info(self):
+        return {"raw": {"frame": {"info": {"height": self.height, "width": self.width}}}}
+
+    def format(self):
+        return frame_format(cv2.COLOR_YUV2BGR_I420)
+
+    def vmeta(self):
+        # recordings have no frame metadata, the camera pose falls back to the logged height above ground
+        return (None, {})
+
+    def as_ndarray(self):
+        return self.yuv
+
+    def unref(self):
+        pass
+
+
+class MoveRecorder:
+    """
+    Stand-in for the drone piloting: keeps the moves, as sent to moveBy (z positive down), with the video time they were sent at
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.moves = []
+
+    def move_by(self, x, y, z, yaw):
+        self.moves.append((self.clock(), x, y, z, yaw))
+
+    def write(self, path):
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["video_time", "x", "y", "z", "yaw"])
+            writer.writerows(self.moves)
+
+
+class ReplayMedia:
+    """
+    Stand-in for the drone camera media the Tracker reads the stream frames from
+    """
+    def __init__(self):
+        self.running = False
+        self.frame_queue = queue.Queue()
+        self.frame_counter = 0
+
+
+class ReplayDrone:
+    """
+    Stand-in for the drone of a Tracker: recorded frames, logged telemetry and recorded moves
+    """
+    def __init__(self, telemetry, clock):
+        self.telemetry = telemetry
+        self.clock = clock
+        self.camera = type("ReplayCamera", (), {})()
+        self.camera.media = ReplayMedia()
+        self.piloting = MoveRecorder(clock)
+
+    def get_drone_coordinates(self):
+        return self.telemetry.at(self.clock())
+
+    def get_drone_height(self):
+        return self.telemetry.height_at(self.clock())
+
+    def get_drone_heading(self):
+        # the logs have no heading, the herd filters are not compensated for the recorded flight
+        return None
+
+
+def replay(recording, output_directory, model, telemetry=None, realtime=False, speed=1.0, decision_hz=TARGET_DECISION_HZ, duration=None, offset=0.0, profile=None):
+    """
+    Replay `recording` (video file or directory of frames) through a Tracker using `model`, writing
+    the mission results, the decision trace and the replay summary into `output_directory`.
+    `telemetry` is a telemetry_log.csv or a mission directory, `offset` the video time of its first sample.
+    Returns the summary
+    """
+    if speed <= 0 or decision_hz <= 0:
+        raise ValueError(f"Illegal replay settings: speed={speed}, decision_hz={decision_hz}")
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    os.makedirs(output_directory, exist_ok=True)
+
+    source = FrameSource(recording)
+    telemetry_log = TelemetryLog.load(telemetry, offset)
+    video_time = [0.0]
+    started = [None]
+    if realtime:
+        clock = lambda: (time.monotonic() - started[0]) * speed if started[0] is not None else 0.0
+    else:
+        clock = lambda: video_time[0]
+
+    drone = ReplayDrone(telemetry_log, clock)
+    tracker = Tracker(drone, model, output_directory, None, profile)
+    if tracker.herd is not None:
+        tracker.herd.clock = clock
+
+    trace_file = open(os.path.join(output_directory, TRACE_FILE), "w")
+    decisions = [0]
+    def on_decision(trace):
+        decisions[0] += 1
+        trace["video_time"] = clock()
+        trace_file.write(json.dumps(trace) + "\n")
+    tracker.on_decision = on_decision
+
+    frames = 0
+    wall_start = time.perf_counter()
+    try:
+        if realtime:
+            # decisions at the rate of the drone in video time
+            tracker.decision_rate = DecisionRate(target_hz=decision_hz * speed)
+            media = drone.camera.media
+            media.running = True
+            intake = threading.Thread(target=tracker.track, name="WildWings-Replay-Intake")
+            intake.start()
+            started[0] = time.monotonic()
+            try:
+                while True:
+                    frame = source.read()
+                    if frame is None or (duration is not None and frame[1] > duration):
+                        break
+                    _, frame_time, bgr = frame
+                    delay = started[0] + frame_time / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    media.frame_queue.put(ReplayFrame(bgr))
+                    frames += 1
+            finally:
+                media.running = False
+                intake.join()
+        else:
+            # decode only the decision frames, the frames in between are skipped
+            period = 1 / decision_hz
+            skip = 0
+            while True:
+                frame = source.read(skip)
+                if frame is None or (duration is not None and frame[1] > duration):
+                    break
+                index, frame_time, bgr = frame
+                video_time[0] = frame_time
+                tracker.decide(ReplayFrame(bgr), index + 1)
+                frames += 1
+                next_index = int(np.ceil((frame_time + period) * source.fps - 1e-6))
+                skip = max(0, next_index - index - 1)
+    finally:
+        wall_time = time.perf_counter() - wall_start
+        video_seconds = clock()
+        tracker.close()
+        trace_file.close()
+        source.close()
+
+    drone.piloting.write(os.path.join(output_directory, MOVES_FILE))
+    summary = {
+        "recording": recording,
+        "telemetry": telemetry,
+        "mode": "realtime" if realtime else "max_speed",
+        "speed": speed,
+        "decision_hz": decision_hz,
+        "fps": source.fps,
+        "frames": frames,
+        "decisions": decisions[0],
+        "moves": len(drone.piloting.moves),
+        "video_seconds": video_seconds,
+        "wall_seconds": wall_time,
+        "realtime_factor": video_seconds / wall_time if wall_time > 0 else None,
+        "stages": tracker.stages.stats(),
+        "detector": tracker.model.stats() if tracker.model is not None and hasattr(tracker.model, "stats") else None,
+        "motion_gate": tracker.motion_gate.stats() if tracker.motion_gate is not None else None,
+        "herd": tracker.herd.stats() if tracker.herd is not None else None,
+        "decision_rate": tracker.decision_rate.stats() if realtime else None,
+    }
+    with open(os.path.join(output_directory, SUMMARY_FILE), "w") as file:
+        json.dump(summary, file, indent=2, default=str)
+    logger.info(
+        f"Replayed {recording}: {summary['decisions']} decisions, {summary['moves']} moves, "
+        f"{video_seconds:.1f} s of video in {wall_time:.1f} s"
+    )
+    return summary
+
+
+def find_recording(mission_directory):
+    """
+    Recording of a mission directory: its first video file, or its frames directory
+    """
+    videos = sorted(glob.glob(os.path.join(mission_directory, "*.mp4")))
+    if videos:
+        return videos[0]
+    frames = os.path.join(mission_directory, "frames")
+    return frames if os.path.isdir(frames) else None
+
+def find_telemetry(mission_directory):
+    if os.path.exists(os.path.join(mission_directory, mission_log.LOG_DIRECTORY, "schema.json")):
+        return mission_directory
+    path = os.path.join(mission_directory, "telemetry_log.csv")
+    return path if os.path.exists(path) else None
+
+
+_worker_model = None
+
+def _replay_worker(mission, output_directory, options):
+    # the model is loaded once per worker process and shared by its missions
+    global _worker_model
+    logging.basicConfig(level=logging.WARNING)
+    if _worker_model is None:
+        _worker_model = load_model()
+    return replay(mission["recording"], output_directory, _worker_model, mission.get("telemetry"), **options)
+
+def replay_missions(missions, output_root, workers=None, **options):
+    """
+    Replay missions in parallel, one process per worker. `missions` are {"name", "recording", "telemetry"}
+    dictionaries, every replay is written to <output_root>/<name>. Returns {name: summary or error}
+    """
+    os.makedirs(output_root, exist_ok=True)
+    results = {}
+    context = mp.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(_replay_worker, mission, os.path.join(output_root, mission["name"]), options): mission["name"]
+            for mission in missions
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"Replay of {name} failed: {e}")
+                results[name] = {"error": str(e)}
+    with open(os.path.join(output_root, "benchmark.json"), "w") as file:
+        json.dump(results, file, indent=2, default=str)
+    return results
+
+
+def load_trace(replay_directory):
+    with open(os.path.join(replay_directory, TRACE_FILE)) as file:
+        return {trace["frame"]: trace for trace in map(json.loads, file)}
+
+def compare(replay_a, replay_b):
+    """
+    Compare the decisions taken on the same frames by two replays and their stage timings
+    """
+    trace_a, trace_b = load_trace(replay_a), load_trace(replay_b)
+    frames = sorted(set(trace_a) & set(trace_b))
+    different = [frame for frame in frames if trace_a[frame]["move"] != trace_b[frame]["move"]]
+    stages = {}
+    for stage in sorted({stage for trace in trace_a.values() for stage in trace["stages"]}):
+        a = [trace["stages"].get(stage, 0.0) for trace in trace_a.values()]
+        b = [trace["stages"].get(stage, 0.0) for trace in trace_b.values()]
+        stages[stage] = (float(np.median(a)) if a else None, float(np.median(b)) if b else None)
+    return {"frames": len(frames), "different_moves": different, "stages_p50": stages}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    flags = dict(arg[2:].split("=", 1) if "=" in arg else (arg[2:], "1") for arg in sys.argv[1:] if arg.startswith("--"))
+    command = args[0] if args else None
+
+    if command == "run" and len(args) >= 3:
+        summary = replay(
+            args[1], args[2], load_model(), args[3] if len(args) > 3 else None,
+            realtime="realtime" in flags, speed=float(flags.get("speed", 1.0)),
+        )
+        print(json.dumps({key: summary[key] for key in ("decisions", "moves", "video_seconds", "wall_seconds", "realtime_factor")}))
+        for stage, stats in summary["stages"].items():
+            print(f"{stage:>10}: p50 {stats['latency_p50'] * 1000:7.2f} ms, p95 {stats['latency_p95'] * 1000:7.2f} ms")
+    elif command == "batch" and len(args) >= 3:
+        missions = []
+        for directory in sorted(glob.glob(os.path.join(args[1], "*"))):
+            recording = find_recording(directory) if os.path.isdir(directory) else None
+            if recording is not None:
+                missions.append({"name": os.path.basename(directory), "recording": recording, "telemetry": find_telemetry(directory)})
+        workers = int(flags["workers"]) if "workers" in flags else None
+        results = replay_missions(missions, args[2], workers, realtime="realtime" in flags, speed=float(flags.get("speed", 1.0)))
+        for name, summary in sorted(results.items()):
+            if "error" in summary:
+                print(f"{name}: failed, {summary['error']}")
+            else:
+                print(f"{name}: {summary['decisions']} decisions, {summary['moves']} moves, {summary['realtime_factor']:.1f}x real time")
+    elif command == "compare" and len(args) >= 3:
+        result = compare(args[1], args[2])
+        print(f"{result['frames']} frames in both replays, {len(result['different_moves'])} different moves")
+        for stage, (a, b) in result["stages_p50"].items():
+            print(f"{stage:>10}: p50 {a * 1000:7.2f} ms -> {b * 1000:7.2f} ms" if a is not None and b is not None else f"{stage:>10}: n/a")
+    else:
+        print("Usage: python replay.py run <recording> <output directory> [<telemetry log>] [--realtime] [--speed=X]")
+        print("       python replay.py batch <missions directory> <output directory> [--workers=N] [--realtime] [--speed=X]")
+        print("       python replay.py compare <replay directory> <replay directory>")
+        sys.exit(1)
@@ -0,0 +1,137 @@
+# Region-of-interest inference that follows the herd.
+# Once the herd is found, the next frames are only inferred on an expanded crop around its last
+# bounding box and the boxes are mapped back to frame coordinates. The full frame is inferred again
+# when the herd is lost, when it reaches the edge of the crop, and every `refresh_every` frames.
+#
+# Enabled with WILDWINGS_ROI=1, tuned with WILDWINGS_ROI_REFRESH (frames) and WILDWINGS_ROI_MARGIN
+# (fraction of the herd size added on each side).
+
+import os
+
+import numpy as np
+
+from detectors import Detector, Detections, DEFAULT_PROFILE
+
+ROI_ENABLED = os.getenv("WILDWINGS_ROI", "0") == "1"
+ROI_REFRESH = int(os.getenv("WILDWINGS_ROI_REFRESH", "10"))
+ROI_MARGIN = float(os.getenv("WILDWINGS_ROI_MARGIN", "0.5"))
+ROI_MIN_SIZE = 320 # pixels, smaller crops don't save inference time anymore
+
+
+def herd_bbox(detections):
+    """
+    Bounding box (x1, y1, x2, y2) of all the boxes of a frame
+    """
+    xyxy = detections.xyxy
+    return (float(xyxy[:, 0].min()), float(xyxy[:, 1].min()), float(xyxy[:, 2].max()), float(xyxy[:, 3].max()))
+
+def expand_bbox(bbox, shape, margin=ROI_MARGIN, min_size=ROI_MIN_SIZE):
+    """
+    Expand a box by `margin` times its size on each side, to at least `min_size`,
+    and clamp it to the frame. Coordinates are even so the crop maps onto the YUV chroma planes
+    """
+    height, width = shape[:2]
+    x1, y1, x2, y2 = bbox
+    w = max(x2 - x1, 1.0)
+    h = max(y2 - y1, 1.0)
+    half_w = max(w * (0.5 + margin), min(min_size, width) / 2)
+    half_h = max(h * (0.5 + margin), min(min_size, height) / 2)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    # shift the window inside the frame instead of shrinking it
+    cx = min(max(cx, half_w), width - half_w)
+    cy = min(max(cy, half_h), height - half_h)
+    left = max(0, int(cx - half_w) & ~1)
+    top = max(0, int(cy - half_h) & ~1)
+    right = min(width, (int(np.ceil(cx + half_w)) + 1) & ~1)
+    bottom = min(height, (int(np.ceil(cy + half_h)) + 1) & ~1)
+    return left, top, right, bottom
+
+def crop_altitude(altitude, crop_width, width):
+    """
+    Altitude at which a crop `crop_width` pixels wide would span the whole field of view. The animals keep
+    their size in pixels in the crop, so the wrapped detector (tiling.select_tiling) sizes them right
+    """
+    if altitude is None:
+        return None
+    return altitude * crop_width / width
+
+
+class RoiDetector(Detector):
+    """
+    Wrap a detector to infer on the herd region only, state is per mission
+    """
+    backend = "roi"
+
+    def __init__(self, detector, refresh_every=ROI_REFRESH, margin=ROI_MARGIN, min_size=ROI_MIN_SIZE):
+        super().__init__(detector.name)
+        self.detector = detector
+        self.backend = f"roi+{detector.backend}"
+        self.refresh_every = refresh_every
+        self.margin = margin
+        self.min_size = min_size
+        self.roi = None
+        self.since_refresh = 0
+        self.full_frames = 0
+        self.roi_frames = 0
+        self.lost = 0
+        self.pixels = 0
+        self.full_pixels = 0
+
+    def reset(self):
+        self.roi = None
+        self.since_refresh = 0
+
+    def _full(self, frame, profile, altitude):
+        detections = self.detector(frame, profile, altitude)
+        self.full_frames += 1
+        self.pixels += frame.shape[0] * frame.shape[1]
+        self.since_refresh = 0
+        return detections
+
+    def detect(self, frame, profile=DEFAULT_PROFILE, altitude=None):
+        self.full_pixels += frame.shape[0] * frame.shape[1]
+
+        if self.roi is None or self.since_refresh >= self.refresh_every:
+            detections = self._full(frame, profile, altitude)
+            edge = False
+        else:
+            left, top, right, bottom = self.roi
+            crop = frame[top:bottom, left:right]
+            found = self.detector(crop, profile, crop_altitude(altitude, right - left, frame.shape[1]))
+            self.roi_frames += 1
+            self.since_refresh += 1
+            self.pixels += crop.shape[0] * crop.shape[1]
+
+            if len(found) == 0:
+                # herd lost, look for it in the whole frame right away
+                self.lost += 1
+                detections = self._full(frame, profile, altitude)
+                edge = False
+            else:
+                xyxy = found.xyxy + np.array([left, top, left, top], dtype=np.float32)
+                detections = Detections(xyxy, found.conf, found.cls, frame.shape, image=frame, names=found.names)
+                # a herd touching an inner side of the crop may extend past it, refresh on the next frame
+                height, width = frame.shape[:2]
+                x1, y1, x2, y2 = herd_bbox(detections)
+                edge = (
+                    (left > 0 and x1 <= left + 1) or (top > 0 and y1 <= top + 1)
+                    or (right < width and x2 >= right - 1) or (bottom < height and y2 >= bottom - 1)
+                )
+
+        if len(detections) == 0:
+            self.roi = None
+        else:
+            self.roi = expand_bbox(herd_bbox(detections), frame.shape, self.margin, self.min_size)
+            if edge:
+                self.since_refresh = self.refresh_every
+        return detections
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            "full_frames": self.full_frames,
+            "roi_frames": self.roi_frames,
+            "lost": self.lost,
+            "pixel_ratio": self.pixels / self.full_pixels if self.full_pixels else None,
+        })
+        return stats
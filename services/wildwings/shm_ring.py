@@ -0,0 +1,271 @@
+# Shared-memory frame handoff between the stream process and a dedicated inference process.
+# Frames are written once into preallocated shared buffers, only the slot number and a few
+# integers cross the pipe, so 1080p frames are never pickled and inference runs on its own
+# core without competing with the Olympe callbacks for the GIL.
+
+import json
+import time
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+DEFAULT_SLOTS = 4
+DEFAULT_MAX_BYTES = 1920 * 1088 * 3 // 2 # one 1080p I420/NV12 frame (height padded to 1088)
+HEADER_FIELDS = 5 # seq, rows, cols, cvt_flag, frame_number
+
+logger = logging.getLogger("wildwings.inference")
+
+
+class FrameRing:
+    """
+    Ring of preallocated frame buffers in shared memory.
+    Each slot header holds the sequence number of the frame in it, -1 while it is being written,
+    so a reader can detect a frame that was overwritten under its feet.
+    """
+    def __init__(self, name=None, slots=DEFAULT_SLOTS, max_bytes=DEFAULT_MAX_BYTES, create=False):
+        self.slots = slots
+        self.max_bytes = max_bytes
+        control_bytes = 8 * 2
+        header_bytes = 8 * slots * HEADER_FIELDS
+        size = control_bytes + header_bytes + slots * max_bytes
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.name = self.shm.name
+        self.owner = create
+
+        buf = self.shm.buf
+        # control: the slot and sequence number currently read by the inference process
+        self.control = np.ndarray((2,), dtype=np.int64, buffer=buf, offset=0)
+        self.header = np.ndarray((slots, HEADER_FIELDS), dtype=np.int64, buffer=buf, offset=control_bytes)
+        self.data = np.ndarray((slots, max_bytes), dtype=np.uint8, buffer=buf, offset=control_bytes + header_bytes)
+        if create:
+            self.header[:] = 0
+            self.control[:] = -1
+
+        self.seq = 0
+        self.latest_slot = -1
+        self.next_slot = 0
+
+    def _pick_slot(self):
+        # never overwrite the latest published frame or the one being read
+        reader_slot = int(self.control[0])
+        for _ in range(self.slots):
+            slot = self.next_slot
+            self.next_slot = (self.next_slot + 1) % self.slots
+            if slot != self.latest_slot and slot != reader_slot:
+                return slot
+        raise RuntimeError("No free frame slot")
+
+    def write(self, frame, cvt_flag, frame_number):
+        """
+        Copy a frame into a free slot (the only copy of the handoff) and return (slot, seq)
+        """
+        if frame.nbytes > self.max_bytes:
+            raise ValueError(f"Frame of {frame.nbytes} bytes does not fit in slots of {self.max_bytes} bytes")
+        rows, cols = frame.shape[:2]
+        slot = self._pick_slot()
+        self.header[slot, 0] = -1
+        np.copyto(self.data[slot, :frame.nbytes].reshape(frame.shape), frame)
+        self.seq += 1
+        self.header[slot, 1:] = (rows, cols, cvt_flag, frame_number)
+        self.header[slot, 0] = self.seq
+        self.latest_slot = slot
+        return slot, self.seq
+
+    def read(self, slot, seq):
+        """
+        Return a view on the frame of a slot, None if it was already overwritten
+        """
+        self.control[:] = (slot, seq)
+        if self.header[slot, 0] != seq:
+            self.release()
+            return None
+        rows, cols = int(self.header[slot, 1]), int(self.header[slot, 2])
+        return self.data[slot, :rows * cols].reshape(rows, cols)
+
+    def valid(self, slot, seq):
+        return self.header[slot, 0] == seq
+
+    def release(self):
+        self.control[:] = -1
+
+    def close(self):
+        # the numpy views must be dropped before the shared memory can be closed
+        self.control = self.header = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def finish_mission(mission_herd, evidence, mission_log):
+    """
+    Write the evidence frames and detections of a mission of the inference process
+    """
+    if mission_herd is not None:
+        logger.info(f"Herd tracking: {mission_herd.stats()}")
+    evidence.flush(10.0)
+    logger.info(f"Evidence: {evidence.stats()}")
+    mission_log.close()
+
+
+def inference_main(ring_name, slots, max_bytes, conn, model_name):
+    """
+    Entry point of the inference process: load the model once, then answer
+    frame requests with the next move, always skipping to the newest request.
+    An {"end": output_directory} request finishes the mission
+    """
+    import cv2
+    import navigation
+    from detectors import load_detector, DetectionProfile
+    from geometry import CameraPose
+    from evidence import EvidenceWriter
+    from yuv import YuvFrame, YUV_PREPROCESS
+    from mission_log import MissionLog
+
+    ring = FrameRing(ring_name, slots, max_bytes)
+    profiles = {}
+    mission_model, mission_herd, mission_directory, mission_log = None, None, None, None
+    try:
+        model = load_detector(model_name)
+        # annotated frames are written by worker threads of this process
+        evidence = EvidenceWriter()
+        conn.send({"ready": True})
+    except Exception as e:
+        conn.send({"ready": False, "error": str(e)})
+        ring.close()
+        return
+
+    try:
+        while True:
+            request = conn.recv()
+            while request is not None and "end" not in request and conn.poll():
+                conn.send({"seq": request["seq"], "skipped": True})
+                request = conn.recv()
+            if request is None:
+                break
+            if "end" in request:
+                # the stream of the mission stopped, its data is written now instead of when the next mission starts
+                if request["end"] == mission_directory:
+                    finish_mission(mission_herd, evidence, mission_log)
+                    mission_model, mission_herd, mission_directory, mission_log = None, None, None, None
+                conn.send({"end": request["end"]})
+                continue
+
+            start = time.perf_counter()
+            frame = ring.read(request["slot"], request["seq"])
+            if frame is None:
+                conn.send({"seq": request["seq"], "skipped": True})
+                continue
+            cvt_flag = int(ring.header[request["slot"], 3])
+            shape = (frame.shape[0] * 2 // 3, frame.shape[1])
+            if YUV_PREPROCESS:
+                # the YUV frame is copied out of the ring, the detector only converts its reduced input
+                image = YuvFrame(frame.copy(), cvt_flag, frame.shape[0] * 2 // 3, frame.shape[1])
+            else:
+                image = cv2.cvtColor(frame, cvt_flag)
+            valid = ring.valid(request["slot"], request["seq"])
+            del frame
+            ring.release()
+            if not valid:
+                conn.send({"seq": request["seq"], "skipped": True})
+                continue
+
+            # the profile of a mission is only parsed once
+            key = json.dumps(request["profile"], sort_keys=True)
+            if key not in profiles:
+                profiles[key] = DetectionProfile.from_dict(request["profile"])
+            # a new mission starts with a new tiling / ROI / herd tracking state
+            if request["output_directory"] != mission_directory:
+                if mission_directory is not None:
+                    finish_mission(mission_herd, evidence, mission_log)
+                evidence.reset()
+                mission_directory = request["output_directory"]
+                # the detections table of the mission, the stream process writes the telemetry table
+                mission_log = MissionLog(mission_directory)
+                mission_model = navigation.mission_detector(model)
+                mission_herd = navigation.mission_herd()
+            pose = CameraPose.from_dict(request["pose"])
+            # compensated from the frame the herd last saw, the requests skipped in between don't matter
+            navigation.follow_flight(mission_herd, request.get("position"), shape, pose)
+            move = navigation.get_next_action(
+                image, mission_model, mission_directory, request["frame_number"], profiles[key], pose, mission_herd, evidence, mission_log
+            )
+            conn.send({"seq": request["seq"], "move": move, "latency": time.perf_counter() - start})
+    finally:
+        evidence.close()
+        if mission_log is not None:
+            mission_log.close()
+        ring.close()
+
+
+class RemoteDetector:
+    """
+    Stream-side handle of the inference process started once with its own model
+    """
+    def __init__(self, model_name="yolov5su", slots=DEFAULT_SLOTS, max_bytes=DEFAULT_MAX_BYTES, start_timeout=300):
+        context = mp.get_context("spawn")
+        self.ring = FrameRing(None, slots, max_bytes, create=True)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=inference_main,
+            args=(self.ring.name, slots, max_bytes, child_conn, model_name),
+            name="WildWings-Inference",
+            daemon=True
+        )
+        self.process.start()
+
+        if not self.conn.poll(start_timeout):
+            self.close()
+            raise RuntimeError("Inference process did not start in time")
+        ready = self.conn.recv()
+        if not ready.get("ready"):
+            self.close()
+            raise RuntimeError(f"Inference process failed to start: {ready.get('error')}")
+        logger.info(f"Inference process started (pid {self.process.pid})")
+
+    def get_next_action(self, frame, cvt_flag, frame_number, output_directory, profile, pose=None, position=None, timeout=30):
+        """
+        Hand a YUV frame to the inference process and wait for the next move with the detection profile of the mission,
+        `position` is the drone position at the frame (Tracker.drone_position) for the herd ego-motion compensation
+        """
+        slot, seq = self.ring.write(frame, cvt_flag, frame_number)
+        self.conn.send({
+            "slot": slot,
+            "seq": seq,
+            "frame_number": frame_number,
+            "output_directory": output_directory,
+            "profile": profile.to_dict(),
+            "pose": pose.to_dict() if pose is not None else None,
+            "position": position,
+        })
+        while self.conn.poll(timeout):
+            reply = self.conn.recv()
+            if reply.get("seq") != seq:
+                continue
+            if reply.get("skipped"):
+                return None
+            return reply["move"]
+        raise TimeoutError(f"No inference result for frame {frame_number} after {timeout}s")
+
+    def end_mission(self, output_directory, timeout=30):
+        """
+        Tell the inference process the mission stream stopped and wait until it wrote the detections and evidence
+        """
+        self.conn.send({"end": output_directory})
+        while self.conn.poll(timeout):
+            # replies of requests that timed out before are dropped
+            if self.conn.recv().get("end") == output_directory:
+                return
+        raise TimeoutError(f"The inference process did not finish the mission {output_directory} after {timeout}s")
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(10)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.ring.close()
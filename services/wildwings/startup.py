@@ -0,0 +1,76 @@
+# Startup state of the wildwings service.
+# The heavy dependencies (cv2, olympe, SoftwarePilot, torch/ultralytics) are imported in the background
+# by the mission worker while the HTTP API is already up. Each import is timed so a slow restart can be
+# traced to a dependency, and each subsystem (streaming, drone, model) reports when it is warm.
+
+import sys
+import time
+import importlib
+import threading
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """
+    Import times and warm-up state of the subsystems of the service
+    """
+    def __init__(self, subsystems):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.imports = {}
+        self.subsystems = {name: {"ready": False, "seconds": None, "error": None} for name in subsystems}
+
+    def timed_import(self, name):
+        """
+        Import a module and record its import time and the number of modules it pulled in,
+        a module already imported is returned without a record
+        """
+        if name in sys.modules:
+            return sys.modules[name]
+        modules = len(sys.modules)
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        with self.lock:
+            self.imports[name] = {
+                "seconds": round(time.perf_counter() - start, 4),
+                "modules": len(sys.modules) - modules,
+            }
+        return module
+
+    @contextmanager
+    def warming(self, subsystem):
+        """
+        Mark `subsystem` warm once the block succeeds, its error is recorded otherwise
+        """
+        if subsystem not in self.subsystems:
+            raise ValueError(f"Illegal subsystem {subsystem}")
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            with self.lock:
+                self.subsystems[subsystem]["error"] = str(e)
+            raise
+        with self.lock:
+            self.subsystems[subsystem].update(ready=True, seconds=round(time.perf_counter() - start, 4))
+
+    def ready(self):
+        with self.lock:
+            return all(state["ready"] for state in self.subsystems.values())
+
+    def checks(self):
+        with self.lock:
+            return {name: dict(state) for name, state in self.subsystems.items()}
+
+    def report(self):
+        """
+        Slowest imports first, with the warm-up time of each subsystem
+        """
+        with self.lock:
+            imports = sorted(self.imports.items(), key=lambda item: item[1]["seconds"], reverse=True)
+            return {
+                "uptime": round(time.perf_counter() - self.started, 4),
+                "import_seconds": round(sum(record["seconds"] for _, record in imports), 4),
+                "imports": [{"module": name, **record} for name, record in imports],
+                "subsystems": {name: dict(state) for name, state in self.subsystems.items()},
+            }
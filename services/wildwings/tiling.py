@@ -0,0 +1,136 @@
+# Tiled (slicing) inference for small animals seen from altitude.
+# The frame is split into overlapping tiles inferred in one batch together with the whole frame,
+# the boxes are mapped back to frame coordinates and merged with a cross-tile NMS. The tile size
+# and overlap are picked from the altitude, tiling is skipped when the animals are already large
+# enough in the resized full frame.
+#
+# Enabled with WILDWINGS_TILING=1.
+
+import os
+import math
+
+import numpy as np
+
+from detectors import Detector, Detections, DEFAULT_PROFILE, batched_nms
+from geometry import CAMERA_HFOV
+
+TILING_ENABLED = os.getenv("WILDWINGS_TILING", "0") == "1"
+ANIMAL_SIZE = 1.5 # meters, size of the smallest animals to detect
+MIN_OBJECT_PX = 32 # pixels an animal needs at the model input to be detected reliably
+TILE_SIZES = (1280, 960, 640) # pixels, largest first
+MIN_OVERLAP, MAX_OVERLAP = 0.1, 0.3
+
+
+def animal_size_px(altitude, width, hfov=CAMERA_HFOV, animal_size=ANIMAL_SIZE):
+    """
+    Size in frame pixels of an animal seen from `altitude` meters, camera pointing down
+    """
+    ground_width = 2 * altitude * math.tan(math.radians(hfov) / 2)
+    return animal_size * width / ground_width
+
+def select_tiling(altitude, shape, input_size):
+    """
+    Pick the largest tile size that shows the animals with at least MIN_OBJECT_PX at the model input,
+    and an overlap that fits a whole animal. Returns (tile, overlap), None when the full frame is enough
+    """
+    if altitude is None or altitude <= 0:
+        return None
+    height, width = shape[:2]
+    longest = max(height, width)
+    size_px = animal_size_px(altitude, width)
+    if size_px * input_size / longest >= MIN_OBJECT_PX:
+        return None
+    tile = TILE_SIZES[-1]
+    for candidate in TILE_SIZES:
+        if size_px * input_size / candidate >= MIN_OBJECT_PX:
+            tile = candidate
+            break
+    if tile >= longest:
+        return None
+    overlap = min(max(1.2 * size_px / tile, MIN_OVERLAP), MAX_OVERLAP)
+    return tile, overlap
+
+def tile_windows(shape, tile, overlap):
+    """
+    Overlapping (x1, y1, x2, y2) windows covering the frame, the last ones aligned on the frame edges.
+    The coordinates are even (for even frame and tile sizes) so the tiles map onto the YUV chroma planes
+    """
+    height, width = shape[:2]
+
+    def starts(size):
+        length = min(tile, size)
+        stride = max(2, int(length * (1 - overlap)) & ~1)
+        positions = list(range(0, size - length + 1, stride))
+        if positions[-1] + length < size:
+            positions.append(size - length)
+        return positions, length
+
+    xs, tile_w = starts(width)
+    ys, tile_h = starts(height)
+    return [(x, y, x + tile_w, y + tile_h) for y in ys for x in xs]
+
+
+class TiledDetector(Detector):
+    """
+    Wrap a detector to infer overlapping tiles of the frame in one batch when flying high
+    """
+    backend = "tiled"
+
+    def __init__(self, detector, include_full=True):
+        super().__init__(detector.name)
+        self.detector = detector
+        self.backend = f"tiled+{detector.backend}"
+        # the whole frame is inferred in the same batch for the animals larger than a tile
+        self.include_full = include_full
+        self.tiled_frames = 0
+        self.single_frames = 0
+        self.last_tiling = None
+
+    def detect(self, frame, profile=DEFAULT_PROFILE, altitude=None):
+        input_size = getattr(self.detector, "input_size", profile.imgsz)
+        tiling = select_tiling(altitude, frame.shape, input_size)
+        if tiling is None:
+            self.single_frames += 1
+            return self.detector(frame, profile)
+
+        tile, overlap = tiling
+        windows = tile_windows(frame.shape, tile, overlap)
+        images = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in windows]
+        if self.include_full:
+            images.append(frame)
+            windows.append((0, 0, frame.shape[1], frame.shape[0]))
+        results = self.detector.detect_batch(images, profile)
+        self.tiled_frames += 1
+        self.last_tiling = {"altitude": altitude, "tile": tile, "overlap": overlap, "tiles": len(windows)}
+
+        height, width = frame.shape[:2]
+        xyxy, conf, cls = [], [], []
+        for (x1, y1, x2, y2), found in zip(windows, results):
+            if len(found) == 0:
+                continue
+            boxes = found.xyxy
+            # boxes cut by an inner tile edge are partial animals, the overlap shows them whole in a neighbour tile
+            cut = (
+                ((boxes[:, 0] <= 1) & (x1 > 0)) | ((boxes[:, 1] <= 1) & (y1 > 0))
+                | ((boxes[:, 2] >= x2 - x1 - 1) & (x2 < width)) | ((boxes[:, 3] >= y2 - y1 - 1) & (y2 < height))
+            )
+            keep = ~cut
+            xyxy.append(boxes[keep] + np.array([x1, y1, x1, y1], dtype=np.float32))
+            conf.append(found.conf[keep])
+            cls.append(found.cls[keep])
+
+        names = results[0].names
+        if not xyxy:
+            return Detections(np.zeros((0, 4)), np.zeros(0), np.zeros(0), frame.shape, image=frame, names=names)
+        xyxy, conf, cls = np.concatenate(xyxy), np.concatenate(conf), np.concatenate(cls)
+        keep = batched_nms(xyxy, conf, cls, profile.iou)[:profile.max_det]
+        return Detections(xyxy[keep], conf[keep], cls[keep], frame.shape, image=frame, names=names)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            "tiled_frames": self.tiled_frames,
+            "single_frames": self.single_frames,
+            "last_tiling": self.last_tiling,
+        })
+        return stats
@@ -0,0 +1,315 @@
+# Multi-object tracking of the animals and Kalman filtering of the herd between detections.
+# Animals are associated across decision frames ByteTrack-style (confident boxes first, then the
+# low confidence ones to keep the existing tracks alive) with a constant velocity Kalman filter
+# per track, which gives stable track IDs and a de-duplicated head count. The herd centroid and
+# extent have their own filter, so decisions are smoothed and can be predicted between inferences.
+# The filters are in frame pixels: the displacement the drone flew between two frames shifts their state
+# by where the herd appears after it (ego-motion compensation), so the drone's own moves aren't learned as herd velocity.
+#
+# Disabled with WILDWINGS_HERD_TRACKING=0.
+
+import os
+import time
+
+import numpy as np
+
+HERD_TRACKING = os.getenv("WILDWINGS_HERD_TRACKING", "1") == "1"
+
+
+def iou_matrix(a, b):
+    """
+    Pairwise IoU between two sets of xyxy boxes
+    """
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+def greedy_match(iou, threshold):
+    """
+    Match rows to columns by decreasing IoU above `threshold`, returns the (row, column) pairs
+    """
+    matches = []
+    if iou.size == 0:
+        return matches
+    rows, cols = np.unravel_index(np.argsort(-iou, axis=None), iou.shape)
+    used_rows, used_cols = set(), set()
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        if iou[i, j] < threshold:
+            break
+        if i in used_rows or j in used_cols:
+            continue
+        matches.append((i, j))
+        used_rows.add(i)
+        used_cols.add(j)
+    return matches
+
+def xyxy_to_cxcywh(box):
+    return np.array([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2, box[2] - box[0], box[3] - box[1]], dtype=np.float64)
+
+def cxcywh_to_xyxy(box):
+    return np.array([box[0] - box[2] / 2, box[1] - box[3] / 2, box[0] + box[2] / 2, box[1] + box[3] / 2], dtype=np.float64)
+
+
+class ConstantVelocityKalman:
+    """
+    Kalman filter of a measurement vector with a constant velocity per component,
+    `acceleration` is the process noise in pixels/s² and `measurement_noise` the measurement std in pixels,
+    scalars or one value per component
+    """
+    def __init__(self, measurement, acceleration=50.0, measurement_noise=10.0, initial_velocity_std=50.0):
+        n = len(measurement)
+        self.n = n
+        self.acceleration = np.broadcast_to(np.asarray(acceleration, dtype=np.float64), (n,))
+        measurement_noise = np.broadcast_to(np.asarray(measurement_noise, dtype=np.float64), (n,))
+        initial_velocity_std = np.broadcast_to(np.asarray(initial_velocity_std, dtype=np.float64), (n,))
+        self.x = np.zeros(2 * n)
+        self.x[:n] = measurement
+        self.P = np.diag(np.concatenate([measurement_noise ** 2, initial_velocity_std ** 2]))
+        self.H = np.hstack([np.eye(n), np.zeros((n, n))])
+        self.R = np.diag(measurement_noise ** 2)
+
+    def predict(self, dt):
+        if dt <= 0:
+            return self.x[:self.n]
+        n = self.n
+        F = np.eye(2 * n)
+        F[:n, n:] = np.eye(n) * dt
+        q = np.diag(self.acceleration ** 2)
+        Q = np.zeros((2 * n, 2 * n))
+        Q[:n, :n] = q * dt ** 4 / 4
+        Q[:n, n:] = Q[n:, :n] = q * dt ** 3 / 2
+        Q[n:, n:] = q * dt ** 2
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+        return self.x[:self.n]
+
+    def update(self, measurement):
+        y = measurement - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(2 * self.n) - K @ self.H) @ self.P
+        return self.x[:self.n]
+
+
+# the box size of an animal changes much slower than its position
+TRACK_ACCELERATION = (10.0, 10.0, 2.0, 2.0) # cx, cy, w, h in pixels/s²
+TRACK_MEASUREMENT_NOISE = (5.0, 5.0, 5.0, 5.0) # pixels
+TRACK_VELOCITY_STD = (50.0, 50.0, 2.0, 2.0) # pixels/s
+
+
+class Track:
+    """
+    One animal followed across frames
+    """
+    def __init__(self, track_id, box, cls, conf, timestamp):
+        self.id = track_id
+        self.cls = int(cls)
+        self.conf = float(conf)
+        self.kalman = ConstantVelocityKalman(xyxy_to_cxcywh(box), TRACK_ACCELERATION, TRACK_MEASUREMENT_NOISE, TRACK_VELOCITY_STD)
+        self.hits = 1
+        self.misses = 0
+        self.confirmed = False
+        self.last_seen = timestamp
+
+    @property
+    def box(self):
+        cx, cy, w, h = self.kalman.x[:4]
+        return cxcywh_to_xyxy((cx, cy, max(w, 1.0), max(h, 1.0)))
+
+    def update(self, box, conf, timestamp):
+        self.kalman.update(xyxy_to_cxcywh(box))
+        self.conf = float(conf)
+        self.hits += 1
+        self.misses = 0
+        self.last_seen = timestamp
+
+
+class MultiObjectTracker:
+    """
+    SORT/ByteTrack-style tracker: Kalman prediction, IoU association of the confident boxes,
+    then of the low confidence ones to the unmatched tracks, tracks confirmed after `min_hits`
+    and dropped after `max_misses` frames without a match
+    """
+    def __init__(self, high_conf=0.5, low_conf=0.1, match_iou=0.2, low_match_iou=0.3, min_hits=3, max_misses=3):
+        self.high_conf = high_conf
+        self.low_conf = low_conf
+        self.match_iou = match_iou
+        self.low_match_iou = low_match_iou
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        self.tracks = []
+        self.next_id = 1
+        self.timestamp = None
+        # ids of the confirmed tracks by class, for the de-duplicated head count
+        self.confirmed_ids = {}
+
+    def _associate(self, tracks, boxes, classes, threshold):
+        if not tracks or len(boxes) == 0:
+            return [], list(range(len(tracks))), list(range(len(boxes)))
+        iou = iou_matrix(np.array([track.box for track in tracks]), boxes)
+        iou[np.array([track.cls for track in tracks])[:, None] != classes[None, :]] = 0
+        matches = greedy_match(iou, threshold)
+        matched_tracks = {i for i, _ in matches}
+        matched_boxes = {j for _, j in matches}
+        return (
+            matches,
+            [i for i in range(len(tracks)) if i not in matched_tracks],
+            [j for j in range(len(boxes)) if j not in matched_boxes],
+        )
+
+    def update(self, detections, timestamp):
+        """
+        Update the tracks with the detections of a frame, returns the confirmed tracks seen in it
+        """
+        dt = timestamp - self.timestamp if self.timestamp is not None else 0.0
+        self.timestamp = timestamp
+        for track in self.tracks:
+            track.kalman.predict(dt)
+
+        high = detections.conf >= self.high_conf
+        low = (detections.conf >= self.low_conf) & ~high
+        high_index, low_index = np.flatnonzero(high), np.flatnonzero(low)
+
+        # confident boxes against every track
+        matches, unmatched_tracks, unmatched_high = self._associate(
+            self.tracks, detections.xyxy[high_index], detections.cls[high_index], self.match_iou
+        )
+        for i, j in matches:
+            k = high_index[j]
+            self.tracks[i].update(detections.xyxy[k], detections.conf[k], timestamp)
+
+        # low confidence boxes only keep the remaining tracks alive
+        remaining = [self.tracks[i] for i in unmatched_tracks]
+        low_matches, still_unmatched, _ = self._associate(
+            remaining, detections.xyxy[low_index], detections.cls[low_index], self.low_match_iou
+        )
+        for i, j in low_matches:
+            k = low_index[j]
+            remaining[i].update(detections.xyxy[k], detections.conf[k], timestamp)
+        for i in still_unmatched:
+            remaining[i].misses += 1
+
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        for j in unmatched_high:
+            k = high_index[j]
+            self.tracks.append(Track(self.next_id, detections.xyxy[k], detections.cls[k], detections.conf[k], timestamp))
+            self.next_id += 1
+
+        for track in self.tracks:
+            if not track.confirmed and track.hits >= self.min_hits:
+                track.confirmed = True
+                self.confirmed_ids.setdefault(track.cls, set()).add(track.id)
+        return [track for track in self.tracks if track.confirmed and track.misses == 0]
+
+    def compensate(self, transform):
+        """
+        Move every track to where it appears after the drone's move, `transform` maps an (N, 2) array of pixels
+        """
+        for track in self.tracks:
+            (x1, y1), (x2, y2) = transform(track.box.reshape(2, 2))
+            track.kalman.x[:4] = xyxy_to_cxcywh((x1, y1, x2, y2))
+
+    def head_count(self):
+        """
+        Number of distinct animals confirmed since the start of the mission, by class
+        """
+        return {cls: len(ids) for cls, ids in self.confirmed_ids.items()}
+
+
+class HerdState:
+    """
+    Estimated herd centroid (mean of the animal centers) and extent (x1, y1, x2, y2) in frame pixels
+    """
+    def __init__(self, state, predicted=False):
+        self.centroid = (float(state[0]), float(state[1]))
+        self.bbox = (float(state[2]), float(state[3]), float(state[4]), float(state[5]))
+        self.predicted = predicted
+
+
+class HerdTracker:
+    """
+    Per-mission herd state: animal tracks and a Kalman filter on the herd centroid and extent,
+    predicted for up to `max_coast` seconds without detections
+    """
+    def __init__(self, max_coast=3.0, acceleration=50.0, measurement_noise=15.0, clock=time.monotonic):
+        self.animals = MultiObjectTracker()
+        # time source of the update/predict timestamps, the video time when replaying a recording
+        self.clock = clock
+        # drone position and camera pose of the last frame, kept by navigation.follow_flight
+        self.flight = None
+        self.max_coast = max_coast
+        self.acceleration = acceleration
+        self.measurement_noise = measurement_noise
+        self.kalman = None
+        self.timestamp = None
+        self.last_seen = None
+        self.updates = 0
+        self.predictions = 0
+        self.compensations = 0
+
+    def update(self, detections, timestamp):
+        """
+        Update with the detections of a frame, returns the filtered HerdState
+        (predicted if the herd was not detected, None once it is lost)
+        """
+        self.animals.update(detections, timestamp)
+        if len(detections) == 0:
+            return self.predict(timestamp)
+
+        xyxy = detections.xyxy
+        measurement = np.array([
+            (xyxy[:, 0].sum() + xyxy[:, 2].sum()) / (2 * len(xyxy)),
+            (xyxy[:, 1].sum() + xyxy[:, 3].sum()) / (2 * len(xyxy)),
+            xyxy[:, 0].min(), xyxy[:, 1].min(), xyxy[:, 2].max(), xyxy[:, 3].max(),
+        ], dtype=np.float64)
+        if self.kalman is None or timestamp - self.last_seen > self.max_coast:
+            self.kalman = ConstantVelocityKalman(measurement, self.acceleration, self.measurement_noise)
+        else:
+            self.kalman.predict(timestamp - self.timestamp)
+            self.kalman.update(measurement)
+        self.timestamp = timestamp
+        self.last_seen = timestamp
+        self.updates += 1
+        return HerdState(self.kalman.x)
+
+    def predict(self, timestamp):
+        """
+        Extrapolate the herd state to `timestamp` without a detection, None if there is no recent herd
+        """
+        if self.kalman is None or timestamp - self.last_seen > self.max_coast:
+            return None
+        self.kalman.predict(timestamp - self.timestamp)
+        self.timestamp = timestamp
+        self.predictions += 1
+        return HerdState(self.kalman.x, predicted=True)
+
+    def compensate(self, transform):
+        """
+        Ego-motion compensation: shift the herd state and the animal tracks to where they appear after the
+        displacement the drone flew, `transform` maps an (N, 2) array of pixels (geometry.moved_pixels).
+        The velocities are kept, they are the herd's own motion
+        """
+        self.animals.compensate(transform)
+        if self.kalman is None:
+            return
+        x = self.kalman.x
+        (cx, cy), (x1, y1), (x2, y2) = transform(np.array([[x[0], x[1]], [x[2], x[3]], [x[4], x[5]]]))
+        x[:6] = (cx, cy, x1, y1, x2, y2)
+        self.compensations += 1
+
+    def stats(self):
+        head_count = self.animals.head_count()
+        return {
+            "updates": self.updates,
+            "predictions": self.predictions,
+            "compensations": self.compensations,
+            "active_tracks": sum(1 for track in self.animals.tracks if track.confirmed),
+            "head_count": sum(head_count.values()),
+            "head_count_by_class": head_count,
+        }
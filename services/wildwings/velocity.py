@@ -0,0 +1,207 @@
+# Continuous piloting of the drone towards the latest decision (WILDWINGS_VELOCITY_CONTROL=1).
+# A PD controller turns the offset left to fly into roll, pitch and gaz setpoints (PCMD) sent at a
+# fixed rate from a background thread, through the piloting interface of the olympe drone, so it
+# works with any drone object that exposes one (the SoftwarePilot drone has no velocity control).
+# Targets are coalesced: a new decision replaces the previous target, however many arrive between
+# two ticks, and the drone brakes and hovers once a target is reached or not refreshed in time.
+
+import math
+import time
+import logging
+import threading
+
+logger = logging.getLogger("wildwings.velocity")
+
+TOLERANCE = 0.5 # meters left at which a target is reached
+TARGET_TIMEOUT = 3.0 # seconds after which a target that was not refreshed is dropped
+
+
+class VelocityControl:
+    """
+    Closed-loop piloting of an olympe drone towards the latest target offset (x forward, y right, z up)
+    in meters, relative to where the drone was when the target was set. Gains are in percent of the
+    maximum tilt (or vertical speed) per meter and per meter per second
+    """
+    def __init__(self, drone, rate=10.0, kp=6.0, kd=3.0, kp_z=15.0, kd_z=3.0, max_tilt=30.0, max_gaz=30.0, max_step=10.0,
+                 tolerance=TOLERANCE, target_timeout=TARGET_TIMEOUT):
+        if rate <= 0 or max_tilt <= 0 or max_gaz <= 0 or max_step <= 0:
+            raise ValueError("Illegal velocity control parameters")
+        self.drone = drone
+        # the simulated drone runs on its own clock, a real one in real time
+        clock = getattr(drone, "clock", None)
+        self.time = clock.time if clock is not None else time.monotonic
+        self.wait = clock.wait if clock is not None else (lambda event, timeout: event.wait(timeout))
+        self.rate = rate
+        self.kp, self.kd = kp, kd
+        self.kp_z, self.kd_z = kp_z, kd_z
+        self.max_tilt = min(max_tilt, 100.0)
+        self.max_gaz = min(max_gaz, 100.0)
+        self.max_step = max_step
+        self.tolerance = tolerance
+        self.target_timeout = target_timeout
+
+        # olympe is imported by the drone connection, not when the module loads
+        from olympe.messages.ardrone3.PilotingState import SpeedChanged, AttitudeChanged
+        self.speed_changed = SpeedChanged
+        self.attitude_changed = AttitudeChanged
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.running = False
+
+        # latest target, written by set_target and consumed by the control loop
+        self.pending = None
+        self.target = None
+        self.target_time = None
+        self.travelled = [0.0, 0.0, 0.0]
+        self.command = (0, 0, 0)
+        self.sent_time = 0.0
+
+        self.targets = 0
+        self.coalesced = 0
+        self.reached = 0
+        self.expired = 0
+        self.sent = 0
+        self.ticks = 0
+        self.overruns = 0
+
+    def start(self):
+        """
+        Start the piloting interface of the drone and the control loop
+        """
+        if self.running:
+            return
+        if not self.drone.start_piloting():
+            raise RuntimeError("The drone did not start its piloting interface")
+        self.stop_event.clear()
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, name="WildWings-Velocity-Control", daemon=True)
+        self.thread.start()
+        logger.info(f"Velocity control started at {self.rate:g} Hz")
+
+    def stop(self):
+        """
+        Stop the control loop and hover, returns the loop stats. Can be called more than once
+        """
+        if self.running:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+            self.running = False
+            self.drone.piloting(0, 0, 0, 0, 0)
+            self.drone.stop_piloting()
+            self.command = (0, 0, 0)
+        return self.stats()
+
+    def set_target(self, x, y, z):
+        """
+        Replace the target, picked up by the next tick of the loop
+        """
+        with self.lock:
+            if self.pending is not None:
+                # the previous target was never flown, the latest one wins
+                self.coalesced += 1
+            self.pending = (float(x), float(y), float(z), self.time())
+            self.targets += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "rate": self.rate,
+                "targets": self.targets,
+                "coalesced": self.coalesced,
+                "reached": self.reached,
+                "expired": self.expired,
+                "sent": self.sent,
+                "ticks": self.ticks,
+                "overruns": self.overruns,
+            }
+
+    def body_velocity(self):
+        """
+        Measured velocity (forward, right, up) in m/s, None until the drone reports it
+        """
+        try:
+            speed = self.drone.get_state(self.speed_changed)
+            yaw = self.drone.get_state(self.attitude_changed)["yaw"]
+        except (KeyError, RuntimeError):
+            return None
+        # NED speeds rotated into the body frame of the drone
+        north, east, down = speed["speedX"], speed["speedY"], speed["speedZ"]
+        return (
+            math.cos(yaw) * north + math.sin(yaw) * east,
+            -math.sin(yaw) * north + math.cos(yaw) * east,
+            -down,
+        )
+
+    def limit(self, value, previous, limit):
+        value = max(-limit, min(limit, value))
+        # slew rate limit, no lurch when the target jumps
+        return max(previous - self.max_step, min(previous + self.max_step, value))
+
+    def tick(self, now, dt):
+        with self.lock:
+            if self.pending is not None:
+                x, y, z, self.target_time = self.pending
+                self.target = (x, y, z)
+                self.pending = None
+                self.travelled = [0.0, 0.0, 0.0]
+            target = self.target
+            if target is not None and now - self.target_time > self.target_timeout:
+                self.target = target = None
+                self.expired += 1
+
+        # without speed feedback yet the target is only dropped once it expires
+        velocity = self.body_velocity() or (0.0, 0.0, 0.0)
+        for axis in range(3):
+            self.travelled[axis] += velocity[axis] * dt
+
+        roll, pitch, gaz = 0.0, 0.0, 0.0
+        if target is not None:
+            error = [target[axis] - self.travelled[axis] for axis in range(3)]
+            if math.hypot(error[0], error[1]) < self.tolerance and abs(error[2]) < self.tolerance:
+                with self.lock:
+                    if self.target is target:
+                        self.target = None
+                        self.reached += 1
+                error = [0.0, 0.0, 0.0]
+            # the derivative term is taken on the measured velocity: a new target doesn't kick the setpoints
+            pitch = self.kp * error[0] - self.kd * velocity[0]
+            roll = self.kp * error[1] - self.kd * velocity[1]
+            gaz = self.kp_z * error[2] - self.kd_z * velocity[2]
+
+        previous_roll, previous_pitch, previous_gaz = self.command
+        command = (
+            int(round(self.limit(roll, previous_roll, self.max_tilt))),
+            int(round(self.limit(pitch, previous_pitch, self.max_tilt))),
+            int(round(self.limit(gaz, previous_gaz, self.max_gaz))),
+        )
+        with self.lock:
+            self.ticks += 1
+            # an unchanged setpoint is only refreshed every other tick
+            if command == self.command and now - self.sent_time < 2.0 / self.rate:
+                return
+            self.command = command
+            self.sent_time = now
+            self.sent += 1
+        # the setpoint holds for a few ticks only: the drone hovers if the loop stalls
+        self.drone.piloting(command[0], command[1], 0, command[2], 3.0 / self.rate)
+
+    def loop(self):
+        period = 1.0 / self.rate
+        last = self.time()
+        deadline = last + period
+        while not self.wait(self.stop_event, max(0.0, deadline - self.time())):
+            now = self.time()
+            try:
+                self.tick(now, now - last)
+            except Exception as e:
+                logger.error(f"Velocity control tick failed: {e}")
+            last = now
+            deadline += period
+            if deadline < now:
+                # fixed rate: late ticks are dropped, not sent in a burst
+                with self.lock:
+                    self.overruns += 1
+                deadline = now + period
@@ -0,0 +1,175 @@
+# Long-lived mission worker for the wildwings service.
+# The tracking dependencies (torch, ultralytics, olympe, SoftwarePilot) and the YOLO model are
+# loaded once when the service starts instead of once per mission in a `conda run` subprocess.
+
+import os
+import logging
+import threading
+import time
+
+from startup import StartupReport
+
+logger = logging.getLogger("wildwings.worker")
+
+# run the inference in a dedicated process fed through shared memory instead of the service process
+INFERENCE_PROCESS = os.getenv("WILDWINGS_INFERENCE_PROCESS", "0") == "1"
+# fly the simulated Anafi of openpasslite (AnafiSimulator) instead of a real drone
+SIMULATOR = os.getenv("ANAFI_SIMULATOR", "0") == "1"
+
+
+class LogForwarder(logging.Handler):
+    """
+    Forward the mission log records to a callback as soon as they are emitted
+    """
+    def __init__(self, callback):
+        super().__init__(level=logging.INFO)
+        self.callback = callback
+
+    def emit(self, record):
+        try:
+            self.callback(record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+
+class MissionWorker:
+    """
+    Load the tracking stack once and run missions on a background thread
+    """
+    def __init__(self, log_callback):
+        self.log_callback = log_callback
+        self.controller = None
+        self.model = None
+        self.software_pilot = None
+        self.detector = None
+        self.load_time = None
+        self.load_error = None
+        # import times and warm-up state of the streaming, drone and model subsystems
+        self.startup = StartupReport(("streaming", "drone", "model"))
+        self.ready = threading.Event()
+        self.stop_event = threading.Event()
+        self.mission_thread = None
+        self.load_thread = None
+
+        logging.getLogger("wildwings.mission").addHandler(LogForwarder(log_callback))
+
+    def start_loading(self):
+        """
+        Import the tracking stack and load the model in the background so the HTTP API is up immediately
+        """
+        if self.load_thread is None:
+            self.load_thread = threading.Thread(target=self._load, name="WildWings-Loader", daemon=True)
+            self.load_thread.start()
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            if SIMULATOR:
+                # must replace olympe before the controller and SoftwarePilot import it
+                import AnafiSimulator
+                AnafiSimulator.install()
+
+            # frame pipeline first: it is the quickest to warm up
+            with self.startup.warming("streaming"):
+                self.startup.timed_import("cv2")
+                controller = self.startup.timed_import("controller")
+                controller.warm_up_stream()
+                self.controller = controller
+
+            with self.startup.warming("drone"):
+                self.startup.timed_import("olympe")
+                SoftwarePilot = self.startup.timed_import("SoftwarePilot").SoftwarePilot
+                self.software_pilot = SoftwarePilot()
+
+            with self.startup.warming("model"):
+                if INFERENCE_PROCESS:
+                    RemoteDetector = self.startup.timed_import("shm_ring").RemoteDetector
+                    self.detector = RemoteDetector()
+                else:
+                    if self.startup.timed_import("detectors").DETECTOR_BACKEND == "torch":
+                        self.startup.timed_import("torch")
+                        self.startup.timed_import("ultralytics")
+                    self.model = controller.load_model()
+
+            self.load_time = time.perf_counter() - start
+            logger.info(f"Tracking stack loaded in {self.load_time:.1f}s")
+            logger.info(f"Slowest imports: {self.startup.report()['imports'][:5]}")
+        except Exception as e:
+            self.load_error = str(e)
+            logger.error(f"Failed to load tracking stack: {e}")
+        finally:
+            self.ready.set()
+
+    @property
+    def is_running(self):
+        return self.mission_thread is not None and self.mission_thread.is_alive()
+
+    def start_mission(self, output_dir, on_finished=None, profile=None):
+        """
+        Run a mission on a background thread, the model loaded at startup is reused
+        with the detection profile of this mission
+        """
+        if self.is_running:
+            raise RuntimeError("Mission already running")
+        self.start_loading()
+        self.stop_event.clear()
+        self.mission_thread = threading.Thread(
+            target=self._run_mission,
+            args=(output_dir, on_finished, profile),
+            name="WildWings-Mission"
+        )
+        self.mission_thread.start()
+        return self.mission_thread
+
+    def _run_mission(self, output_dir, on_finished, profile):
+        error = None
+        try:
+            if not self.ready.is_set():
+                self.log_callback("Waiting for the tracking stack to load")
+                self.ready.wait()
+            if self.load_error is not None:
+                raise RuntimeError(f"Tracking stack unavailable: {self.load_error}")
+            if self.model is not None and profile is not None:
+                # fail before connecting to the drone if the model doesn't have the classes of the profile
+                self.model.check_profile(profile)
+
+            self.controller.run_mission(
+                output_dir,
+                self.model,
+                software_pilot=self.software_pilot,
+                stop_event=self.stop_event,
+                detector=self.detector,
+                profile=profile
+            )
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Mission failed: {error}")
+        finally:
+            if on_finished is not None:
+                on_finished(error)
+
+    def stop_mission(self, timeout=None):
+        """
+        Ask the running mission to stop, it lands the stream, recording and connection cleanly
+        """
+        self.stop_event.set()
+        if self.mission_thread is not None and timeout is not None:
+            self.mission_thread.join(timeout)
+
+    def close(self):
+        """
+        Stop the inference process and release its shared memory
+        """
+        if self.detector is not None:
+            self.detector.close()
+            self.detector = None
+
+    def status(self):
+        return {
+            "ready": self.ready.is_set() and self.load_error is None,
+            "load_time": self.load_time,
+            "load_error": self.load_error,
+            "subsystems": self.startup.checks(),
+            "mission_running": self.is_running,
+            "inference_process": self.detector.process.pid if self.detector is not None else None,
+        }
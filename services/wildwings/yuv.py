@@ -0,0 +1,185 @@
+# YUV-native preprocessing of the stream frames.
+# A YuvFrame wraps the I420/NV12 buffer of a frame instead of converting it to BGR: crops (ROI,
+# tiles) are views on the planes, and the detectors resize the planes straight to the model input
+# in preallocated buffers, so only the reduced image is converted to BGR. The whole frame is only
+# converted when an annotated evidence frame is drawn, by the evidence workers.
+#
+# Disabled with WILDWINGS_YUV_PREPROCESS=0 (the whole frame is converted to BGR first).
+
+import os
+
+import cv2
+import numpy as np
+
+YUV_PREPROCESS = os.getenv("WILDWINGS_YUV_PREPROCESS", "1") == "1"
+LETTERBOX_COLOR = 114 # gray of the YOLO letterbox padding
+
+
+def even(value):
+    return int(value) & ~1
+
+def cvt_color_flags():
+    """
+    OpenCV YUV to BGR conversion flag of the stream frame formats, keyed by olympe VDEF format. Keyed by
+    format name when the Parrot SDK isn't installed (offline replays), olympe is only imported here
+    """
+    try:
+        import olympe
+    except ImportError:
+        return {"I420": cv2.COLOR_YUV2BGR_I420, "NV12": cv2.COLOR_YUV2BGR_NV12}
+    return {olympe.VDEF_I420: cv2.COLOR_YUV2BGR_I420, olympe.VDEF_NV12: cv2.COLOR_YUV2BGR_NV12}
+
+def frame_format(cvt_flag):
+    """
+    Stream frame format of an OpenCV conversion flag, for frames that don't come from the stream
+    """
+    return next(frame_format for frame_format, flag in cvt_color_flags().items() if flag == cvt_flag)
+
+
+class YuvFrame:
+    """
+    I420 or NV12 frame (the (height * 3/2, width) array of VideoFrame.as_ndarray) and a window
+    (left, top, right, bottom) on it, in even pixels so it maps onto the half resolution chroma planes.
+    `shape` is the (height, width, 3) of the window, like the BGR image it stands for
+    """
+    def __init__(self, yuv, cvt_flag, height, width, window=None):
+        if cvt_flag not in (cv2.COLOR_YUV2BGR_I420, cv2.COLOR_YUV2BGR_NV12):
+            raise ValueError(f"Illegal YUV conversion flag {cvt_flag}")
+        self.yuv = yuv
+        self.cvt_flag = cvt_flag
+        self.height = height
+        self.width = width
+        self.window = window if window is not None else (0, 0, width, height)
+
+    @property
+    def shape(self):
+        left, top, right, bottom = self.window
+        return (bottom - top, right - left, 3)
+
+    def __getitem__(self, key):
+        """
+        Crop with frame[y1:y2, x1:x2], extended to even coordinates
+        """
+        rows, cols = key
+        left, top, right, bottom = self.window
+        height, width = bottom - top, right - left
+        y1, y2, _ = rows.indices(height)
+        x1, x2, _ = cols.indices(width)
+        window = (
+            left + even(x1), top + even(y1),
+            left + min(width, (x2 + 1) & ~1), top + min(height, (y2 + 1) & ~1),
+        )
+        return YuvFrame(self.yuv, self.cvt_flag, self.height, self.width, window)
+
+    def planes(self):
+        """
+        Views of the window on the planes: (Y, U, V) for I420, (Y, UV) for NV12 with UV (h/2, w/2, 2)
+        """
+        height, width = self.height, self.width
+        left, top, right, bottom = self.window
+        y = self.yuv[:height, :width][top:bottom, left:right]
+        chroma = (slice(top // 2, bottom // 2), slice(left // 2, right // 2))
+        if self.cvt_flag == cv2.COLOR_YUV2BGR_NV12:
+            uv = self.yuv[height:height + height // 2, :width].reshape(height // 2, width // 2, 2)
+            return y, uv[chroma]
+        u, v = i420_chroma(self.yuv, height, width)
+        return y, u[chroma], v[chroma]
+
+    def detach(self):
+        """
+        Copy the frame buffer, for the frames kept after the stream frame is released (evidence)
+        """
+        if self.window == (0, 0, self.width, self.height):
+            self.yuv = self.yuv[:self.height * 3 // 2].copy()
+        else:
+            self.yuv = pack(self.planes(), self.cvt_flag)
+            self.height, self.width = self.shape[:2]
+            self.window = (0, 0, self.width, self.height)
+        return self
+
+    def bgr(self):
+        """
+        Convert the window to a new BGR image
+        """
+        if self.window == (0, 0, self.width, self.height):
+            return cv2.cvtColor(self.yuv[:self.height * 3 // 2], self.cvt_flag)
+        return cv2.cvtColor(pack(self.planes(), self.cvt_flag), self.cvt_flag)
+
+
+def i420_chroma(buffer, height, width):
+    """
+    (U, V) planes of an I420 buffer, (height/2, width/2) each after the Y plane
+    """
+    flat = buffer.reshape(-1)
+    size = height * width
+    u = flat[size:size + size // 4].reshape(height // 2, width // 2)
+    v = flat[size + size // 4:size + size // 2].reshape(height // 2, width // 2)
+    return u, v
+
+def pack(planes, cvt_flag, out=None):
+    """
+    Copy plane views into one contiguous (height * 3/2, width) buffer of the same format
+    """
+    y = planes[0]
+    height, width = y.shape
+    if out is None:
+        out = np.empty((height * 3 // 2, width), dtype=np.uint8)
+    out[:height] = y
+    if cvt_flag == cv2.COLOR_YUV2BGR_NV12:
+        out[height:].reshape(height // 2, width // 2, 2)[:] = planes[1]
+    else:
+        u, v = i420_chroma(out, height, width)
+        u[:] = planes[1]
+        v[:] = planes[2]
+    return out
+
+
+class YuvLetterbox:
+    """
+    Resize YuvFrames to a model input on their planes and convert the reduced image only.
+    The buffers are allocated once per output size and reused, one inference at a time
+    """
+    def __init__(self, input_size):
+        self.input_size = input_size
+        self.buffers = {}
+
+    def _buffers(self, new_w, new_h, pad):
+        key = (new_w, new_h, pad)
+        if key not in self.buffers:
+            yuv = np.empty((new_h * 3 // 2, new_w), dtype=np.uint8)
+            bgr = np.empty((new_h, new_w, 3), dtype=np.uint8)
+            canvas = np.full((self.input_size, self.input_size, 3), LETTERBOX_COLOR, dtype=np.uint8) if pad else None
+            self.buffers[key] = (yuv, bgr, canvas)
+        return self.buffers[key]
+
+    def __call__(self, frame, pad=True, reuse=True):
+        """
+        Returns (image, scale, pad_x, pad_y): the window of `frame` fitted in input_size x input_size,
+        padded to a square if `pad`. With `reuse` the image is a shared buffer, overwritten by the next call
+        """
+        height, width = frame.shape[:2]
+        scale = min(self.input_size / height, self.input_size / width)
+        new_w, new_h = max(2, even(round(width * scale))), max(2, even(round(height * scale)))
+        yuv, bgr, canvas = self._buffers(new_w, new_h, pad) if reuse else (
+            np.empty((new_h * 3 // 2, new_w), dtype=np.uint8), None, None
+        )
+
+        planes = frame.planes()
+        interpolation = cv2.INTER_LINEAR
+        cv2.resize(planes[0], (new_w, new_h), dst=yuv[:new_h], interpolation=interpolation)
+        if frame.cvt_flag == cv2.COLOR_YUV2BGR_NV12:
+            cv2.resize(planes[1], (new_w // 2, new_h // 2), dst=yuv[new_h:].reshape(new_h // 2, new_w // 2, 2), interpolation=interpolation)
+        else:
+            u, v = i420_chroma(yuv, new_h, new_w)
+            cv2.resize(planes[1], (new_w // 2, new_h // 2), dst=u, interpolation=interpolation)
+            cv2.resize(planes[2], (new_w // 2, new_h // 2), dst=v, interpolation=interpolation)
+        bgr = cv2.cvtColor(yuv, frame.cvt_flag, dst=bgr)
+
+        if not pad:
+            return bgr, scale, 0, 0
+        pad_x, pad_y = (self.input_size - new_w) // 2, (self.input_size - new_h) // 2
+        if canvas is None:
+            canvas = np.full((self.input_size, self.input_size, 3), LETTERBOX_COLOR, dtype=np.uint8)
+        # the padding of a reused canvas is never written, only the image area
+        canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = bgr
+        return canvas, scale, pad_x, pad_y